@@ -0,0 +1,151 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import DecimalField, F, FloatField, Value
+from django.db.models.functions import Cast, Coalesce, ExtractMonth, ExtractYear
+
+from .dates import filter_days
+from .models import Trade
+
+try:
+    import numpy as np
+except ImportError:  # NumPy اختیاری است؛ فقط تحلیل معاملات به آن نیاز دارد
+    np = None
+
+
+# ستون‌هایی که با یک پرس‌وجوی values_list خوانده می‌شوند؛ مبالغ در خود دیتابیس به float تبدیل
+# می‌شوند تا برای یک میلیون ردیف، یک میلیون شیء Decimal ساخته نشود
+_ZERO = Value(0, output_field=DecimalField(max_digits=10, decimal_places=2))
+
+
+def _amount(field):
+    return Cast(Coalesce(field, _ZERO), FloatField())
+
+
+def load_closed_trades(trading_account, start_date=None, end_date=None):
+    """
+    معاملات بسته حساب (بر اساس تاریخ خروج) را با یک پرس‌وجو به صورت آرایه‌های NumPy برمی‌گرداند:
+    asset_ids, symbols, months (year * 12 + month - 1), gross, broker_commission, trader_commission
+    """
+    if np is None:
+        raise ImproperlyConfigured("Trade analytics require NumPy (pip install numpy).")
+
+    trades = Trade.objects.filter(trading_account=trading_account, status=Trade.CLOSED, exit_date__isnull=False)
+    trades = filter_days(trades, 'exit_date', start_date, end_date)
+
+    rows = list(trades.order_by('exit_date', 'id').values_list(
+        'asset_id',
+        'asset__symbol',
+        ExtractYear('exit_date') * 12 + ExtractMonth('exit_date') - 1,
+        _amount(F('gross_profit_or_loss')),
+        _amount(F('broker_commission')),
+        _amount(F('trader_commission')),
+    ))
+    if not rows:
+        return (np.array([], dtype=np.int64), np.array([], dtype=object), np.array([], dtype=np.int64),
+                np.array([], dtype=np.float64), np.array([], dtype=np.float64), np.array([], dtype=np.float64))
+
+    asset_ids, symbols, months, gross, broker, trader = zip(*rows)
+    return (
+        np.fromiter(asset_ids, dtype=np.int64, count=len(rows)),
+        np.array(symbols, dtype=object),
+        np.fromiter(months, dtype=np.int64, count=len(rows)),
+        np.fromiter(gross, dtype=np.float64, count=len(rows)),
+        np.fromiter(broker, dtype=np.float64, count=len(rows)),
+        np.fromiter(trader, dtype=np.float64, count=len(rows)),
+    )
+
+
+def _round(value, digits=2):
+    return round(float(value), digits)
+
+
+def _summary(net, gross, commissions):
+    """
+    شاخص‌های کلی عملکرد برای آرایه سود/زیان خالص معاملات (به ترتیب تاریخ خروج).
+    """
+    count = net.size
+    wins = net > 0
+    losses = net < 0
+    total_won = net[wins].sum()
+    total_lost = -net[losses].sum()
+
+    # افت سرمایه: بیشترین فاصله سود تجمعی از بالاترین سقف قبلی (سقف اولیه صفر است)
+    cumulative = np.cumsum(net)
+    peaks = np.maximum.accumulate(np.concatenate(([0.0], cumulative)))[1:]
+    max_drawdown = (peaks - cumulative).max() if count else 0.0
+
+    return {
+        'trades': int(count),
+        'wins': int(wins.sum()),
+        'losses': int(losses.sum()),
+        'win_rate': _round(wins.sum() / count, 4) if count else None,
+        'average_win': _round(net[wins].mean()) if wins.any() else None,
+        'average_loss': _round(net[losses].mean()) if losses.any() else None,
+        'expectancy': _round(net.mean()) if count else None,
+        'profit_factor': _round(total_won / total_lost, 4) if total_lost else None,
+        'max_drawdown': _round(max_drawdown),
+        'gross_profit_or_loss': _round(gross.sum()),
+        'commissions': _round(commissions.sum()),
+        'net_profit_or_loss': _round(net.sum()),
+    }
+
+
+def _breakdown(keys, net, gross, commissions):
+    """
+    جمع‌ها به تفکیک کلید عددی (شناسه دارایی یا ماه)، بدون حلقه پایتونی روی معاملات.
+    برای هر کلید (کلید، اندیس اولین معامله آن، جمع‌ها) برگردانده می‌شود؛ اندیس برای خواندن برچسب (نماد) است.
+    """
+    labels, first_index, groups = np.unique(keys, return_index=True, return_inverse=True)
+    size = labels.size
+    counts = np.bincount(groups, minlength=size)
+    wins = np.bincount(groups, weights=net > 0, minlength=size)
+    net_sums = np.bincount(groups, weights=net, minlength=size)
+    gross_sums = np.bincount(groups, weights=gross, minlength=size)
+    commission_sums = np.bincount(groups, weights=commissions, minlength=size)
+    return [
+        (int(labels[i]), int(first_index[i]), {
+            'trades': int(counts[i]),
+            'win_rate': _round(wins[i] / counts[i], 4),
+            'gross_profit_or_loss': _round(gross_sums[i]),
+            'commissions': _round(commission_sums[i]),
+            'net_profit_or_loss': _round(net_sums[i]),
+        })
+        for i in range(size)
+    ]
+
+
+def _month_label(month_index):
+    year, month = divmod(month_index, 12)
+    return f"{year:04d}-{month + 1:02d}"
+
+
+def analyze_trades(asset_ids, symbols, months, gross, broker_commission, trader_commission):
+    """
+    تحلیل برداری آرایه‌های معاملات بسته؛ خروجی summary و تفکیک بر اساس نماد و ماه است.
+    """
+    commissions = broker_commission + trader_commission
+    net = gross - commissions
+
+    # گروه‌بندی روی شناسه عددی دارایی بسیار سریع‌تر از مرتب‌سازی یک میلیون رشته است
+    return {
+        'summary': _summary(net, gross, commissions),
+        'by_asset': [
+            {'asset': symbols[first], **totals}
+            for _, first, totals in _breakdown(asset_ids, net, gross, commissions)
+        ],
+        'by_month': [
+            {'month': _month_label(month), **totals}
+            for month, _, totals in _breakdown(months, net, gross, commissions)
+        ],
+    }
+
+
+def generate_trade_analytics(trading_account, start_date=None, end_date=None):
+    """
+    نرخ برد، میانگین سود و زیان، امید ریاضی، profit factor، بیشترین افت سرمایه و تفکیک ماهانه و
+    به ازای هر نماد برای معاملات بسته یک حساب معاملاتی (کمیسیون‌ها از سود ناخالص کسر می‌شوند).
+    """
+    result = analyze_trades(*load_closed_trades(trading_account, start_date, end_date))
+    result['trading_account_id'] = trading_account.id
+    result['start_date'] = start_date
+    result['end_date'] = end_date
+    return result
@@ -0,0 +1,22 @@
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+
+def day_start(day):
+    """
+    ابتدای روز (نیمه‌شب به وقت منطقه زمانی فعال) به صورت datetime آگاه از منطقه زمانی.
+    """
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def filter_days(queryset, field, start_date=None, end_date=None):
+    """
+    بازه روزهای start_date تا end_date (هر دو شامل) را روی ستون datetime اعمال می‌کند.
+    شرط روی خود ستون است (نه field__date) تا ایندکس‌های آن ستون قابل استفاده بمانند.
+    """
+    if start_date is not None:
+        queryset = queryset.filter(**{f'{field}__gte': day_start(start_date)})
+    if end_date is not None:
+        queryset = queryset.filter(**{f'{field}__lt': day_start(end_date + timedelta(days=1))})
+    return queryset
@@ -0,0 +1,195 @@
+import csv
+import json
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Exists, Min, OuterRef
+from django.utils import timezone
+
+from .dates import filter_days
+from .models import JournalEntry, JournalEntryLine, Trade
+
+
+# خروجی‌ها با cursor سمت سرور و در دسته‌های CHUNK_SIZE تایی خوانده می‌شوند؛
+# در هیچ لحظه‌ای بیش از یک دسته در حافظه نیست
+CHUNK_SIZE = 2000
+
+JOURNAL = 'journal'
+TRADES = 'trades'
+EXPORT_KINDS = [JOURNAL, TRADES]
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+EXPORT_FORMATS = {
+    CSV: 'text/csv',
+    NDJSON: 'application/x-ndjson',
+}
+
+ENTRY_FIELDS = ['entry_id', 'entry_date', 'entry_type', 'description', 'trade_id', 'asset_lot_id']
+LINE_FIELDS = ['line_id', 'account_number', 'account_name', 'debit', 'credit']
+JOURNAL_FIELDS = ENTRY_FIELDS + LINE_FIELDS
+TRADE_FIELDS = [
+    'trade_id', 'asset', 'status', 'position_side', 'quantity', 'entry_price', 'entry_date',
+    'exit_price', 'exit_date', 'gross_profit_or_loss', 'broker_commission', 'trader_commission',
+]
+
+
+def iter_journal_lines(trading_account, start_date=None, end_date=None, chunk_size=CHUNK_SIZE):
+    """
+    آرتیکل‌های حساب معاملاتی را به ترتیب (تاریخ سند، شناسه سند، شناسه آرتیکل) به صورت
+    tuple هایی با ترتیب JOURNAL_FIELDS برمی‌گرداند.
+    """
+    lines = JournalEntryLine.objects.filter(account__trading_account=trading_account)
+    if start_date is not None:
+        lines = lines.filter(journal_entry__entry_date__gte=start_date)
+    if end_date is not None:
+        lines = lines.filter(journal_entry__entry_date__lte=end_date)
+    return lines.order_by('journal_entry__entry_date', 'journal_entry_id', 'id').values_list(
+        'journal_entry_id', 'journal_entry__entry_date', 'journal_entry__entry_type', 'journal_entry__description',
+        'journal_entry__trade_id', 'journal_entry__asset_lot_id',
+        'id', 'account__account_number', 'account__account_name', 'debit_amount', 'credit_amount'
+    ).iterator(chunk_size=chunk_size)
+
+
+def _group_lines(rows, entry_fields, line_fields):
+    """
+    ردیف‌های آرتیکل (مرتب بر اساس سند) را به یک dict به ازای هر سند با لیست آرتیکل‌هایش (lines) تبدیل می‌کند.
+    آرتیکل‌های هر سند پشت سر هم خوانده می‌شوند، پس فقط یک سند در حافظه نگه داشته می‌شود.
+    """
+    entry = None
+    for row in rows:
+        if entry is None or entry['entry_id'] != row[0]:
+            if entry is not None:
+                yield entry
+            entry = dict(zip(entry_fields, row[:len(entry_fields)]))
+            entry['lines'] = []
+        entry['lines'].append(dict(zip(line_fields, row[len(entry_fields):])))
+    if entry is not None:
+        yield entry
+
+
+def iter_journal_entries(trading_account, start_date=None, end_date=None, chunk_size=CHUNK_SIZE):
+    """
+    اسناد حساب معاملاتی را هر کدام به صورت یک dict با لیست آرتیکل‌هایش (lines) برمی‌گرداند.
+    """
+    return _group_lines(iter_journal_lines(trading_account, start_date, end_date, chunk_size), ENTRY_FIELDS, LINE_FIELDS)
+
+
+SYNC_ENTRY_FIELDS = ENTRY_FIELDS + ['posted_by_id', 'reversal_of_id']
+SYNC_LINE_FIELDS = ['line_id', 'account_id', 'trading_account_id', 'account_number', 'debit', 'credit']
+
+
+def ledger_sync_watermark(lag=None):
+    """
+    شناسه اولین سندی که هنوز «تازه» است (کمتر از lag ثانیه از درجش گذشته) یا None اگر چنین سندی نیست.
+    شناسه‌ها هنگام INSERT گرفته می‌شوند نه هنگام commit؛ تراکنشی که شناسه 10 را گرفته ممکن است بعد از
+    تراکنش شناسه 11 commit شود و مصرف‌کننده‌ای که since_id=11 را نگه داشته، سند 10 را هرگز نبیند.
+    با توقف پیش از اولین سند تازه، هر شناسه‌ای که می‌تواند هنوز در تراکنشی باز باشد ارسال نمی‌شود
+    (سندهای بعدی هم دیرتر درج شده‌اند، پس آن‌ها هم تازه‌اند). فرض باقیمانده: هیچ تراکنش ثبت سندی
+    بیش از lag ثانیه باز نمی‌ماند؛ تراکنش طولانی‌تر از آن همچنان می‌تواند از همگام‌سازی جا بماند.
+    """
+    if lag is None:
+        lag = getattr(settings, 'LEDGER_SYNC_LAG_SECONDS', 60)
+    if lag <= 0:
+        return None
+    cutoff = timezone.now() - timedelta(seconds=lag)
+    return JournalEntry.objects.filter(created_at__gt=cutoff).aggregate(first=Min('id'))['first']
+
+
+def iter_ledger_sync(since_id=None, trading_account_id=None, chunk_size=CHUNK_SIZE, lag=None):
+    """
+    همه اسناد (یا اسنادی که حداقل یک آرتیکل در trading_account_id دارند) با شناسه بیشتر از since_id را
+    به ترتیب شناسه و هر کدام با همه آرتیکل‌هایش برمی‌گرداند؛ برای همگام‌سازی سیستم‌های بیرونی.
+    آرتیکل‌ها با cursor سمت سرور خوانده می‌شوند، پس یک همگام‌سازی کامل هم با حافظه ثابت اجرا می‌شود.
+    مصرف‌کننده آخرین entry_id دریافتی را به عنوان since_id درخواست بعدی نگه می‌دارد.
+    اسناد از ledger_sync_watermark(lag) به بعد در این دور ارسال نمی‌شوند و در دور بعد می‌آیند.
+    """
+    lines = JournalEntryLine.objects.all()
+    if since_id is not None:
+        lines = lines.filter(journal_entry_id__gt=since_id)
+    watermark = ledger_sync_watermark(lag)
+    if watermark is not None:
+        lines = lines.filter(journal_entry_id__lt=watermark)
+    if trading_account_id is not None:
+        # سند کامل برگردانده می‌شود، حتی آرتیکل‌هایی که (مثلا در انتقال) به حساب دیگری تعلق دارند
+        lines = lines.filter(Exists(JournalEntryLine.objects.filter(
+            journal_entry_id=OuterRef('journal_entry_id'), account__trading_account_id=trading_account_id
+        )))
+    rows = lines.order_by('journal_entry_id', 'id').values_list(
+        'journal_entry_id', 'journal_entry__entry_date', 'journal_entry__entry_type', 'journal_entry__description',
+        'journal_entry__trade_id', 'journal_entry__asset_lot_id', 'journal_entry__posted_by_id',
+        'journal_entry__reversal_of_id',
+        'id', 'account_id', 'account__trading_account_id', 'account__account_number', 'debit_amount', 'credit_amount'
+    ).iterator(chunk_size=chunk_size)
+    return _group_lines(rows, SYNC_ENTRY_FIELDS, SYNC_LINE_FIELDS)
+
+
+def iter_trades(trading_account, start_date=None, end_date=None, chunk_size=CHUNK_SIZE):
+    """
+    معاملات حساب معاملاتی (بر اساس تاریخ ورود) را به صورت tuple هایی با ترتیب TRADE_FIELDS برمی‌گرداند.
+    """
+    trades = Trade.objects.filter(trading_account=trading_account)
+    # بازه روی خود ستون entry_date اعمال می‌شود تا ایندکس trade_account_status_idx قابل استفاده بماند
+    trades = filter_days(trades, 'entry_date', start_date, end_date)
+    return trades.order_by('entry_date', 'id').values_list(
+        'id', 'asset__symbol', 'status', 'position_side', 'quantity', 'entry_price', 'entry_date',
+        'exit_price', 'exit_date', 'gross_profit_or_loss', 'broker_commission', 'trader_commission'
+    ).iterator(chunk_size=chunk_size)
+
+
+class _Echo:
+    """
+    فایل شبه‌نوشتنی که csv.writer به جای نوشتن، همان خط را برمی‌گرداند.
+    """
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return '' if value is None else value
+
+
+def stream_csv(header, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow([_csv_value(value) for value in row])
+
+
+def stream_ndjson(objects):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    for obj in objects:
+        yield encoder.encode(obj) + '\n'
+
+
+def stream_export(kind, export_format, trading_account, start_date=None, end_date=None, chunk_size=CHUNK_SIZE):
+    """
+    خروجی kind (journal / trades) را با فرمت csv یا ndjson به صورت جریانی از رشته‌ها برمی‌گرداند.
+    CSV دفتر روزنامه یک ردیف به ازای هر آرتیکل دارد و NDJSON یک شیء به ازای هر سند.
+    """
+    if kind not in EXPORT_KINDS:
+        raise ValueError(f"Unknown export kind: {kind}")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+
+    if kind == JOURNAL:
+        if export_format == CSV:
+            return stream_csv(JOURNAL_FIELDS, iter_journal_lines(trading_account, start_date, end_date, chunk_size))
+        return stream_ndjson(iter_journal_entries(trading_account, start_date, end_date, chunk_size))
+
+    trades = iter_trades(trading_account, start_date, end_date, chunk_size)
+    if export_format == CSV:
+        return stream_csv(TRADE_FIELDS, trades)
+    return stream_ndjson(dict(zip(TRADE_FIELDS, row)) for row in trades)
+
+
+def export_filename(kind, export_format, trading_account, start_date=None, end_date=None):
+    parts = [kind, str(trading_account.pk)]
+    if start_date is not None:
+        parts.append(start_date.isoformat())
+    if end_date is not None:
+        parts.append(end_date.isoformat())
+    return f"{'_'.join(parts)}.{export_format}"
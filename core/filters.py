@@ -0,0 +1,52 @@
+from datetime import date
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+def parse_bool(value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(value)
+
+
+def choice_parser(choices):
+    def parse(value):
+        if value not in choices:
+            raise ValueError(value)
+        return value
+    return parse
+
+
+class QueryParamFilterBackend(BaseFilterBackend):
+    """
+    فیلترهای ساده query string که هر ViewSet در filter_fields تعریف می‌کند:
+    {param: (lookup, parser)}؛ lookup یک lookup جنگو است یا تابعی (queryset, value) -> queryset.
+    فیلترهای اصلی روی ستون‌های ایندکس شده‌اند؛ فیلتر روی ستون بدون ایندکس فقط برای جدول‌های کوچک
+    (مثل سرفصل‌ها) تعریف می‌شود که در عمل همراه فیلتر ایندکس‌دار حساب معاملاتی استفاده می‌شوند.
+    مقدار نامعتبر خطای 400 می‌دهد.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        for param, (lookup, parse) in getattr(view, 'filter_fields', {}).items():
+            raw = request.query_params.get(param)
+            if raw in (None, ''):
+                continue
+            try:
+                value = parse(raw)
+            except (TypeError, ValueError):
+                raise ValidationError({param: f"Invalid value: {raw}"})
+            queryset = lookup(queryset, value) if callable(lookup) else queryset.filter(**{lookup: value})
+        return queryset
+
+
+def date_range_fields(lookup):
+    """
+    فیلترهای start_date و end_date (شامل) روی یک ستون تاریخ.
+    """
+    return {
+        'start_date': (f'{lookup}__gte', date.fromisoformat),
+        'end_date': (f'{lookup}__lte', date.fromisoformat),
+    }
@@ -0,0 +1,108 @@
+from datetime import date, datetime
+
+from django.db.models import Exists, F, OuterRef, Prefetch, Q
+
+from .dates import filter_days
+from .models import JournalEntry, JournalEntryLine, Trade
+
+
+# صفحه‌بندی keyset: به جای OFFSET، هر صفحه از جایی که صفحه قبل تمام شد ادامه می‌دهد
+# (WHERE (entry_date, id) < cursor)، پس هزینه صفحه N با صفحه اول برابر است
+HISTORY_PAGE_SIZE = 50
+CURSOR_SEPARATOR = '~'
+
+
+def encode_cursor(value, pk):
+    """
+    مکان نما (cursor) آخرین ردیف یک صفحه را به صورت رشته '<تاریخ>~<شناسه>' می‌سازد.
+    """
+    return f"{value.isoformat() if value is not None else ''}{CURSOR_SEPARATOR}{pk}"
+
+
+def decode_cursor(cursor, parse_value):
+    """
+    رشته cursor را به (مقدار، شناسه) برمی‌گرداند؛ در صورت نامعتبر بودن ValueError می‌دهد.
+    """
+    value, separator, pk = cursor.rpartition(CURSOR_SEPARATOR)
+    if not separator:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return (parse_value(value) if value else None), int(pk)
+
+
+def _line_amount_filter(min_amount, max_amount):
+    # در هر آرتیکل فقط یکی از بدهکار/بستانکار مقدار دارد؛ مبلغ آرتیکل همان مقدار غیر صفر است
+    conditions = Q()
+    for column in ('debit_amount', 'credit_amount'):
+        condition = Q(**{f'{column}__gt': 0})
+        if min_amount is not None:
+            condition &= Q(**{f'{column}__gte': min_amount})
+        if max_amount is not None:
+            condition &= Q(**{f'{column}__lte': max_amount})
+        conditions |= condition
+    return conditions
+
+
+def journal_entry_page(user, cursor=None, page_size=HISTORY_PAGE_SIZE, trading_account=None, account=None,
+                       start_date=None, end_date=None, min_amount=None, max_amount=None, entry_type=None):
+    """
+    یک صفحه از اسناد کاربر (جدیدترین اول، بر اساس (entry_date, id)) به همراه cursor صفحه بعد.
+    فیلتر حساب و مبلغ روی آرتیکل‌ها اعمال می‌شود: سندی برگردانده می‌شود که حداقل یک آرتیکل منطبق داشته باشد.
+    تعداد پرس‌وجوها ثابت است (اسناد + آرتیکل‌ها)، مستقل از شماره صفحه و حجم تاریخچه.
+    """
+    lines = JournalEntryLine.objects.filter(journal_entry=OuterRef('pk'), account__trading_account__user=user)
+    if trading_account is not None:
+        lines = lines.filter(account__trading_account=trading_account)
+    if account is not None:
+        lines = lines.filter(account=account)
+    if min_amount is not None or max_amount is not None:
+        lines = lines.filter(_line_amount_filter(min_amount, max_amount))
+
+    entries = JournalEntry.objects.filter(Exists(lines))
+    if start_date is not None:
+        entries = entries.filter(entry_date__gte=start_date)
+    if end_date is not None:
+        entries = entries.filter(entry_date__lte=end_date)
+    if entry_type:
+        entries = entries.filter(entry_type=entry_type)
+    if cursor:
+        last_date, last_id = decode_cursor(cursor, date.fromisoformat)
+        entries = entries.filter(Q(entry_date__lt=last_date) | Q(entry_date=last_date, id__lt=last_id))
+
+    entries = list(
+        entries.order_by('-entry_date', '-id').select_related('posted_by').prefetch_related(
+            Prefetch('journalentryline_set', queryset=JournalEntryLine.objects.select_related('account').order_by('id'))
+        )[:page_size + 1]
+    )
+    next_cursor = None
+    if len(entries) > page_size:
+        entries = entries[:page_size]
+        next_cursor = encode_cursor(entries[-1].entry_date, entries[-1].id)
+    return entries, next_cursor
+
+
+def trade_page(user, cursor=None, page_size=HISTORY_PAGE_SIZE, trading_account=None, start_date=None, end_date=None):
+    """
+    یک صفحه از معاملات کاربر (جدیدترین ورود اول، بر اساس (entry_date, id)) به همراه cursor صفحه بعد.
+    معاملات بدون تاریخ ورود در انتهای فهرست می‌آیند.
+    """
+    trades = Trade.objects.filter(trading_account__user=user)
+    if trading_account is not None:
+        trades = trades.filter(trading_account=trading_account)
+    trades = filter_days(trades, 'entry_date', start_date, end_date)
+    if cursor:
+        last_date, last_id = decode_cursor(cursor, datetime.fromisoformat)
+        if last_date is None:
+            trades = trades.filter(entry_date__isnull=True, id__lt=last_id)
+        else:
+            trades = trades.filter(
+                Q(entry_date__lt=last_date) | Q(entry_date=last_date, id__lt=last_id) | Q(entry_date__isnull=True)
+            )
+
+    trades = list(
+        trades.order_by(F('entry_date').desc(nulls_last=True), '-id').select_related('asset', 'trading_account')[:page_size + 1]
+    )
+    next_cursor = None
+    if len(trades) > page_size:
+        trades = trades[:page_size]
+        next_cursor = encode_cursor(trades[-1].entry_date, trades[-1].id)
+    return trades, next_cursor
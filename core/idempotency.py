@@ -0,0 +1,91 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(request):
+    """
+    اثر انگشت درخواست (متد، مسیر و بدنه)؛ یک کلید فقط برای تکرار همان درخواست معتبر است.
+    """
+    payload = json.dumps([request.method, request.path, request.data], sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _replay(stored, fingerprint):
+    if stored.request_fingerprint != fingerprint:
+        return Response(
+            {'error': f"{IDEMPOTENCY_HEADER} was already used for a different request."},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    return Response(stored.response_body, status=stored.response_status, headers={REPLAYED_HEADER: 'true'})
+
+
+def idempotent(view_method):
+    """
+    دکوراتور اکشن‌های مالی viewset ها: اگر درخواست هدر Idempotency-Key داشته باشد، اکشن و ذخیره پاسخ آن
+    در یک تراکنش اجرا می‌شوند و تکرار درخواست با همان کلید، پاسخ ذخیره شده را بدون دست زدن به دفتر برمی‌گرداند.
+    فقط پاسخ‌های موفق (2xx) ذخیره می‌شوند؛ درخواست ناموفق چیزی ثبت نکرده و تکرار آن بی‌خطر است.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = request_fingerprint(request)
+        stored = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+        if stored is not None:
+            return _replay(stored, fingerprint)
+
+        try:
+            with transaction.atomic():
+                response = view_method(self, request, *args, **kwargs)
+                if status.is_success(response.status_code):
+                    IdempotencyKey.objects.create(
+                        user=request.user,
+                        key=key,
+                        request_fingerprint=fingerprint,
+                        response_status=response.status_code,
+                        # پاسخ همان‌طور که JSONRenderer آن را می‌فرستد ذخیره می‌شود (Decimal، تاریخ، ...)
+                        response_body=json.loads(JSONRenderer().render(response.data) or 'null'),
+                    )
+        except IntegrityError:
+            # درخواست همزمان دیگری با همین کلید زودتر commit شد؛ ثبت این درخواست همراه با تراکنش rollback شده است
+            stored = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+            if stored is None:
+                raise
+            return _replay(stored, fingerprint)
+        return response
+
+    return wrapper
+
+
+def prune_idempotency_keys(older_than=None):
+    """
+    کلیدهای قدیمی‌تر از IDEMPOTENCY_KEY_RETENTION_DAYS را حذف و تعداد آن‌ها را برمی‌گرداند.
+    """
+    if older_than is None:
+        older_than = timedelta(days=getattr(settings, 'IDEMPOTENCY_KEY_RETENTION_DAYS', 7))
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=timezone.now() - older_than).delete()
+    return deleted
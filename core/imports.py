@@ -0,0 +1,357 @@
+import csv
+import json
+import os
+from collections import namedtuple
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from .lots import COST_PRECISION, InsufficientQuantity, LotQueue
+from .models import (
+    Asset, AssetLot, AccountBalance, ChartOfAccount, ImportCheckpoint, JournalEntry, JournalEntryLine,
+    LotConsumption, TradingAccount, REVENUE, EXPENSE
+)
+from .services import _money, get_account, get_chart_of_accounts, get_or_create_account, lock_trading_accounts, post_entries
+
+
+# هر دسته در یک تراکنش ثبت می‌شود (یک bulk insert برای دسته‌ها، اسناد و آرتیکل‌ها)؛
+# در هیچ لحظه‌ای بیش از یک دسته از فایل در حافظه نیست
+BATCH_SIZE = 500
+
+BUY = 'BUY'
+SELL = 'SELL'
+DEPOSIT = 'DEPOSIT'
+WITHDRAWAL = 'WITHDRAWAL'
+EVENT_TYPES = [BUY, SELL, DEPOSIT, WITHDRAWAL]
+
+CSV = 'csv'
+JSONL = 'jsonl'
+IMPORT_FORMATS = {'.csv': CSV, '.jsonl': JSONL, '.ndjson': JSONL}
+
+# ستون‌های فایل: account شناسه حساب معاملاتی است؛ asset (نماد اسپات) و quantity فقط برای خرید و فروش لازم‌اند.
+# amount برای خرید هزینه کل، برای فروش مبلغ فروش و برای واریز/برداشت مبلغ نقد (دلار) است.
+FILL_FIELDS = ['account', 'type', 'asset', 'quantity', 'amount', 'date', 'description']
+
+Fill = namedtuple('Fill', ['line_number', 'trading_account_id', 'event_type', 'asset', 'quantity', 'amount', 'entry_date', 'description'])
+
+
+class FillImportError(ValueError):
+    def __init__(self, line_number, message):
+        self.line_number = line_number
+        super().__init__(f"Line {line_number}: {message}")
+
+
+def detect_format(path):
+    file_format = IMPORT_FORMATS.get(os.path.splitext(path)[1].lower())
+    if file_format is None:
+        raise ValueError(f"Cannot detect the format of {path}; expected one of {', '.join(IMPORT_FORMATS)}.")
+    return file_format
+
+
+def iter_raw_rows(path, file_format=None):
+    """
+    رکوردهای فایل را یکی یکی به صورت (شماره خط، dict) می‌خواند؛ خطوط خالی JSONL نادیده گرفته می‌شوند.
+    """
+    file_format = file_format or detect_format(path)
+    with open(path, newline='', encoding='utf-8') as handle:
+        if file_format == CSV:
+            reader = csv.DictReader(handle)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line_number, line in enumerate(handle, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise FillImportError(line_number, f"invalid JSON ({e.msg})")
+            if not isinstance(row, dict):
+                raise FillImportError(line_number, "expected a JSON object")
+            yield line_number, row
+
+
+def _parse_date(value):
+    value = str(value).strip()
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        # برخی صرافی‌ها زمان کامل (ISO 8601) صادر می‌کنند؛ فقط روز آن برای سند لازم است
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).date()
+
+
+def _parse_decimal(row, name, required=True):
+    value = row.get(name)
+    if value in (None, ''):
+        if required:
+            raise ValueError(f"'{name}' is required")
+        return None
+    value = Decimal(str(value))
+    if not value.is_finite() or value <= 0:
+        raise ValueError(f"'{name}' must be a positive number")
+    return value
+
+
+def parse_fill(line_number, row):
+    """
+    یک رکورد خام را به Fill تبدیل می‌کند؛ در صورت نامعتبر بودن FillImportError با شماره خط می‌دهد.
+    """
+    try:
+        event_type = str(row.get('type') or '').strip().upper()
+        if event_type not in EVENT_TYPES:
+            raise ValueError(f"unknown type '{row.get('type')}', expected one of {', '.join(EVENT_TYPES)}")
+        is_trade = event_type in (BUY, SELL)
+        asset = str(row.get('asset') or '').strip()
+        if is_trade and not asset:
+            raise ValueError("'asset' is required for spot buys and sells")
+        if not row.get('date'):
+            raise ValueError("'date' is required")
+        return Fill(
+            line_number=line_number,
+            trading_account_id=int(row.get('account')),
+            event_type=event_type,
+            asset=asset if is_trade else None,
+            quantity=_parse_decimal(row, 'quantity', required=is_trade) if is_trade else None,
+            amount=_parse_decimal(row, 'amount'),
+            entry_date=_parse_date(row['date']),
+            description=str(row.get('description') or ''),
+        )
+    except (TypeError, ValueError, InvalidOperation) as e:
+        raise FillImportError(line_number, str(e) or repr(e))
+
+
+class _BatchPoster:
+    """
+    یک دسته Fill را با همان سندهایی که make_deposit / make_withdrawal / execute_spot_buy / execute_spot_sell
+    صادر می‌کنند ثبت می‌کند، با این تفاوت که تاریخ سند تاریخ رکورد است و همه نوشتن‌ها گروهی انجام می‌شوند.
+    موجودی نقد و صف FIFO هر (حساب، دارایی) یک بار برای دسته خوانده و سپس در حافظه به‌روز می‌شوند.
+    """
+
+    def __init__(self, fills, user=None):
+        self.fills = fills
+        self.user = user
+        self.entries = []
+        self.consumptions = []  # (اندیس سند، Consumption ها)
+        self.new_lots = []
+        self.existing_lot_remaining = {}
+
+    def _load(self):
+        fills = self.fills
+        trading_account_ids = {fill.trading_account_id for fill in fills}
+        self.trading_accounts = TradingAccount.objects.in_bulk(trading_account_ids)
+        symbols = {fill.asset for fill in fills if fill.asset}
+        # نماد یکتا نیست؛ در صورت تکرار قدیمی‌ترین دارایی اسپات انتخاب می‌شود
+        self.assets = {
+            asset.symbol: asset
+            for asset in Asset.objects.filter(symbol__in=symbols, asset_type=Asset.SPOT).order_by('-id')
+        }
+        for fill in fills:
+            if fill.trading_account_id not in self.trading_accounts:
+                raise FillImportError(fill.line_number, f"trading account {fill.trading_account_id} does not exist")
+            if fill.asset and fill.asset not in self.assets:
+                raise FillImportError(fill.line_number, f"unknown spot asset '{fill.asset}'")
+
+        lock_trading_accounts(*self.trading_accounts.values())
+        # سرفصل‌ها یک بار برای دسته خوانده می‌شوند؛ سرفصل‌های سود/زیانی که دسته می‌سازد فقط در همین نسخه اضافه می‌شوند
+        self.charts = {
+            trading_account_id: dict(get_chart_of_accounts(trading_account))
+            for trading_account_id, trading_account in self.trading_accounts.items()
+        }
+        cash_account_ids = {
+            self.charts[trading_account_id]['1010'].id: trading_account_id
+            for trading_account_id in self.trading_accounts
+            if '1010' in self.charts[trading_account_id]
+        }
+        self.cash = dict.fromkeys(self.trading_accounts, Decimal('0.00'))
+        for account_id, debit, credit in AccountBalance.objects.filter(account_id__in=cash_account_ids).values_list(
+            'account_id', 'debit_total', 'credit_total'
+        ):
+            self.cash[cash_account_ids[account_id]] = debit - credit
+        self.queues = {}
+
+    def _account(self, fill, account_number):
+        try:
+            return get_account(
+                self.trading_accounts[fill.trading_account_id], account_number, self.charts[fill.trading_account_id]
+            )
+        except ChartOfAccount.DoesNotExist as e:
+            raise FillImportError(fill.line_number, str(e))
+
+    def _pnl_account(self, fill, realized_pnl):
+        trading_account = self.trading_accounts[fill.trading_account_id]
+        if realized_pnl > 0:
+            return get_or_create_account(
+                trading_account, '4030', chart=self.charts[fill.trading_account_id],
+                account_name='Realized Gain on Spot Sale', account_type=REVENUE,
+                parent_account=self._account(fill, '4000')
+            )
+        return get_or_create_account(
+            trading_account, '5030', chart=self.charts[fill.trading_account_id],
+            account_name='Realized Loss on Spot Sale', account_type=EXPENSE,
+            parent_account=self._account(fill, '5000')
+        )
+
+    def _queue(self, fill):
+        key = (fill.trading_account_id, fill.asset)
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = LotQueue.load(
+                self.trading_accounts[fill.trading_account_id], self.assets[fill.asset], for_update=True
+            )
+        return queue
+
+    def _header(self, fill, entry_type, description, **kwargs):
+        if self.user is not None:
+            kwargs['posted_by'] = self.user
+        else:
+            kwargs['posted_by_id'] = self.trading_accounts[fill.trading_account_id].user_id
+        return JournalEntry(entry_date=fill.entry_date, description=description, entry_type=entry_type, **kwargs)
+
+    def _spend(self, fill, amount):
+        available = self.cash[fill.trading_account_id]
+        if available < amount:
+            raise FillImportError(fill.line_number, f"insufficient cash. Available: {available}, required: {amount}")
+        self.cash[fill.trading_account_id] = available - amount
+
+    def _deposit(self, fill):
+        self.cash[fill.trading_account_id] += fill.amount
+        self.entries.append((self._header(fill, JournalEntry.DEPOSIT, fill.description), [
+            JournalEntryLine(account=self._account(fill, '1010'), debit_amount=fill.amount),
+            JournalEntryLine(account=self._account(fill, '3010'), credit_amount=fill.amount),
+        ]))
+
+    def _withdrawal(self, fill):
+        self._spend(fill, fill.amount)
+        self.entries.append((self._header(fill, JournalEntry.WITHDRAWAL, fill.description), [
+            JournalEntryLine(account=self._account(fill, '1010'), credit_amount=fill.amount),
+            JournalEntryLine(account=self._account(fill, '3010'), debit_amount=fill.amount),
+        ]))
+
+    def _buy(self, fill):
+        self._spend(fill, fill.amount)
+        unit_cost = (fill.amount / fill.quantity).quantize(COST_PRECISION)
+        lot = AssetLot(
+            asset=self.assets[fill.asset],
+            trading_account=self.trading_accounts[fill.trading_account_id],
+            quantity=fill.quantity,
+            purchase_price_usd=unit_cost,
+            remaining_quantity=fill.quantity,
+        )
+        self.new_lots.append(lot)
+        # خود شیء ذخیره نشده به جای شناسه در صف قرار می‌گیرد؛ فروش‌های همین دسته می‌توانند از آن مصرف کنند
+        self._queue(fill).add(fill.quantity, unit_cost, lot)
+        self.entries.append((
+            self._header(
+                fill, JournalEntry.SPOT_BUY, f"Spot Buy: {fill.quantity} {fill.asset} | {fill.description}", asset_lot=lot
+            ),
+            [
+                JournalEntryLine(account=self._account(fill, '1020'), debit_amount=fill.amount),
+                JournalEntryLine(account=self._account(fill, '1010'), credit_amount=fill.amount),
+            ]
+        ))
+
+    def _sell(self, fill):
+        try:
+            consumptions = self._queue(fill).consume(fill.quantity)
+        except InsufficientQuantity as e:
+            raise FillImportError(fill.line_number, f"not enough {fill.asset} to sell. {e}")
+        for consumption in consumptions:
+            if isinstance(consumption.lot_id, AssetLot):
+                consumption.lot_id.remaining_quantity = consumption.remaining
+            else:
+                self.existing_lot_remaining[consumption.lot_id] = consumption.remaining
+
+        sale_proceeds = _money(fill.amount)
+        cost_of_goods_sold = _money(sum((consumption.cost for consumption in consumptions), Decimal('0.00')))
+        realized_pnl = sale_proceeds - cost_of_goods_sold
+        self.cash[fill.trading_account_id] += sale_proceeds
+
+        lines = [
+            JournalEntryLine(account=self._account(fill, '1010'), debit_amount=sale_proceeds),
+            JournalEntryLine(account=self._account(fill, '1020'), credit_amount=cost_of_goods_sold),
+        ]
+        if realized_pnl > 0:
+            lines.append(JournalEntryLine(account=self._pnl_account(fill, realized_pnl), credit_amount=realized_pnl))
+        elif realized_pnl < 0:
+            lines.append(JournalEntryLine(account=self._pnl_account(fill, realized_pnl), debit_amount=abs(realized_pnl)))
+
+        self.consumptions.append((len(self.entries), consumptions))
+        self.entries.append((
+            self._header(
+                fill, JournalEntry.SPOT_SELL,
+                f"Spot Sell: {fill.quantity} {fill.asset} | PnL: {realized_pnl} | {fill.description}"
+            ),
+            lines
+        ))
+
+    def post(self):
+        self._load()
+        handlers = {DEPOSIT: self._deposit, WITHDRAWAL: self._withdrawal, BUY: self._buy, SELL: self._sell}
+        for fill in self.fills:
+            handlers[fill.event_type](fill)
+
+        AssetLot.objects.bulk_create(self.new_lots, batch_size=1000)
+        AssetLot.objects.bulk_update(
+            [AssetLot(id=lot_id, remaining_quantity=remaining) for lot_id, remaining in self.existing_lot_remaining.items()],
+            ['remaining_quantity'], batch_size=1000
+        )
+        headers = post_entries(self.entries)
+        LotConsumption.objects.bulk_create([
+            LotConsumption(
+                journal_entry=headers[index],
+                lot_id=getattr(consumption.lot_id, 'pk', consumption.lot_id),
+                quantity=consumption.quantity,
+                cost_usd=consumption.cost
+            )
+            for index, consumptions in self.consumptions
+            for consumption in consumptions
+        ], batch_size=1000)
+        return headers
+
+
+def post_fills(fills, user=None):
+    """
+    یک دسته Fill را در یک تراکنش ثبت می‌کند و اسناد ساخته شده را برمی‌گرداند.
+    اگر هر رکوردی نامعتبر باشد (موجودی ناکافی، دارایی ناشناخته، ...) FillImportError رخ می‌دهد و هیچ چیز از دسته ثبت نمی‌شود.
+    posted_by اسناد کاربر داده شده یا در نبود آن صاحب حساب معاملاتی است.
+    """
+    with transaction.atomic():
+        return _BatchPoster(fills, user).post()
+
+
+def import_fills(path, name=None, batch_size=BATCH_SIZE, file_format=None, user=None, restart=False, progress=None):
+    """
+    فایل CSV/JSONL رویدادهای صرافی را به صورت جریانی ثبت می‌کند و تعداد رکوردهای ثبت شده در این اجرا را برمی‌گرداند.
+    هر batch_size رکورد در یک تراکنش ثبت می‌شود و نقطه بازیابی (ImportCheckpoint) در همان تراکنش جلو می‌رود؛
+    پس اجرای دوباره پس از توقف، رکوردهای commit شده را رد می‌کند و از اولین رکورد ثبت نشده ادامه می‌دهد.
+    progress(committed) در صورت وجود پس از هر دسته با تعداد کل رکوردهای commit شده صدا زده می‌شود.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1.")
+    name = name or os.path.abspath(path)
+    checkpoint, _ = ImportCheckpoint.objects.get_or_create(name=name)
+    if restart and checkpoint.rows_committed:
+        checkpoint.rows_committed = 0
+        checkpoint.save(update_fields=['rows_committed', 'updated_at'])
+
+    committed = checkpoint.rows_committed
+    rows = islice(iter_raw_rows(path, file_format), committed, None)
+    imported = 0
+    while True:
+        batch = [parse_fill(line_number, row) for line_number, row in islice(rows, batch_size)]
+        if not batch:
+            return imported
+        with transaction.atomic():
+            # قفل نقطه بازیابی: دو اجرای همزمان روی یک فایل نمی‌توانند یک دسته را دو بار ثبت کنند
+            current = ImportCheckpoint.objects.select_for_update().values_list('rows_committed', flat=True).get(pk=checkpoint.pk)
+            if current != committed:
+                raise ValueError(f"Checkpoint '{name}' moved from {committed} to {current}; is another import running?")
+            _BatchPoster(batch, user).post()
+            committed += len(batch)
+            ImportCheckpoint.objects.filter(pk=checkpoint.pk).update(rows_committed=committed, updated_at=timezone.now())
+        imported += len(batch)
+        if progress is not None:
+            progress(committed)
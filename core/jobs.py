@@ -0,0 +1,123 @@
+import os
+import socket
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ReportJob
+from .services import (
+    generate_income_statement, generate_consolidated_balance_sheet, generate_trial_balance
+)
+
+
+# کاری که بیش از این مدت در وضعیت RUNNING مانده باشد (worker متوقف شده) دوباره در صف قرار می‌گیرد
+STALE_JOB_TIMEOUT = timedelta(minutes=30)
+MAX_ATTEMPTS = 3
+
+
+def _date_param(params, name, required=True):
+    value = params.get(name)
+    if not value:
+        if required:
+            raise ValueError(f"Parameter '{name}' is required.")
+        return None
+    return date.fromisoformat(str(value))
+
+
+def _income_statement(job):
+    params = job.params
+    return generate_income_statement(
+        job.trading_account, _date_param(params, 'start_date'), _date_param(params, 'end_date')
+    )
+
+
+def _balance_sheet(job):
+    return generate_consolidated_balance_sheet(
+        [job.trading_account], as_of=_date_param(job.params, 'as_of', required=False)
+    )
+
+
+def _trial_balance(job):
+    return generate_trial_balance(job.trading_account, as_of=_date_param(job.params, 'as_of', required=False))
+
+
+REPORT_GENERATORS = {
+    ReportJob.INCOME_STATEMENT: _income_statement,
+    ReportJob.BALANCE_SHEET: _balance_sheet,
+    ReportJob.TRIAL_BALANCE: _trial_balance,
+}
+
+
+def validate_job_params(report_type, params):
+    """
+    پارامترهای یک کار را پیش از ثبت بررسی می‌کند؛ در صورت نامعتبر بودن ValueError می‌دهد.
+    """
+    if report_type not in REPORT_GENERATORS:
+        raise ValueError(f"Unknown report type: {report_type}")
+    if report_type == ReportJob.INCOME_STATEMENT:
+        if _date_param(params, 'start_date') > _date_param(params, 'end_date'):
+            raise ValueError("start_date must not be after end_date.")
+    else:
+        _date_param(params, 'as_of', required=False)
+
+
+def submit_report_job(user, trading_account, report_type, params=None):
+    params = params or {}
+    validate_job_params(report_type, params)
+    return ReportJob.objects.create(user=user, trading_account=trading_account, report_type=report_type, params=params)
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_next_job(worker_id=None):
+    """
+    قدیمی‌ترین کار PENDING را برمی‌دارد و آن را RUNNING می‌کند؛ اگر کاری نباشد None.
+    ردیف‌هایی که worker دیگری در حال برداشتن آن‌هاست (قفل شده) رد می‌شوند (SKIP LOCKED)،
+    پس worker ها منتظر یکدیگر نمی‌مانند و یک کار دو بار برداشته نمی‌شود.
+    """
+    with transaction.atomic():
+        job = ReportJob.objects.select_for_update(skip_locked=True).filter(
+            status=ReportJob.PENDING
+        ).order_by('created_at', 'id').first()
+        if job is None:
+            return None
+        job.status = ReportJob.RUNNING
+        job.worker = worker_id or default_worker_id()
+        job.started_at = timezone.now()
+        job.attempts += 1
+        job.save(update_fields=['status', 'worker', 'started_at', 'attempts'])
+    return job
+
+
+def run_job(job):
+    """
+    گزارش کار را می‌سازد و نتیجه یا خطا را ذخیره می‌کند.
+    """
+    try:
+        result = REPORT_GENERATORS[job.report_type](job)
+    except Exception as e:
+        job.status = ReportJob.FAILED
+        job.error = f"{type(e).__name__}: {e}"
+        job.result = None
+    else:
+        job.status = ReportJob.SUCCEEDED
+        job.error = ''
+        job.result = result
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'result', 'finished_at'])
+    return job
+
+
+def requeue_stale_jobs(timeout=STALE_JOB_TIMEOUT):
+    """
+    کارهایی که worker آن‌ها از کار افتاده را دوباره PENDING می‌کند (یا پس از MAX_ATTEMPTS تلاش FAILED).
+    تعداد کارهای برگردانده شده به صف را برمی‌گرداند.
+    """
+    stale = ReportJob.objects.filter(status=ReportJob.RUNNING, started_at__lt=timezone.now() - timeout)
+    stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status=ReportJob.FAILED, error="Worker stopped before finishing the job.", finished_at=timezone.now()
+    )
+    return stale.filter(attempts__lt=MAX_ATTEMPTS).update(status=ReportJob.PENDING, worker='')
@@ -0,0 +1,169 @@
+from collections import deque, namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+
+from .models import AssetLot
+
+
+# دقت بهای تمام شده هر مصرف، برابر با دقت فیلدهای قیمت در AssetLot
+COST_PRECISION = Decimal('0.00000001')
+ZERO = Decimal('0')
+
+# یک برداشت از یک دسته: چه مقدار، با چه بهایی و چه مقدار از آن دسته باقی ماند
+Consumption = namedtuple('Consumption', ['lot_id', 'quantity', 'cost', 'remaining'])
+
+
+class InsufficientQuantity(ValueError):
+    def __init__(self, available, requested):
+        self.available = available
+        self.requested = requested
+        super().__init__(f"موجودی کافی نیست. موجودی: {available}، مقدار درخواستی: {requested}")
+
+
+class LotQueue:
+    """
+    صف FIFO دسته‌های باز یک دارایی در یک حساب.
+    هر دسته فقط به صورت [شناسه، مقدار باقی‌مانده، قیمت واحد] نگهداری می‌شود و
+    جمع مقدار و بهای تمام شده صف به صورت جاری به‌روز می‌شود تا پرس‌وجوی آن‌ها O(1) باشد.
+    این کلاس هیچ وابستگی به دیتابیس ندارد.
+    """
+    __slots__ = ('_lots', 'quantity', 'cost_basis')
+
+    def __init__(self, lots=()):
+        self._lots = deque()
+        self.quantity = ZERO
+        self.cost_basis = ZERO
+        for lot_id, remaining, unit_cost in lots:
+            self.add(remaining, unit_cost, lot_id)
+
+    @classmethod
+    def load(cls, trading_account, asset, for_update=False):
+        """
+        دسته‌های باز را با یک پرس‌وجو (و در صورت نیاز قفل‌شده) به ترتیب FIFO بارگذاری می‌کند.
+        """
+        lots = AssetLot.objects.filter(
+            trading_account=trading_account,
+            asset=asset,
+            remaining_quantity__gt=0
+        ).order_by('purchase_date', 'id')
+        if for_update:
+            lots = lots.select_for_update()
+        return cls(lots.values_list('id', 'remaining_quantity', 'purchase_price_usd'))
+
+    def __len__(self):
+        return len(self._lots)
+
+    def __iter__(self):
+        return (tuple(lot) for lot in self._lots)
+
+    @property
+    def average_cost(self):
+        return self.cost_basis / self.quantity if self.quantity else ZERO
+
+    def add(self, quantity, unit_cost, lot_id=None):
+        if quantity <= 0:
+            return
+        self._lots.append([lot_id, quantity, unit_cost])
+        self.quantity += quantity
+        self.cost_basis += quantity * unit_cost
+
+    def cost_of(self, quantity):
+        """
+        بهای تمام شده FIFO مقدار داده شده را بدون تغییر صف برمی‌گرداند.
+        """
+        if quantity > self.quantity:
+            raise InsufficientQuantity(self.quantity, quantity)
+        cost = ZERO
+        remaining = quantity
+        for _, lot_quantity, unit_cost in self._lots:
+            if remaining <= 0:
+                break
+            taken = min(lot_quantity, remaining)
+            cost += (taken * unit_cost).quantize(COST_PRECISION, rounding=ROUND_HALF_UP)
+            remaining -= taken
+        return cost
+
+    def consume(self, quantity):
+        """
+        مقدار داده شده را به ترتیب FIFO از صف کم می‌کند و لیست Consumption ها را برمی‌گرداند.
+        اگر موجودی کافی نباشد، پیش از هر تغییری InsufficientQuantity رخ می‌دهد.
+        """
+        if quantity > self.quantity:
+            raise InsufficientQuantity(self.quantity, quantity)
+
+        consumptions = []
+        remaining = quantity
+        lots = self._lots
+        while remaining > 0:
+            lot = lots[0]
+            lot_id, lot_quantity, unit_cost = lot
+            taken = min(lot_quantity, remaining)
+            cost = (taken * unit_cost).quantize(COST_PRECISION, rounding=ROUND_HALF_UP)
+            left = lot_quantity - taken
+            if left:
+                lot[1] = left
+            else:
+                lots.popleft()
+            self.quantity -= taken
+            self.cost_basis -= taken * unit_cost
+            remaining -= taken
+            consumptions.append(Consumption(lot_id, taken, cost, left))
+        return consumptions
+
+
+class LotBook:
+    """
+    مجموعه صف‌های FIFO به تفکیک (حساب، دارایی).
+    برای اجرای آفلاین تاریخچه معاملات (مالیات، سناریوهای فرضی) بدون هیچ دسترسی به دیتابیس استفاده می‌شود.
+    """
+    BUY = 'BUY'
+    SELL = 'SELL'
+
+    def __init__(self):
+        self.queues = {}
+        self.realized_pnl = {}
+
+    def queue(self, account, asset):
+        key = (account, asset)
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = LotQueue()
+        return queue
+
+    def add(self, account, asset, quantity, unit_cost, lot_id=None):
+        self.queue(account, asset).add(quantity, unit_cost, lot_id)
+
+    def consume(self, account, asset, quantity):
+        return self.queue(account, asset).consume(quantity)
+
+    def replay(self, fills, on_disposal=None):
+        """
+        fills: iterable از (حساب، دارایی، BUY/SELL، مقدار، قیمت واحد) به ترتیب زمانی.
+        سود/زیان شناسایی‌شده هر (حساب، دارایی) در realized_pnl جمع می‌شود؛
+        در صورت نیاز on_disposal(account, asset, quantity, proceeds, cost) برای هر فروش صدا زده می‌شود.
+        مقدار یا قیمت صفر/منفی ValueError می‌دهد (فروش منفی صف را بزرگ و سود ساختگی ثبت می‌کرد).
+        """
+        queues = self.queues
+        realized = self.realized_pnl
+        for number, (account, asset, side, quantity, price) in enumerate(fills, start=1):
+            if quantity <= 0 or price <= 0:
+                raise ValueError(
+                    f"Fill #{number} ({account}, {asset}, {side}): quantity and price must be positive, "
+                    f"got quantity {quantity} and price {price}."
+                )
+            key = (account, asset)
+            queue = queues.get(key)
+            if queue is None:
+                queue = queues[key] = LotQueue()
+
+            if side == self.BUY:
+                queue.add(quantity, price)
+                continue
+            if side != self.SELL:
+                raise ValueError(f"Unknown fill side: {side}")
+
+            cost = sum((consumption.cost for consumption in queue.consume(quantity)), ZERO)
+            proceeds = quantity * price
+            realized[key] = realized.get(key, ZERO) + proceeds - cost
+            if on_disposal is not None:
+                on_disposal(account, asset, quantity, proceeds, cost)
+        return self
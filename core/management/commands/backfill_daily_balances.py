@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import TradingAccount
+from core.services import rebuild_daily_balances
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the per-account daily closing balance snapshots from the journal lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trading-account', type=int, help="Only backfill the accounts of this trading account id.")
+
+    def handle(self, *args, **options):
+        trading_account = None
+        if options['trading_account']:
+            try:
+                trading_account = TradingAccount.objects.get(pk=options['trading_account'])
+            except TradingAccount.DoesNotExist:
+                raise CommandError(f"Trading account {options['trading_account']} does not exist.")
+
+        written = rebuild_daily_balances(trading_account=trading_account)
+        self.stdout.write(self.style.SUCCESS(f"{written} daily balance snapshot(s) written."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import TradingAccount
+from core.services import rebuild_equity_curve
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the daily equity curve of the trading accounts from the journal lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trading-account', type=int, help="Only backfill this trading account id.")
+
+    def handle(self, *args, **options):
+        trading_account = None
+        if options['trading_account']:
+            try:
+                trading_account = TradingAccount.objects.get(pk=options['trading_account'])
+            except TradingAccount.DoesNotExist:
+                raise CommandError(f"Trading account {options['trading_account']} does not exist.")
+
+        written = rebuild_equity_curve(trading_account=trading_account)
+        self.stdout.write(self.style.SUCCESS(f"{written} equity curve point(s) written."))
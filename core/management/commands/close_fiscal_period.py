@@ -0,0 +1,39 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import TradingAccount
+from core.services import close_fiscal_period
+
+
+class Command(BaseCommand):
+    help = "Closes the next fiscal period of every trading account (or a single one) through the given date."
+
+    def add_arguments(self, parser):
+        parser.add_argument('end_date', help="Last day of the period, in YYYY-MM-DD format.")
+        parser.add_argument('--trading-account', type=int, help="Only close the period of this trading account id.")
+
+    def handle(self, *args, **options):
+        try:
+            end_date = datetime.strptime(options['end_date'], '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError("end_date must be in YYYY-MM-DD format.")
+
+        trading_accounts = TradingAccount.objects.order_by('pk')
+        if options['trading_account']:
+            trading_accounts = trading_accounts.filter(pk=options['trading_account'])
+            if not trading_accounts.exists():
+                raise CommandError(f"Trading account {options['trading_account']} does not exist.")
+
+        closed = skipped = 0
+        for trading_account in trading_accounts.iterator():
+            try:
+                period = close_fiscal_period(trading_account, end_date, user=None)
+            except ValueError as e:
+                skipped += 1
+                self.stdout.write(f"Trading account {trading_account.pk}: {e}")
+                continue
+            closed += 1
+            self.stdout.write(f"Trading account {trading_account.pk}: closed {period.start_date} - {period.end_date}")
+
+        self.stdout.write(self.style.SUCCESS(f"{closed} period(s) closed, {skipped} skipped."))
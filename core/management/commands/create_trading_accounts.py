@@ -0,0 +1,53 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import TradingAccount
+from core.services import create_trading_accounts_bulk
+
+
+class Command(BaseCommand):
+    help = "Provisions one trading account (with its full chart of accounts) for each selected user."
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help="Users to provision. Combine with --role to select by role.")
+        parser.add_argument('--role', help="Provision every user with this role (e.g. Trader).")
+        parser.add_argument('--name', default='{username} Account', help="Account name template; {username} is substituted.")
+        parser.add_argument('--account-type', default=TradingAccount.CRYPTO, choices=[c[0] for c in TradingAccount.ACCOUNT_TYPES])
+        parser.add_argument('--purpose', default=TradingAccount.SPOT, choices=[c[0] for c in TradingAccount.ACCOUNT_PURPOSE_CHOICES])
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        if not options['usernames'] and not options['role']:
+            raise CommandError("Pass at least one username or --role.")
+
+        users = User.objects.all()
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        if options['role']:
+            users = users.filter(role=options['role'])
+        users = list(users)
+
+        missing = set(options['usernames']) - {user.username for user in users}
+        if missing:
+            raise CommandError(f"Unknown user(s): {', '.join(sorted(missing))}")
+
+        specs = [
+            {
+                'user': user,
+                'name': options['name'].format(username=user.username),
+                'account_type': options['account_type'],
+                'account_purpose': options['purpose'],
+            }
+            for user in users
+        ]
+
+        # کاربرانی که از قبل حسابی با همین نام دارند دوباره ساخته نمی‌شوند
+        existing = set(TradingAccount.objects.filter(
+            user__in=users, name__in={spec['name'] for spec in specs}
+        ).values_list('user_id', 'name'))
+        specs = [spec for spec in specs if (spec['user'].pk, spec['name']) not in existing]
+
+        accounts = create_trading_accounts_bulk(specs)
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(accounts)} trading account(s) provisioned, {len(existing)} already existed."
+        ))
@@ -0,0 +1,51 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.exports import CHUNK_SIZE, EXPORT_FORMATS, EXPORT_KINDS, stream_export
+from core.models import TradingAccount
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f"Invalid date '{value}', expected YYYY-MM-DD.")
+
+
+class Command(BaseCommand):
+    help = "Streams the journal entries or trades of a trading account to a CSV/NDJSON file in constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('trading_account', type=int, help="Trading account id.")
+        parser.add_argument('--kind', choices=EXPORT_KINDS, default=EXPORT_KINDS[0])
+        parser.add_argument('--format', dest='export_format', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--start-date', type=_parse_date)
+        parser.add_argument('--end-date', type=_parse_date)
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Rows fetched per database round trip.")
+        parser.add_argument('--output', '-o', help="Output file path (defaults to stdout).")
+
+    def handle(self, *args, **options):
+        try:
+            trading_account = TradingAccount.objects.get(pk=options['trading_account'])
+        except TradingAccount.DoesNotExist:
+            raise CommandError(f"Trading account {options['trading_account']} does not exist.")
+
+        chunks = stream_export(
+            options['kind'], options['export_format'], trading_account,
+            options['start_date'], options['end_date'], options['chunk_size']
+        )
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+
+        rows = 0
+        with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+            for chunk in chunks:
+                output.write(chunk)
+                rows += 1
+        # سطر اول CSV سرستون است
+        if options['export_format'] == 'csv':
+            rows -= 1
+        self.stderr.write(self.style.SUCCESS(f"Exported {rows} record(s) to {options['output']}."))
@@ -0,0 +1,45 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.imports import BATCH_SIZE, EVENT_TYPES, FILL_FIELDS, IMPORT_FORMATS, import_fills
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams a CSV/JSONL export of exchange events (" + ", ".join(EVENT_TYPES) + ") from disk and posts them "
+        "in batches. Progress is checkpointed in the database, so re-running after a crash resumes after the last "
+        "committed batch. Columns: " + ", ".join(FILL_FIELDS) + "."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL (.jsonl/.ndjson) file to import.")
+        parser.add_argument('--format', dest='file_format', choices=sorted(set(IMPORT_FORMATS.values())),
+                            help="File format (defaults to the file extension).")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Records committed per transaction.")
+        parser.add_argument('--checkpoint', help="Checkpoint name (defaults to the absolute file path).")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and import from the first record.")
+        parser.add_argument('--posted-by', help="Username recorded as poster (defaults to each trading account's owner).")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['posted_by']:
+            try:
+                user = get_user_model().objects.get(username=options['posted_by'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"User '{options['posted_by']}' does not exist.")
+
+        def progress(committed):
+            self.stderr.write(f"{committed} record(s) committed.")
+
+        try:
+            imported = import_fills(
+                options['path'], name=options['checkpoint'], batch_size=options['batch_size'],
+                file_format=options['file_format'], user=user, restart=options['restart'], progress=progress
+            )
+        except OSError as e:
+            raise CommandError(str(e))
+        except ValueError as e:
+            # دسته ناقص rollback شده است؛ پس از اصلاح فایل، اجرای دوباره از همان دسته ادامه می‌دهد
+            raise CommandError(f"Import stopped: {e}")
+
+        self.stdout.write(self.style.SUCCESS(f"Imported {imported} record(s) from {options['path']}."))
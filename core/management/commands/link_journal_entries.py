@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import TradingAccount
+from core.services import link_journal_entries
+
+
+class Command(BaseCommand):
+    help = "Links journal entries posted before source references existed to their trades, asset lots and entry types."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trading-account', type=int, help="Only link the entries of this trading account id.")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be linked without saving anything.")
+
+    def handle(self, *args, **options):
+        trading_account = None
+        if options['trading_account']:
+            try:
+                trading_account = TradingAccount.objects.get(pk=options['trading_account'])
+            except TradingAccount.DoesNotExist:
+                raise CommandError(f"Trading account {options['trading_account']} does not exist.")
+
+        counts = link_journal_entries(trading_account=trading_account, dry_run=options['dry_run'])
+
+        for entry_type, count in sorted(counts.items()):
+            self.stdout.write(f"{entry_type}: {count}")
+
+        verb = "would be linked" if options['dry_run'] else "linked"
+        self.stdout.write(self.style.SUCCESS(f"{sum(counts.values())} journal entries {verb}."))
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from core.idempotency import prune_idempotency_keys
+
+
+class Command(BaseCommand):
+    help = "Deletes stored Idempotency-Key responses older than IDEMPOTENCY_KEY_RETENTION_DAYS."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Override the retention period in days.")
+
+    def handle(self, *args, **options):
+        older_than = timedelta(days=options['days']) if options['days'] is not None else None
+        deleted = prune_idempotency_keys(older_than)
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} idempotency key(s)."))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import TradingAccount
+from core.services import rebuild_account_balances
+
+
+class Command(BaseCommand):
+    help = "Recomputes the running account balances from the journal lines and reports any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trading-account', type=int, help="Only rebuild the accounts of this trading account id.")
+        parser.add_argument('--check', action='store_true', help="Verify the balances without rewriting them.")
+
+    def handle(self, *args, **options):
+        trading_account = None
+        if options['trading_account']:
+            try:
+                trading_account = TradingAccount.objects.get(pk=options['trading_account'])
+            except TradingAccount.DoesNotExist:
+                raise CommandError(f"Trading account {options['trading_account']} does not exist.")
+
+        mismatches = rebuild_account_balances(trading_account=trading_account, dry_run=options['check'])
+
+        for account_id, stored, actual in mismatches:
+            self.stdout.write(
+                f"Account {account_id}: stored debit/credit {stored[0]}/{stored[1]}, "
+                f"ledger debit/credit {actual[0]}/{actual[1]}"
+            )
+
+        if options['check']:
+            if mismatches:
+                raise CommandError(f"{len(mismatches)} account balance(s) do not match the ledger.")
+            self.stdout.write(self.style.SUCCESS("All account balances match the ledger."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Account balances rebuilt ({len(mismatches)} corrected)."))
@@ -0,0 +1,55 @@
+import csv
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.lots import LotBook, InsufficientQuantity
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays a CSV of fills (account,asset,side,quantity,price) through the in-memory FIFO lot engine "
+        "and prints realized PnL and the remaining cost basis per account and asset. Nothing is written to the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file with a header row: account,asset,side,quantity,price")
+
+    def _read_fills(self, path):
+        with open(path, newline='') as handle:
+            for line_number, row in enumerate(csv.DictReader(handle), start=2):
+                side = (row.get('side') or '').strip().upper()
+                if side not in (LotBook.BUY, LotBook.SELL):
+                    raise CommandError(
+                        f"Invalid fill on line {line_number}: side must be {LotBook.BUY} or {LotBook.SELL}, "
+                        f"got {row.get('side')!r}"
+                    )
+                try:
+                    fill = (
+                        row['account'],
+                        row['asset'],
+                        side,
+                        Decimal(row['quantity']),
+                        Decimal(row['price']),
+                    )
+                except (KeyError, TypeError, InvalidOperation) as e:
+                    raise CommandError(f"Invalid fill on line {line_number}: {e!r}")
+                if fill[3] <= 0 or fill[4] <= 0:
+                    raise CommandError(f"Invalid fill on line {line_number}: quantity and price must be positive.")
+                yield fill
+
+    def handle(self, *args, **options):
+        try:
+            book = LotBook().replay(self._read_fills(options['path']))
+        except OSError as e:
+            raise CommandError(str(e))
+        except InsufficientQuantity as e:
+            raise CommandError(f"Fill sells more than the open lots hold: {e}")
+
+        for (account, asset), queue in sorted(book.queues.items()):
+            realized = book.realized_pnl.get((account, asset), Decimal('0'))
+            self.stdout.write(
+                f"{account} {asset}: realized PnL {realized:.2f}, "
+                f"open {queue.quantity} at cost basis {queue.cost_basis:.2f}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Replayed fills for {len(book.queues)} account/asset pair(s)."))
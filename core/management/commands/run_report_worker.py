@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.jobs import claim_next_job, default_worker_id, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs queued report jobs. Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED, "
+        "so several worker processes can run side by side."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Process the jobs currently queued and exit.")
+        parser.add_argument('--max-jobs', type=int, default=0, help="Exit after this many jobs (0 = no limit).")
+        parser.add_argument('--sleep', type=float, default=2.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--worker-id', default='', help="Name recorded on claimed jobs (defaults to host:pid).")
+        parser.add_argument('--requeue-interval', type=float, default=60.0,
+                            help="Seconds between checks for jobs left RUNNING by a crashed worker.")
+
+    def handle(self, *args, **options):
+        worker_id = options['worker_id'] or default_worker_id()
+
+        processed = 0
+        last_requeue = None
+        while not options['max_jobs'] or processed < options['max_jobs']:
+            # کار worker از کار افتاده در حین اجرای worker های دیگر هم دوباره به صف برمی‌گردد، نه فقط هنگام شروع
+            if last_requeue is None or time.monotonic() - last_requeue >= options['requeue_interval']:
+                last_requeue = time.monotonic()
+                requeued = requeue_stale_jobs()
+                if requeued:
+                    self.stdout.write(f"Requeued {requeued} stale job(s).")
+
+            job = claim_next_job(worker_id)
+            if job is None:
+                if options['once']:
+                    break
+                # اتصال‌های قطع‌شده یا قدیمی در زمان بیکاری دور انداخته می‌شوند
+                close_old_connections()
+                time.sleep(options['sleep'])
+                continue
+
+            run_job(job)
+            processed += 1
+            self.stdout.write(f"Job {job.pk} ({job.report_type}) {job.status}")
+
+        self.stdout.write(self.style.SUCCESS(f"Worker {worker_id} processed {processed} job(s)."))
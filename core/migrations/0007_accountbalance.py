@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def populate_account_balances(apps, schema_editor):
+    AccountBalance = apps.get_model('core', 'AccountBalance')
+    JournalEntryLine = apps.get_model('core', 'JournalEntryLine')
+
+    totals = JournalEntryLine.objects.values('account_id').annotate(
+        total_debit=Sum('debit_amount'),
+        total_credit=Sum('credit_amount')
+    )
+    AccountBalance.objects.bulk_create([
+        AccountBalance(
+            account_id=row['account_id'],
+            debit_total=row['total_debit'] or 0,
+            credit_total=row['total_credit'] or 0
+        )
+        for row in totals
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_populate_additional_account_name_fa'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalance',
+            fields=[
+                ('account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='running_balance', serialize=False, to='core.chartofaccount')),
+                ('debit_total', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('credit_total', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+            ],
+        ),
+        migrations.RunPython(populate_account_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,101 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_accounts(apps, schema_editor):
+    """
+    سرفصل‌های تکراری (یک شماره حساب دو بار در یک حساب معاملاتی، مثلا ساخته شده از API) پیش از افزودن
+    قید یکتایی در قدیمی‌ترین سرفصل ادغام می‌شوند: آرتیکل‌ها و زیرحساب‌ها به آن منتقل و مانده‌هایش
+    از روی آرتیکل‌های ادغام شده دوباره ساخته می‌شوند.
+    """
+    ChartOfAccount = apps.get_model('core', 'ChartOfAccount')
+    JournalEntryLine = apps.get_model('core', 'JournalEntryLine')
+    AccountBalance = apps.get_model('core', 'AccountBalance')
+    AccountDailyBalance = apps.get_model('core', 'AccountDailyBalance')
+
+    groups = ChartOfAccount.objects.filter(trading_account__isnull=False).values(
+        'trading_account_id', 'account_number'
+    ).annotate(count=Count('id'), keep_id=Min('id')).filter(count__gt=1).order_by()
+    merged = False
+    for group in groups:
+        keep_id = group['keep_id']
+        duplicate_ids = list(ChartOfAccount.objects.filter(
+            trading_account_id=group['trading_account_id'], account_number=group['account_number']
+        ).exclude(pk=keep_id).values_list('id', flat=True))
+        merged_ids = duplicate_ids + [keep_id]
+
+        JournalEntryLine.objects.filter(account_id__in=duplicate_ids).update(account_id=keep_id)
+        ChartOfAccount.objects.filter(pk=keep_id, parent_account_id__in=duplicate_ids).update(parent_account_id=None)
+        ChartOfAccount.objects.filter(parent_account_id__in=duplicate_ids).update(parent_account_id=keep_id)
+
+        AccountBalance.objects.filter(account_id__in=merged_ids).delete()
+        AccountDailyBalance.objects.filter(account_id__in=merged_ids).delete()
+        lines = JournalEntryLine.objects.filter(account_id=keep_id)
+        totals = lines.aggregate(debit=Sum('debit_amount'), credit=Sum('credit_amount'))
+        if totals['debit'] is not None:
+            AccountBalance.objects.create(account_id=keep_id, debit_total=totals['debit'], credit_total=totals['credit'])
+        # هر ردیف روزانه مانده تجمعی پایان آن روز است، نه جمع همان روز
+        snapshots = []
+        running_debit = running_credit = 0
+        for row in lines.values('journal_entry__entry_date').annotate(
+            debit=Sum('debit_amount'), credit=Sum('credit_amount')
+        ).order_by('journal_entry__entry_date'):
+            running_debit += row['debit']
+            running_credit += row['credit']
+            snapshots.append(AccountDailyBalance(
+                account_id=keep_id, date=row['journal_entry__entry_date'],
+                debit_total=running_debit, credit_total=running_credit
+            ))
+        AccountDailyBalance.objects.bulk_create(snapshots)
+
+        ChartOfAccount.objects.filter(pk__in=duplicate_ids).delete()
+        merged = True
+
+    if merged and schema_editor.connection.vendor == 'postgresql':
+        # کلیدهای خارجی DEFERRED هستند؛ بدون اجرای فوری بررسی‌ها، ALTER TABLE بعدی با
+        # «pending trigger events» شکست می‌خورد
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_accountdailybalance'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='journalentryline',
+            name='account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='core.chartofaccount'),
+        ),
+        migrations.AlterField(
+            model_name='trade',
+            name='trading_account',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='trades', to='core.tradingaccount'),
+        ),
+        migrations.AddIndex(
+            model_name='assetlot',
+            index=models.Index(condition=models.Q(('remaining_quantity__gt', 0)), fields=['trading_account', 'asset', 'purchase_date'], name='assetlot_open_fifo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='journalentry',
+            index=models.Index(fields=['entry_date', 'id'], name='journalentry_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='journalentryline',
+            index=models.Index(fields=['account', 'journal_entry'], name='jeline_account_entry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trade',
+            index=models.Index(fields=['trading_account', 'status', 'entry_date'], name='trade_account_status_idx'),
+        ),
+        migrations.RunPython(merge_duplicate_accounts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chartofaccount',
+            constraint=models.UniqueConstraint(fields=('trading_account', 'account_number'), name='unique_account_number_per_trading_account'),
+        ),
+    ]
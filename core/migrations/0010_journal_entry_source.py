@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_ledger_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='journalentry',
+            name='asset_lot',
+            field=models.ForeignKey(blank=True, help_text='دسته خریدی که این سند آن را ایجاد کرده است (خرید یا واریز دارایی اسپات)', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='journal_entries', to='core.assetlot'),
+        ),
+        migrations.AddField(
+            model_name='journalentry',
+            name='entry_type',
+            field=models.CharField(choices=[('MANUAL', 'Manual'), ('DEPOSIT', 'Cash Deposit'), ('WITHDRAWAL', 'Cash Withdrawal'), ('TRANSFER', 'Inter-account Transfer'), ('SPOT_DEPOSIT', 'Spot Asset Deposit'), ('SPOT_WITHDRAWAL', 'Spot Asset Withdrawal'), ('SPOT_BUY', 'Spot Buy'), ('SPOT_SELL', 'Spot Sell'), ('TRADE_CLOSE', 'Closed Trade')], db_index=True, default='MANUAL', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='journalentry',
+            name='trade',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='journal_entries', to='core.trade'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_journal_entry_source'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='journalentry',
+            name='reversal_of',
+            field=models.ForeignKey(blank=True, help_text='سندی که این سند آن را برگشت زده است', null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='reversals', to='core.journalentry'),
+        ),
+        migrations.AlterField(
+            model_name='journalentry',
+            name='entry_type',
+            field=models.CharField(choices=[('MANUAL', 'Manual'), ('DEPOSIT', 'Cash Deposit'), ('WITHDRAWAL', 'Cash Withdrawal'), ('TRANSFER', 'Inter-account Transfer'), ('SPOT_DEPOSIT', 'Spot Asset Deposit'), ('SPOT_WITHDRAWAL', 'Spot Asset Withdrawal'), ('SPOT_BUY', 'Spot Buy'), ('SPOT_SELL', 'Spot Sell'), ('TRADE_CLOSE', 'Closed Trade'), ('REVERSAL', 'Reversal')], db_index=True, default='MANUAL', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='LotConsumption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('cost_usd', models.DecimalField(decimal_places=8, help_text='بهای تمام شده مقدار مصرف\u200cشده (مقدار × قیمت خرید دسته)', max_digits=20)),
+                ('journal_entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lot_consumptions', to='core.journalentry')),
+                ('lot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumptions', to='core.assetlot')),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_lot_consumption'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='assetlot',
+            name='assetlot_open_fifo_idx',
+        ),
+        migrations.AddIndex(
+            model_name='assetlot',
+            index=models.Index(condition=models.Q(('remaining_quantity__gt', 0)), fields=['trading_account', 'asset', 'purchase_date', 'id'], name='assetlot_open_fifo_idx'),
+        ),
+    ]
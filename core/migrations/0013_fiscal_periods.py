@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_fifo_index_tiebreak'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='journalentry',
+            name='entry_type',
+            field=models.CharField(choices=[('MANUAL', 'Manual'), ('DEPOSIT', 'Cash Deposit'), ('WITHDRAWAL', 'Cash Withdrawal'), ('TRANSFER', 'Inter-account Transfer'), ('SPOT_DEPOSIT', 'Spot Asset Deposit'), ('SPOT_WITHDRAWAL', 'Spot Asset Withdrawal'), ('SPOT_BUY', 'Spot Buy'), ('SPOT_SELL', 'Spot Sell'), ('TRADE_CLOSE', 'Closed Trade'), ('REVERSAL', 'Reversal'), ('CLOSING', 'Period Closing')], db_index=True, default='MANUAL', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='FiscalPeriod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('closed_at', models.DateTimeField(auto_now_add=True)),
+                ('closed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('closing_entry', models.OneToOneField(blank=True, help_text='سند بستن حساب\u200cهای درآمد و هزینه به حقوق صاحبان سهام', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='closed_period', to='core.journalentry')),
+                ('trading_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fiscal_periods', to='core.tradingaccount')),
+            ],
+            options={
+                'ordering': ['start_date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PeriodClosingBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('debit_total', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('credit_total', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('period_debit', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('period_credit', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='period_closing_balances', to='core.chartofaccount')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='closing_balances', to='core.fiscalperiod')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='fiscalperiod',
+            constraint=models.UniqueConstraint(fields=('trading_account', 'end_date'), name='unique_period_end_per_trading_account'),
+        ),
+        migrations.AddConstraint(
+            model_name='periodclosingbalance',
+            constraint=models.UniqueConstraint(fields=('period', 'account'), name='unique_closing_balance_per_account'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_report_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyEquity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('cash', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('spot_holdings', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('realized_pnl', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('trading_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_equity', to='core.tradingaccount')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('trading_account', 'date'), name='unique_daily_equity_per_account')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:04
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_journal_entry_created_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tradingaccount',
+            name='ledger_version',
+            field=models.CharField(default=core.models.new_ledger_version, editable=False, max_length=32),
+        ),
+    ]
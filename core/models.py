@@ -1,8 +1,11 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.db.models import Sum
 from django.core.exceptions import ValidationError
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _, get_language
 
@@ -32,6 +35,7 @@ FARSI_ACCOUNT_NAME_MAP = {
     'Platform Fees': 'هزینه‌های پلتفرم',
     'Realized Gain on Spot Sale': 'سود حاصل از فروش اسپات',
     'Realized Loss on Spot Sale': 'ضرر حاصل از فروش اسپات',
+    'Retained Earnings': 'سود انباشته',
 }
 
 
@@ -87,6 +91,12 @@ class Currency(models.Model):
 
 # مدل سرفصل‌های حسابداری
 class ChartOfAccount(models.Model):
+    # ثابت‌های نوع سرفصل، برای دسترسی به صورت ChartOfAccount.REVENUE
+    ASSET = ASSET
+    LIABILITY = LIABILITY
+    EQUITY = EQUITY
+    REVENUE = REVENUE
+    EXPENSE = EXPENSE
 
     account_number = models.CharField(max_length=50)
     account_name = models.CharField(max_length=255)
@@ -113,6 +123,16 @@ class ChartOfAccount(models.Model):
         help_text="Connects this account to a specific user as a counterparty"
     )
 
+    class Meta:
+        constraints = [
+            # هر شماره سرفصل در هر حساب معاملاتی فقط یک بار تعریف می‌شود؛
+            # همین ایندکس یکتا جستجوی (حساب معاملاتی، شماره سرفصل) را هم پوشش می‌دهد
+            models.UniqueConstraint(
+                fields=['trading_account', 'account_number'],
+                name='unique_account_number_per_trading_account'
+            ),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.account_name_fa and self.account_name:
             self.account_name_fa = translate_account_name_to_farsi(self.account_name)
@@ -132,9 +152,70 @@ class ChartOfAccount(models.Model):
 
 # مدل اسناد حسابداری
 class JournalEntry(models.Model):
+    # --- نوع رویدادی که این سند را صادر کرده است ---
+    MANUAL = 'MANUAL'
+    DEPOSIT = 'DEPOSIT'
+    WITHDRAWAL = 'WITHDRAWAL'
+    TRANSFER = 'TRANSFER'
+    SPOT_DEPOSIT = 'SPOT_DEPOSIT'
+    SPOT_WITHDRAWAL = 'SPOT_WITHDRAWAL'
+    SPOT_BUY = 'SPOT_BUY'
+    SPOT_SELL = 'SPOT_SELL'
+    TRADE_CLOSE = 'TRADE_CLOSE'
+    REVERSAL = 'REVERSAL'
+    CLOSING = 'CLOSING'
+    ENTRY_TYPE_CHOICES = [
+        (MANUAL, 'Manual'),
+        (DEPOSIT, 'Cash Deposit'),
+        (WITHDRAWAL, 'Cash Withdrawal'),
+        (TRANSFER, 'Inter-account Transfer'),
+        (SPOT_DEPOSIT, 'Spot Asset Deposit'),
+        (SPOT_WITHDRAWAL, 'Spot Asset Withdrawal'),
+        (SPOT_BUY, 'Spot Buy'),
+        (SPOT_SELL, 'Spot Sell'),
+        (TRADE_CLOSE, 'Closed Trade'),
+        (REVERSAL, 'Reversal'),
+        (CLOSING, 'Period Closing'),
+    ]
+
     entry_date = models.DateField()
     description = models.TextField()
     posted_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPE_CHOICES, default=MANUAL, db_index=True)
+
+    # --- سند مبدا: به جای جستجو در شرح سند، سند مستقیما به معامله یا دسته خرید متصل است ---
+    trade = models.ForeignKey(
+        'Trade',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='journal_entries'
+    )
+    asset_lot = models.ForeignKey(
+        'AssetLot',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='journal_entries',
+        help_text="دسته خریدی که این سند آن را ایجاد کرده است (خرید یا واریز دارایی اسپات)"
+    )
+    reversal_of = models.ForeignKey(
+        'self',
+        on_delete=models.RESTRICT,
+        null=True,
+        blank=True,
+        related_name='reversals',
+        help_text="سندی که این سند آن را برگشت زده است"
+    )
+    # زمان درج ردیف (نه تاریخ سند)؛ همگام‌سازی افزایشی با آن اسنادی را که ممکن است هنوز commit نشده باشند کنار می‌گذارد.
+    # اسناد قدیمی‌تر از این فیلد مقدار ندارند و همیشه قطعی فرض می‌شوند.
+    created_at = models.DateTimeField(auto_now_add=True, null=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # بازه‌های تاریخی گزارش‌ها و مرتب‌سازی تاریخچه اسناد
+            models.Index(fields=['entry_date', 'id'], name='journalentry_date_idx'),
+        ]
 
     def clean(self):
         # این متد قبل از ذخیره در Django Admin و ModelForms صدا زده می‌شود
@@ -156,14 +237,151 @@ class JournalEntry(models.Model):
 
 class JournalEntryLine(models.Model):
     journal_entry = models.ForeignKey(JournalEntry, on_delete=models.CASCADE)
-    account = models.ForeignKey(ChartOfAccount, on_delete=models.PROTECT)
+    # ایندکس ترکیبی jeline_account_entry_idx با ستون account شروع می‌شود و جای ایندکس جداگانه را می‌گیرد
+    account = models.ForeignKey(ChartOfAccount, on_delete=models.PROTECT, db_index=False)
     debit_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     credit_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
+    class Meta:
+        indexes = [
+            # آرتیکل‌های یک سرفصل به همراه سند آن‌ها (دفتر معین و گزارش‌ها)
+            models.Index(fields=['account', 'journal_entry'], name='jeline_account_entry_idx'),
+        ]
+
     def __str__(self):
         return f"Line {self.id} in Entry {self.journal_entry.id}"
 
+class AccountBalance(models.Model):
+    """
+    مانده جاری هر سرفصل که همزمان با ثبت آرتیکل‌ها به‌روز می‌شود،
+    تا برای خواندن موجودی نیازی به جمع زدن کل دفتر نباشد.
+    """
+    account = models.OneToOneField(
+        ChartOfAccount,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='running_balance'
+    )
+    debit_total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    credit_total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    @property
+    def balance(self):
+        return self.debit_total - self.credit_total
+
+    def __str__(self):
+        return f"Balance of {self.account_id}: {self.balance}"
+
+
+class FiscalPeriod(models.Model):
+    """
+    یک دوره مالی بسته شده از یک حساب معاملاتی.
+    دوره‌ها پشت سر هم و بدون فاصله هستند؛ ثبت، ویرایش یا حذف آرتیکل با تاریخی
+    در یک دوره بسته شده مجاز نیست.
+    """
+    trading_account = models.ForeignKey('TradingAccount', on_delete=models.CASCADE, related_name='fiscal_periods')
+    start_date = models.DateField()
+    end_date = models.DateField()
+    closed_at = models.DateTimeField(auto_now_add=True)
+    closed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    closing_entry = models.OneToOneField(
+        JournalEntry,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='closed_period',
+        help_text="سند بستن حساب‌های درآمد و هزینه به حقوق صاحبان سهام"
+    )
+
+    class Meta:
+        ordering = ['start_date']
+        constraints = [
+            models.UniqueConstraint(fields=['trading_account', 'end_date'], name='unique_period_end_per_trading_account'),
+        ]
+
+    def __str__(self):
+        return f"{self.trading_account_id}: {self.start_date} - {self.end_date}"
+
+
+class PeriodClosingBalance(models.Model):
+    """
+    مانده هر سرفصل در پایان یک دوره بسته شده.
+    debit_total / credit_total: جمع تجمعی تا پایان دوره (پس از سند بستن).
+    period_debit / period_credit: گردش خود دوره بدون سند بستن، برای صورت سود و زیان.
+    """
+    period = models.ForeignKey(FiscalPeriod, on_delete=models.CASCADE, related_name='closing_balances')
+    account = models.ForeignKey(ChartOfAccount, on_delete=models.CASCADE, related_name='period_closing_balances')
+    debit_total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    credit_total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    period_debit = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    period_credit = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'account'], name='unique_closing_balance_per_account'),
+        ]
+
+    @property
+    def balance(self):
+        return self.debit_total - self.credit_total
+
+    def __str__(self):
+        return f"Closing balance of {self.account_id} for period {self.period_id}: {self.balance}"
+
+
+class AccountDailyBalance(models.Model):
+    """
+    مانده پایان روز هر سرفصل (جمع تجمعی بدهکار و بستانکار تا پایان آن روز).
+    فقط برای روزهایی که آرتیکل دارند ردیف ساخته می‌شود؛ مانده هر تاریخ دلخواه
+    برابر با آخرین ردیف قبل از آن تاریخ است.
+    """
+    account = models.ForeignKey(ChartOfAccount, on_delete=models.CASCADE, related_name='daily_balances')
+    date = models.DateField()
+    debit_total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    credit_total = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'date'], name='unique_daily_balance_per_account'),
+        ]
+
+    @property
+    def balance(self):
+        return self.debit_total - self.credit_total
+
+    def __str__(self):
+        return f"Balance of {self.account_id} on {self.date}: {self.balance}"
+
+class DailyEquity(models.Model):
+    """
+    منحنی سرمایه حساب معاملاتی: مقادیر تجمعی پایان روز نقد (1010)، دارایی‌های اسپات به بهای تمام شده (1020)
+    و سود/زیان تحقق یافته (درآمدها - هزینه‌ها + سود انباشته 3090).
+    مانند AccountDailyBalance فقط برای روزهای دارای آرتیکل ردیف ساخته می‌شود.
+    """
+    trading_account = models.ForeignKey('TradingAccount', on_delete=models.CASCADE, related_name='daily_equity')
+    date = models.DateField()
+    cash = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    spot_holdings = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    realized_pnl = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['trading_account', 'date'], name='unique_daily_equity_per_account'),
+        ]
+
+    @property
+    def equity(self):
+        # سود تحقق یافته قبلا در نقد تسویه شده است؛ فقط برای نمودار جداگانه نگه داشته می‌شود
+        return self.cash + self.spot_holdings
+
+    def __str__(self):
+        return f"Equity of {self.trading_account_id} on {self.date}: {self.equity}"
+
 # مدل حساب‌های معاملاتی
+def new_ledger_version():
+    return uuid.uuid4().hex
+
+
 class TradingAccount(models.Model):
     CRYPTO = 'Crypto'
     FOREX = 'Forex'
@@ -189,6 +407,8 @@ class TradingAccount(models.Model):
         choices=ACCOUNT_PURPOSE_CHOICES,
         help_text="مشخص می‌کند که این حساب برای چه نوع معاملاتی استفاده می‌شود."
     )
+    # توکن تصادفی که در همان تراکنش هر تغییر دفتر عوض می‌شود؛ کلید گزارش‌های کش شده در همه پروسه‌ها
+    ledger_version = models.CharField(max_length=32, default=new_ledger_version, editable=False)
 
     def __str__(self):
         return f"{self.name} ({self.get_account_type_display()} - {self.get_account_purpose_display()})"
@@ -227,16 +447,37 @@ class AssetLot(models.Model):
 
     class Meta:
         ordering = ['purchase_date'] # برای اجرای صحیح FIFO
+        indexes = [
+            # فقط دسته‌های باز در صف FIFO ایندکس می‌شوند؛ دسته‌های مصرف‌شده هرگز خوانده نمی‌شوند
+            models.Index(
+                fields=['trading_account', 'asset', 'purchase_date', 'id'],
+                condition=models.Q(remaining_quantity__gt=0),
+                name='assetlot_open_fifo_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.remaining_quantity}/{self.quantity} of {self.asset.symbol} bought at ${self.purchase_price_usd:.2f}"
 
     def save(self, *args, **kwargs):
-        # هنگام ساخت یک دسته جدید، مقدار باقی‌مانده برابر با مقدار کل است
-        if not self.pk:
+        # هنگام ساخت یک دسته جدید، اگر مقدار باقی‌مانده داده نشده باشد برابر با مقدار کل است
+        if not self.pk and self.remaining_quantity is None:
             self.remaining_quantity = self.quantity
         super().save(*args, **kwargs)
 
+class LotConsumption(models.Model):
+    """
+    هر ردیف نشان می‌دهد یک سند فروش یا برداشت اسپات چه مقدار از کدام دسته خرید را
+    با چه بهای تمام شده‌ای مصرف کرده است؛ برای حسابرسی COGS و برگشت سند بدون اجرای مجدد FIFO.
+    """
+    journal_entry = models.ForeignKey(JournalEntry, on_delete=models.CASCADE, related_name='lot_consumptions')
+    lot = models.ForeignKey(AssetLot, on_delete=models.CASCADE, related_name='consumptions')
+    quantity = models.DecimalField(max_digits=20, decimal_places=8)
+    cost_usd = models.DecimalField(max_digits=20, decimal_places=8, help_text="بهای تمام شده مقدار مصرف‌شده (مقدار × قیمت خرید دسته)")
+
+    def __str__(self):
+        return f"{self.quantity} of lot {self.lot_id} in Entry {self.journal_entry_id}"
+
 # مدل معاملات مشتقه (Futures/CFD)
 class Trade(models.Model):
     """
@@ -259,7 +500,7 @@ class Trade(models.Model):
     ]
     
     # --- بخش اطلاعات اصلی ---
-    trading_account = models.ForeignKey(TradingAccount, on_delete=models.CASCADE, related_name="trades")
+    trading_account = models.ForeignKey(TradingAccount, on_delete=models.CASCADE, related_name="trades", db_index=False)  # پوشش داده شده با trade_account_status_idx
     asset = models.ForeignKey(Asset, on_delete=models.PROTECT, limit_choices_to={'asset_type': Asset.DERIVATIVE})
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=OPEN)
     
@@ -286,5 +527,99 @@ class Trade(models.Model):
         related_name='commissioned_trades'
     )
 
+    class Meta:
+        indexes = [
+            # فهرست معاملات باز/بسته هر حساب به ترتیب تاریخ ورود
+            models.Index(fields=['trading_account', 'status', 'entry_date'], name='trade_account_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"[{self.status}] {self.position_side} {self.quantity} {self.asset.symbol}"
+
+
+class ReportJob(models.Model):
+    """
+    گزارشی که به جای درخواست وب، توسط worker پس‌زمینه (run_report_worker) ساخته می‌شود.
+    worker ها کارهای PENDING را با SELECT ... FOR UPDATE SKIP LOCKED برمی‌دارند،
+    پس چند پروسه worker می‌توانند همزمان و بدون برداشتن کار تکراری اجرا شوند.
+    """
+    INCOME_STATEMENT = 'income_statement'
+    BALANCE_SHEET = 'balance_sheet'
+    TRIAL_BALANCE = 'trial_balance'
+    REPORT_TYPE_CHOICES = [
+        (INCOME_STATEMENT, 'Income Statement'),
+        (BALANCE_SHEET, 'Balance Sheet'),
+        (TRIAL_BALANCE, 'Trial Balance'),
+    ]
+
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    SUCCEEDED = 'SUCCEEDED'
+    FAILED = 'FAILED'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='report_jobs')
+    trading_account = models.ForeignKey(TradingAccount, on_delete=models.CASCADE, related_name='report_jobs')
+    report_type = models.CharField(max_length=30, choices=REPORT_TYPE_CHOICES)
+    params = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # صف کارهای در انتظار به ترتیب ورود؛ فقط ردیف‌های PENDING در ایندکس هستند
+            models.Index(
+                fields=['created_at', 'id'],
+                name='reportjob_pending_idx',
+                condition=models.Q(status='PENDING')
+            ),
+        ]
+
+    def __str__(self):
+        return f"ReportJob {self.pk} [{self.status}] {self.report_type}"
+
+
+class ImportCheckpoint(models.Model):
+    """
+    پیشرفت یک ورود فایل (import_fills): تعداد رکوردهای فایل که ثبت و commit شده‌اند.
+    در همان تراکنش هر دسته به‌روز می‌شود، پس پس از توقف ناگهانی، ورود دوباره از اولین رکورد ثبت نشده ادامه می‌یابد.
+    """
+    name = models.CharField(max_length=255, unique=True, help_text="شناسه ورود؛ به طور پیش‌فرض مسیر کامل فایل")
+    rows_committed = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.rows_committed} row(s) committed"
+
+
+class IdempotencyKey(models.Model):
+    """
+    پاسخ ذخیره شده یک درخواست مالی (واریز، برداشت، خرید/فروش اسپات، بستن معامله) برای هدر Idempotency-Key.
+    در همان تراکنش سند حسابداری نوشته می‌شود؛ تکرار درخواست با همان کلید، همین پاسخ را بدون ثبت دوباره برمی‌گرداند.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    request_fingerprint = models.CharField(max_length=64, help_text="SHA-256 مسیر و بدنه درخواست اول")
+    response_status = models.PositiveSmallIntegerField()
+    response_body = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+
     def __str__(self):
-        return f"[{self.status}] {self.position_side} {self.quantity} {self.asset.symbol}"
\ No newline at end of file
+        return f"{self.key} ({self.user_id}) -> {self.response_status}"
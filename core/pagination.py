@@ -0,0 +1,16 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    صفحه‌بندی cursor روی کلید اصلی (جدیدترین اول): هزینه هر صفحه مستقل از عمق آن است
+    و ثبت ردیف‌های جدید بین دو درخواست باعث تکرار یا جا افتادن ردیفی نمی‌شود.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = '-id'
+
+
+class AscendingIdCursorPagination(IdCursorPagination):
+    ordering = 'id'
@@ -1,6 +1,8 @@
 from rest_framework import serializers
-from .models import User, Currency, ChartOfAccount, JournalEntry, JournalEntryLine, TradingAccount, Asset, AssetLot, Trade
+from .models import User, Currency, ChartOfAccount, JournalEntry, JournalEntryLine, TradingAccount, Asset, AssetLot, Trade, ReportJob
 from django.db.models import Sum
+from .services import get_cash_balance
+from .jobs import validate_job_params
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -18,15 +20,29 @@ class ChartOfAccountSerializer(serializers.ModelSerializer):
         model = ChartOfAccount
         fields = ['id', 'account_number', 'account_name', 'account_type', 'parent_account', 'is_active']
 
+class JournalEntryLineItemSerializer(serializers.ModelSerializer):
+    account_number = serializers.CharField(source='account.account_number', read_only=True)
+
+    class Meta:
+        model = JournalEntryLine
+        fields = ['id', 'account', 'account_number', 'debit_amount', 'credit_amount']
+
 class JournalEntrySerializer(serializers.ModelSerializer):
+    # آرتیکل‌ها با prefetch_related در JournalEntryViewSet خوانده می‌شوند
+    lines = JournalEntryLineItemSerializer(source='journalentryline_set', many=True, read_only=True)
+
     class Meta:
         model = JournalEntry
-        fields = ['id', 'entry_date', 'description', 'posted_by']
+        fields = ['id', 'entry_date', 'entry_type', 'description', 'posted_by', 'lines']
+        read_only_fields = ('entry_type',)
 
 class JournalEntryLineSerializer(serializers.ModelSerializer):
+    entry_date = serializers.DateField(source='journal_entry.entry_date', read_only=True)
+    account_number = serializers.CharField(source='account.account_number', read_only=True)
+
     class Meta:
         model = JournalEntryLine
-        fields = ['id', 'journal_entry', 'account', 'debit_amount', 'credit_amount']
+        fields = ['id', 'journal_entry', 'entry_date', 'account', 'account_number', 'debit_amount', 'credit_amount']
 
 class TradingAccountSerializer(serializers.ModelSerializer):
     class Meta:
@@ -39,6 +55,8 @@ class AssetSerializer(serializers.ModelSerializer):
         fields = ['id', 'symbol', 'name', 'asset_type', 'trading_account']
 
 class AssetLotSerializer(serializers.ModelSerializer):
+    asset_symbol = serializers.CharField(source='asset.symbol', read_only=True)
+
     class Meta:
         model = AssetLot
         fields = '__all__' # یا فیلدهای مورد نظر شما
@@ -82,6 +100,25 @@ class TradeSerializer(serializers.ModelSerializer):
         )
 
 
+class ClosedTradeImportSerializer(serializers.Serializer):
+    """
+    یک ردیف ورود گروهی معاملات بسته شده. شناسه‌ها اینجا فقط از نظر شکل بررسی می‌شوند و
+    record_closed_trades_bulk همه آن‌ها را با یک پرس‌وجو برای هر مدل پیدا می‌کند.
+    """
+    trading_account = serializers.IntegerField()
+    asset = serializers.IntegerField()
+    position_side = serializers.ChoiceField(choices=Trade.SIDE_CHOICES)
+    quantity = serializers.DecimalField(max_digits=20, decimal_places=8, required=False, allow_null=True)
+    entry_price = serializers.DecimalField(max_digits=20, decimal_places=8, required=False, allow_null=True)
+    exit_price = serializers.DecimalField(max_digits=20, decimal_places=8, required=False, allow_null=True)
+    exit_date = serializers.DateTimeField()
+    gross_profit_or_loss = serializers.DecimalField(max_digits=10, decimal_places=2)
+    broker_commission = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, default=0)
+    trader_commission = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, default=0)
+    commission_recipient = serializers.IntegerField(required=False, allow_null=True)
+    exit_description = serializers.CharField(required=False, allow_blank=True, default='')
+
+
 # یک سریالایزر ساده برای نمایش موجودی کیف پول اسپات
 class AssetLotBalanceSerializer(serializers.ModelSerializer):
     asset_name = serializers.CharField(source='asset.name')
@@ -107,20 +144,8 @@ class TradingAccountDetailSerializer(serializers.ModelSerializer):
         این متد موجودی‌های نقد و اسپات را محاسبه و برمی‌گرداند.
         'obj' در اینجا یک نمونه (instance) از مدل TradingAccount است.
         """
-        # --- محاسبه موجودی نقد از روی سرفصل حسابداری ---
-        cash_balance = 0
-        try:
-            cash_account = ChartOfAccount.objects.get(trading_account=obj, account_number='1010')
-            # جمع کل بدهکارها و بستانکارهای حساب نقد
-            balance_agg = JournalEntryLine.objects.filter(account=cash_account).aggregate(
-                total_debit=Sum('debit_amount'),
-                total_credit=Sum('credit_amount')
-            )
-            total_debit = balance_agg['total_debit'] or 0
-            total_credit = balance_agg['total_credit'] or 0
-            cash_balance = total_debit - total_credit
-        except ChartOfAccount.DoesNotExist:
-            cash_balance = 0
+        # --- موجودی نقد از جدول مانده‌های جاری خوانده می‌شود ---
+        cash_balance = get_cash_balance(obj)
 
         # --- دریافت موجودی دارایی‌های اسپات از کیف پول ---
         spot_assets_qs = AssetLot.objects.filter(
@@ -138,3 +163,29 @@ class TradingAccountDetailSerializer(serializers.ModelSerializer):
             'cash_balance': cash_balance,
             'spot_assets': spot_assets_data
         }
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    """
+    ثبت و پیگیری کارهای گزارش پس‌زمینه. نتیجه از طریق اکشن download دریافت می‌شود.
+    """
+    class Meta:
+        model = ReportJob
+        fields = [
+            'id', 'trading_account', 'report_type', 'params', 'status', 'error',
+            'attempts', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = ('status', 'error', 'attempts', 'created_at', 'started_at', 'finished_at')
+
+    def validate_trading_account(self, trading_account):
+        user = self.context['request'].user
+        if user.role != 'Admin' and trading_account.user_id != user.id:
+            raise serializers.ValidationError("Trading account not found.")
+        return trading_account
+
+    def validate(self, data):
+        try:
+            validate_job_params(data['report_type'], data.get('params') or {})
+        except ValueError as e:
+            raise serializers.ValidationError({'params': str(e)})
+        return data
@@ -1,11 +1,18 @@
 
-from django.db import transaction
+import hashlib
+import re
+from datetime import timedelta
+
+from django.db import transaction, IntegrityError
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
-from django.db.models import Sum, Value
+from django.db.models import Q, Sum, Max, Min, Value, F, OuterRef, Subquery, Case, When, DecimalField
 from django.db.models.functions import Coalesce
-from decimal import Decimal
-from core.models import ChartOfAccount, JournalEntry, JournalEntryLine, TradingAccount, AssetLot, Asset
-from .models import ASSET, LIABILITY, EQUITY, REVENUE, EXPENSE, Trade # وارد کردن ثابت‌ها از مدل‌ها
+from decimal import Decimal, ROUND_HALF_UP
+from core.models import translate_account_name_to_farsi, ChartOfAccount, JournalEntry, JournalEntryLine, TradingAccount, AssetLot, Asset, AccountBalance, AccountDailyBalance, DailyEquity, LotConsumption, FiscalPeriod, PeriodClosingBalance
+from .models import ASSET, LIABILITY, EQUITY, REVENUE, EXPENSE, Trade, User, new_ledger_version # وارد کردن ثابت‌ها از مدل‌ها
+from .lots import LotQueue
 
 
 
@@ -53,19 +60,43 @@ CHART_OF_ACCOUNTS_TEMPLATE = [
     ]},
 ]
 
-def _create_accounts_recursively(accounts_list, trading_account, parent_account=None):
-    # این تابع کمکی بدون تغییر باقی می‌ماند
-    for acc_def in accounts_list:
-        new_account = ChartOfAccount.objects.create(
-            trading_account=trading_account,
-            parent_account=parent_account,
-            account_number=acc_def['number'],
-            account_name=acc_def['name'].format(account_name=trading_account.name),
-            account_type=acc_def['type'],
-            is_active=True
-        )
-        if 'children' in acc_def:
-            _create_accounts_recursively(acc_def['children'], trading_account, parent_account=new_account)
+def _provision_chart_of_accounts(trading_accounts):
+    """
+    ساختار CHART_OF_ACCOUNTS_TEMPLATE را برای چند حساب معاملاتی می‌سازد.
+    هر سطح از الگو (برای همه حساب‌ها) با یک INSERT دسته‌ای ثبت می‌شود و
+    شناسه‌های برگشتی همان سطح، والد سطح بعدی می‌شوند.
+    """
+    level = [
+        (acc_def, trading_account, None)
+        for trading_account in trading_accounts
+        for acc_def in CHART_OF_ACCOUNTS_TEMPLATE
+    ]
+    while level:
+        new_accounts = []
+        for acc_def, trading_account, parent_account in level:
+            account_name = acc_def['name'].format(account_name=trading_account.name)
+            new_accounts.append(ChartOfAccount(
+                trading_account=trading_account,
+                parent_account=parent_account,
+                account_number=acc_def['number'],
+                account_name=account_name,
+                # bulk_create متد save را صدا نمی‌زند، پس نام فارسی را همین‌جا پر می‌کنیم
+                account_name_fa=translate_account_name_to_farsi(account_name),
+                account_type=acc_def['type'],
+                is_active=True
+            ))
+        ChartOfAccount.objects.bulk_create(new_accounts, batch_size=1000)
+
+        level = [
+            (child_def, trading_account, new_account)
+            for (acc_def, trading_account, _), new_account in zip(level, new_accounts)
+            for child_def in acc_def.get('children', [])
+        ]
+
+    # bulk_create سیگنال‌ها را اجرا نمی‌کند؛ نسخه دفتر حساب‌های تازه از قبل یکتاست و عوض کردنش لازم نیست
+    for trading_account in trading_accounts:
+        invalidate_chart_of_accounts(trading_account.pk)
+
 
 def create_trading_account(user, name, account_type, account_purpose):
     """
@@ -78,11 +109,314 @@ def create_trading_account(user, name, account_type, account_purpose):
             account_type=account_type,
             account_purpose=account_purpose
         )
-        # فراخوانی تابع کمکی برای ساخت کل ساختار حسابداری برای این حساب جدید
-        _create_accounts_recursively(CHART_OF_ACCOUNTS_TEMPLATE, trading_account=account)
+        # ساخت کل ساختار حسابداری برای این حساب جدید
+        _provision_chart_of_accounts([account])
         return account
 
 
+def create_trading_accounts_bulk(account_specs):
+    """
+    چندین حساب معاملاتی را به همراه سرفصل‌هایشان با چند کوئری ثابت می‌سازد.
+    account_specs: لیستی از دیکشنری‌ها با کلیدهای user, name, account_type, account_purpose
+    """
+    accounts = [
+        TradingAccount(
+            user=spec['user'],
+            name=spec['name'],
+            account_type=spec['account_type'],
+            account_purpose=spec['account_purpose']
+        )
+        for spec in account_specs
+    ]
+    if not accounts:
+        return []
+
+    with transaction.atomic():
+        TradingAccount.objects.bulk_create(accounts, batch_size=1000)
+        _provision_chart_of_accounts(accounts)
+    return accounts
+
+
+CHART_CACHE_KEY = 'chart-of-accounts:{trading_account_id}'
+
+
+def get_chart_of_accounts(trading_account):
+    """
+    نگاشت شماره حساب به سرفصل برای یک حساب معاملاتی را برمی‌گرداند.
+    کل سرفصل‌ها با یک کوئری بارگذاری و در کش نگهداری می‌شوند؛ سیگنال‌های
+    ChartOfAccount هنگام ساخت، ویرایش یا حذف، کش را باطل می‌کنند.
+    """
+    trading_account_id = getattr(trading_account, 'pk', trading_account)
+    key = CHART_CACHE_KEY.format(trading_account_id=trading_account_id)
+    chart = cache.get(key)
+    if chart is None:
+        chart = {
+            account.account_number: account
+            for account in ChartOfAccount.objects.filter(trading_account_id=trading_account_id)
+        }
+        if transaction.get_connection().in_atomic_block:
+            # سرفصل‌هایی که در همین تراکنش ساخته شده‌اند ممکن است rollback شوند؛ کش فقط پس از commit نوشته
+            # می‌شود (در صورت rollback هرگز). callback ها به ترتیب ثبت اجرا می‌شوند، پس باطل شدن بعدی همین
+            # تراکنش (on_commit در invalidate_chart_of_accounts) این نسخه را هم پاک می‌کند.
+            transaction.on_commit(lambda: _store_chart(key, chart))
+        else:
+            _store_chart(key, chart)
+    return chart
+
+
+def _store_chart(key, chart):
+    # عمر محدود: با کش LocMem هر پروسه کش خودش را دارد و باطل شدن در پروسه‌های دیگر دیده نمی‌شود
+    cache.set(key, chart, getattr(settings, 'CHART_CACHE_TIMEOUT', 300))
+
+
+def invalidate_chart_of_accounts(trading_account_id):
+    key = CHART_CACHE_KEY.format(trading_account_id=trading_account_id)
+    cache.delete(key)
+    # نسخه‌ای که تراکنش دیگری در این فاصله (از داده‌های commit شده قبلی) کش کرده باشد پس از commit پاک می‌شود
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+REPORT_CACHE_KEY = 'report:{report_type}:{digest}'
+
+
+def get_ledger_versions(trading_account_ids):
+    """
+    نسخه دفتر هر حساب معاملاتی را برمی‌گرداند (به همان ترتیب ورودی).
+    نسخه در دیتابیس است، پس همه پروسه‌ها (با هر backend کش) تغییر را همزمان با commit آن می‌بینند.
+    """
+    versions = dict(TradingAccount.objects.filter(pk__in=trading_account_ids).values_list('pk', 'ledger_version'))
+    return [versions.get(trading_account_id) for trading_account_id in trading_account_ids]
+
+
+def bump_ledger_version(*trading_account_ids):
+    """
+    نسخه دفتر حساب‌های داده شده را عوض می‌کند تا گزارش‌های کش شده آن‌ها دیگر خوانده نشوند.
+    به‌روزرسانی در تراکنش فراخوان انجام می‌شود: با rollback نسخه هم برمی‌گردد و پروسه‌های دیگر
+    نسخه جدید را فقط همراه با داده‌های commit شده آن می‌بینند. توکن تصادفی است (نه شمارنده) تا
+    گزارشی که از داده‌های یک تراکنش rollback شده کش شده، با نسخه‌ای که بعدا commit می‌شود یکی نشود.
+    """
+    trading_account_ids = {trading_account_id for trading_account_id in trading_account_ids if trading_account_id is not None}
+    if trading_account_ids:
+        TradingAccount.objects.filter(pk__in=trading_account_ids).update(ledger_version=new_ledger_version())
+
+
+def bump_ledger_version_for_accounts(account_ids):
+    """
+    نسخه دفتر حساب‌های معاملاتی صاحب سرفصل‌های داده شده را عوض می‌کند.
+    """
+    account_ids = set(account_ids)
+    if account_ids:
+        bump_ledger_version(*ChartOfAccount.objects.filter(pk__in=account_ids).values_list(
+            'trading_account_id', flat=True
+        ).distinct())
+
+
+def cached_report(report_type, trading_accounts, params, compute):
+    """
+    نتیجه compute() را برای این نوع گزارش، حساب‌ها و پارامترها از کش برمی‌گرداند.
+    کلید شامل نسخه دفتر همه حساب‌هاست، پس هر ثبتی در یکی از آن‌ها گزارش را
+    بی‌اعتبار می‌کند و تا زمانی که چیزی ثبت نشود، گزارش دوباره محاسبه نمی‌شود.
+    """
+    trading_account_ids = sorted({getattr(trading_account, 'pk', trading_account) for trading_account in trading_accounts})
+    versions = get_ledger_versions(trading_account_ids)
+    digest = hashlib.sha256(repr((trading_account_ids, versions, params)).encode()).hexdigest()
+    key = REPORT_CACHE_KEY.format(report_type=report_type, digest=digest)
+
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        cache.set(key, result, getattr(settings, 'REPORT_CACHE_TIMEOUT', 3600))
+    return result
+
+
+def get_account(trading_account, account_number, chart=None):
+    """
+    سرفصل با شماره مشخص را از کش برمی‌گرداند (بدون کوئری برای حساب‌های پرکاربرد).
+    chart: نگاشتی که ثبت‌های گروهی یک بار برای کل دسته بارگذاری می‌کنند؛ درون تراکنش کش تا commit
+    پر نمی‌شود و بدون آن هر فراخوانی یک کوئری می‌شد.
+    """
+    if chart is None:
+        chart = get_chart_of_accounts(trading_account)
+    try:
+        return chart[account_number]
+    except KeyError:
+        raise ChartOfAccount.DoesNotExist(
+            f"ChartOfAccount {account_number} not found for trading account {getattr(trading_account, 'pk', trading_account)}."
+        )
+
+
+def get_or_create_account(trading_account, account_number, chart=None, **defaults):
+    if chart is None:
+        chart = get_chart_of_accounts(trading_account)
+    account = chart.get(account_number)
+    if account is None:
+        account, _ = ChartOfAccount.objects.get_or_create(
+            trading_account=trading_account,
+            account_number=account_number,
+            defaults=defaults
+        )
+        chart[account_number] = account
+    return account
+
+
+CENT = Decimal('0.01')
+
+
+def _money(value):
+    """
+    مبلغ را به دقت ستون‌های مبلغ آرتیکل (دو رقم اعشار) گرد می‌کند.
+    """
+    return Decimal(str(value or 0)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def ensure_periods_open(postings):
+    """
+    اگر تاریخ هر یک از آرتیکل‌ها در یک دوره مالی بسته شده باشد، ValueError می‌دهد.
+    postings: iterable از (account_id, entry_date). آخرین تاریخ بسته شده همه
+    سرفصل‌ها با یک پرس‌وجوی گروه‌بندی شده خوانده می‌شود.
+    """
+    earliest = {}
+    for account_id, entry_date in postings:
+        if account_id not in earliest or entry_date < earliest[account_id]:
+            earliest[account_id] = entry_date
+    if not earliest:
+        return
+
+    closed_through = dict(
+        FiscalPeriod.objects.filter(
+            trading_account__chart_of_accounts__in=list(earliest)
+        ).values('trading_account__chart_of_accounts').annotate(
+            closed_through=Max('end_date')
+        ).values_list('trading_account__chart_of_accounts', 'closed_through').order_by()
+    )
+    for account_id, entry_date in earliest.items():
+        through = closed_through.get(account_id)
+        if through is not None and entry_date <= through:
+            raise ValueError(f"دوره مالی تا تاریخ {through} بسته شده است؛ ثبت یا تغییر سند با تاریخ {entry_date} مجاز نیست.")
+
+
+def _allocate_rounding_residue(lines, residue):
+    """
+    سند با مبالغ دقیق تراز است ولی گرد کردن هر آرتیکل به سنت اختلاف residue (بدهکار منهای بستانکار) ساخته است.
+    اختلاف به آرتیکلی داده می‌شود که گرد کردنش بیشترین سهم را در آن داشته است.
+    lines: لیست (آرتیکل، بدهکار دقیق، بستانکار دقیق).
+    """
+    sign = 1 if residue > 0 else -1
+
+    def share(item):
+        line, debit, credit = item
+        if line.debit_amount:
+            return sign * (line.debit_amount - debit)
+        return sign * (credit - line.credit_amount)
+
+    line, _, _ = max(lines, key=share)
+    if line.debit_amount:
+        line.debit_amount -= residue
+    else:
+        line.credit_amount += residue
+
+
+def post_entries(entries):
+    """
+    چند سند حسابداری را یکجا ثبت می‌کند.
+    entries: لیستی از (JournalEntry ذخیره نشده، لیست JournalEntryLine بدون journal_entry).
+    تراز بودن هر سند پیش از هر نوشتنی در حافظه بررسی می‌شود؛ سپس همه سرفصل‌ها
+    با یک bulk insert و همه آرتیکل‌ها با یک bulk insert دیگر ذخیره می‌شوند و
+    مانده‌ها در همان تراکنش به‌روز می‌شوند.
+    """
+    prepared = []
+    for header, lines in entries:
+        kept_lines = []
+        raw_debit = raw_credit = Decimal('0')
+        for line in lines:
+            debit, credit = Decimal(str(line.debit_amount or 0)), Decimal(str(line.credit_amount or 0))
+            if debit < 0 or credit < 0:
+                raise ValueError("مبلغ آرتیکل نمی‌تواند منفی باشد.")
+            raw_debit += debit
+            raw_credit += credit
+            line.debit_amount = _money(debit)
+            line.credit_amount = _money(credit)
+            if not line.debit_amount and not line.credit_amount:
+                continue
+            kept_lines.append((line, debit, credit))
+        total_debit = sum((line.debit_amount for line, _, _ in kept_lines), Decimal('0.00'))
+        total_credit = sum((line.credit_amount for line, _, _ in kept_lines), Decimal('0.00'))
+        if total_debit != total_credit:
+            if raw_debit != raw_credit:
+                raise ValueError(f"سند حسابداری نامتوازن است! بدهکار: {raw_debit}, بستانکار: {raw_credit}")
+            _allocate_rounding_residue(kept_lines, total_debit - total_credit)
+        prepared.append((header, [line for line, _, _ in kept_lines]))
+
+    if not prepared:
+        return []
+
+    with transaction.atomic():
+        # bulk_create سیگنال‌ها را اجرا نمی‌کند؛ قفل دوره‌های بسته شده اینجا بررسی می‌شود
+        ensure_periods_open(
+            (line.account_id, header.entry_date) for header, lines in prepared for line in lines
+        )
+        headers = JournalEntry.objects.bulk_create([header for header, _ in prepared], batch_size=1000)
+
+        all_lines = []
+        deltas = {}
+        for header, lines in prepared:
+            for line in lines:
+                line.journal_entry = header
+                all_lines.append(line)
+                key = (line.account_id, header.entry_date)
+                debit, credit = deltas.get(key, (Decimal('0.00'), Decimal('0.00')))
+                deltas[key] = (debit + line.debit_amount, credit + line.credit_amount)
+
+        JournalEntryLine.objects.bulk_create(all_lines, batch_size=1000)
+        apply_ledger_deltas(deltas)
+
+    return headers
+
+
+def post_entry(header, lines):
+    """
+    یک سند حسابداری را با تمام آرتیکل‌هایش ثبت کرده و سند ذخیره شده را برمی‌گرداند.
+    """
+    return post_entries([(header, lines)])[0]
+
+
+def lock_trading_accounts(*trading_accounts):
+    """
+    ردیف حساب‌های معاملاتی را تا پایان تراکنش جاری قفل می‌کند (SELECT ... FOR UPDATE).
+    هر سرویسی که موجودی نقد یا دسته‌های خرید یک حساب را بررسی و سپس مصرف می‌کند
+    باید پیش از خواندن موجودی این قفل را بگیرد؛ در نتیجه عملیات روی یک حساب
+    پشت سر هم اجرا می‌شوند و عملیات روی حساب‌های مختلف همزمان پیش می‌روند.
+    قفل‌ها همیشه به ترتیب شناسه گرفته می‌شوند تا انتقال‌های دوطرفه دچار بن‌بست نشوند.
+    """
+    ids = sorted({trading_account.pk for trading_account in trading_accounts})
+    return list(TradingAccount.objects.select_for_update().filter(pk__in=ids).order_by('pk').values_list('pk', flat=True))
+
+
+def _consume_lots(lot_queue, quantity):
+    """
+    مقدار درخواستی را از صف FIFO کم کرده و دسته‌های تغییر کرده را با یک bulk_update ذخیره می‌کند.
+    لیست Consumption های موتور دسته‌ها را برمی‌گرداند.
+    """
+    consumptions = lot_queue.consume(quantity)
+    AssetLot.objects.bulk_update(
+        [AssetLot(id=consumption.lot_id, remaining_quantity=consumption.remaining) for consumption in consumptions],
+        ['remaining_quantity']
+    )
+    return consumptions
+
+
+def _record_lot_consumptions(journal_entry, consumptions):
+    LotConsumption.objects.bulk_create([
+        LotConsumption(
+            journal_entry=journal_entry,
+            lot_id=consumption.lot_id,
+            quantity=consumption.quantity,
+            cost_usd=consumption.cost
+        )
+        for consumption in consumptions
+    ])
+
+
 def record_direct_closed_trade(
     trading_account, asset, position_side, quantity, entry_price, 
     exit_price, exit_date, gross_pnl, broker_commission, 
@@ -170,6 +504,14 @@ def create_journal_entry_for_closed_trade(trade: Trade):
     این تابع منطق حسابداری را بر اساس سود، زیان و کمیسیون‌های تفکیک شده اجرا می‌کند
     و تمام اطلاعات را از آبجکت Trade دریافت می‌کند.
     """
+    return post_entry(*build_closed_trade_entry(trade))
+
+
+def build_closed_trade_entry(trade: Trade, chart=None):
+    """
+    سند حسابداری معامله بسته شده را بدون ثبت می‌سازد و (سرفصل سند، آرتیکل‌ها) را برمی‌گرداند.
+    chart: سرفصل‌های از پیش بارگذاری شده حساب (برای ثبت گروهی)؛ مانند get_account.
+    """
     try:
         # ۱. استخراج اطلاعات از آبجکت trade
         trading_account = trade.trading_account
@@ -179,65 +521,158 @@ def create_journal_entry_for_closed_trade(trade: Trade):
         commission_recipient = trade.commission_recipient
 
         # ۲. پیدا کردن حساب‌های اصلی مورد نیاز از سرفصل‌ها
-        cash_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='1010')
-        pnl_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='4010') # حساب درآمد/زیان
-        fee_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='5010') # حساب هزینه کارمزد
-
-        # ۳. ایجاد هدر سند حسابداری
-        entry = JournalEntry.objects.create(
-            entry_date=trade.exit_date.date(),
-            description=f"Journal Entry for Closed Trade #{trade.id}: {trade.asset.symbol}",
-            posted_by=trading_account.user
-        )
+        if chart is None:
+            chart = get_chart_of_accounts(trading_account)
+        cash_account = get_account(trading_account, '1010', chart)
+        pnl_account = get_account(trading_account, '4010', chart) # حساب درآمد/زیان
+        fee_account = get_account(trading_account, '5010', chart) # حساب هزینه کارمزد
+
+        lines = []
 
-        # ۴. ثبت آرتیکل‌های مربوط به سود/زیان ناخالص
+        # ۳. آرتیکل‌های مربوط به سود/زیان ناخالص
         if gross_pnl > 0:
             # در صورت سود: بدهکار نقد، بستانکار درآمد (حساب 4010)
-            JournalEntryLine.objects.create(journal_entry=entry, account=cash_account, debit_amount=gross_pnl)
-            JournalEntryLine.objects.create(journal_entry=entry, account=pnl_account, credit_amount=gross_pnl)
+            lines.append(JournalEntryLine(account=cash_account, debit_amount=gross_pnl))
+            lines.append(JournalEntryLine(account=pnl_account, credit_amount=gross_pnl))
         elif gross_pnl < 0:
             # در صورت زیان: بدهکار درآمد (حساب 4010)، بستانکار نقد
             # توجه: زیان نیز در حساب درآمد ثبت می‌شود اما به صورت بدهکار
-            JournalEntryLine.objects.create(journal_entry=entry, account=pnl_account, debit_amount=abs(gross_pnl))
-            JournalEntryLine.objects.create(journal_entry=entry, account=cash_account, credit_amount=abs(gross_pnl))
+            lines.append(JournalEntryLine(account=pnl_account, debit_amount=abs(gross_pnl)))
+            lines.append(JournalEntryLine(account=cash_account, credit_amount=abs(gross_pnl)))
 
-        # ۵. ثبت آرتیکل‌های مربوط به کمیسیون
+        # ۴. آرتیکل‌های مربوط به کمیسیون
         total_fees = broker_commission + trader_commission
         if total_fees > 0:
+            if trader_commission > 0 and not commission_recipient:
+                raise ValueError("برای ثبت کمیسیون تریدر، دریافت‌کننده کمیسیون باید مشخص شود.")
+
             # الف) هزینه کل، حساب هزینه (5010) را بدهکار می‌کند
-            JournalEntryLine.objects.create(journal_entry=entry, account=fee_account, debit_amount=total_fees)
+            lines.append(JournalEntryLine(account=fee_account, debit_amount=total_fees))
             
             # ب) پرداخت کمیسیون بروکر، نقدینگی را کم می‌کند (بستانکار)
-            JournalEntryLine.objects.create(journal_entry=entry, account=cash_account, credit_amount=broker_commission)
+            lines.append(JournalEntryLine(account=cash_account, credit_amount=broker_commission))
             
             # ج) کمیسیون تریدر، بدهی ایجاد می‌کند (بستانکار)
-            if trader_commission > 0 and commission_recipient:
-                liabilities_parent = ChartOfAccount.objects.get(trading_account=trading_account, account_number='2000')
-                payable_account, _ = ChartOfAccount.objects.get_or_create(
-                    trading_account=trading_account,
+            if trader_commission > 0:
+                payable_account = get_or_create_account(
+                    trading_account,
+                    f"2010-{commission_recipient.id}",
+                    chart=chart,
                     counterparty_user=commission_recipient,
                     account_type=LIABILITY,
-                    defaults={
-                        'parent_account': liabilities_parent,
-                        'account_name': f"Payable to: {commission_recipient.username}",
-                        'account_number': f"2010-{commission_recipient.id}",
-                        'is_active': True
-                    }
+                    parent_account=get_account(trading_account, '2000', chart),
+                    account_name=f"Payable to: {commission_recipient.username}",
+                    is_active=True
                 )
-                JournalEntryLine.objects.create(journal_entry=entry, account=payable_account, credit_amount=trader_commission)
-        
-        return entry
+                lines.append(JournalEntryLine(account=payable_account, credit_amount=trader_commission))
+
+        # ۵. سند حسابداری به همراه تمام آرتیکل‌ها
+        return (
+            JournalEntry(
+                entry_date=trade.exit_date.date(),
+                description=f"Journal Entry for Closed Trade #{trade.id}: {trade.asset.symbol}",
+                posted_by_id=trading_account.user_id,
+                entry_type=JournalEntry.TRADE_CLOSE,
+                trade=trade
+            ),
+            lines
+        )
 
     except ChartOfAccount.DoesNotExist as e:
         raise ValueError(f"حسابداری برای {trading_account.name} به درستی تنظیم نشده است. حساب مورد نیاز پیدا نشد. جزئیات: {e}")
 
 
+class TradeImportError(ValueError):
+    """
+    خطاهای ورود گروهی معاملات؛ errors نگاشت شماره ردیف به لیست پیام‌های آن ردیف است.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"{len(errors)} row(s) could not be imported.")
+
+
+def record_closed_trades_bulk(rows, trading_accounts=None):
+    """
+    چند معامله بسته شده (مانند record_direct_closed_trade) را یکجا ثبت می‌کند.
+    rows: لیستی از dict با کلیدهای trading_account، asset و commission_recipient (شناسه) و
+    position_side، quantity، entry_price، exit_price، exit_date، gross_profit_or_loss،
+    broker_commission، trader_commission، exit_description.
+    trading_accounts: حساب‌های مجاز (پیش‌فرض همه)؛ شناسه خارج از آن خطای همان ردیف است.
+    همه ردیف‌ها پیش از هر نوشتنی بررسی می‌شوند و اگر ردیفی نامعتبر باشد TradeImportError
+    داده می‌شود و چیزی ثبت نمی‌شود. در غیر این صورت معاملات، اسناد و آرتیکل‌ها هر کدام با
+    یک bulk insert در یک تراکنش ثبت می‌شوند.
+    """
+    if trading_accounts is None:
+        trading_accounts = TradingAccount.objects.all()
+    accounts_by_id = trading_accounts.in_bulk({row['trading_account'] for row in rows})
+    assets_by_id = Asset.objects.in_bulk({row['asset'] for row in rows})
+    recipients_by_id = User.objects.in_bulk({row['commission_recipient'] for row in rows if row.get('commission_recipient')})
+    # سرفصل‌های هر حساب یک بار برای کل دسته خوانده می‌شوند (کپی، تا سرفصل‌های ساخته شده در دسته به کش نرسند)
+    charts = {
+        trading_account_id: dict(get_chart_of_accounts(trading_account))
+        for trading_account_id, trading_account in accounts_by_id.items()
+    }
+
+    errors = {}
+    trades = []
+    for index, row in enumerate(rows):
+        row_errors = []
+        trading_account = accounts_by_id.get(row['trading_account'])
+        asset = assets_by_id.get(row['asset'])
+        recipient = recipients_by_id.get(row.get('commission_recipient'))
+        if trading_account is None:
+            row_errors.append(f"Trading account {row['trading_account']} not found.")
+        if asset is None:
+            row_errors.append(f"Asset {row['asset']} not found.")
+        elif asset.asset_type != Asset.DERIVATIVE:
+            row_errors.append("این قابلیت فقط برای دارایی‌های مشتقه است.")
+        if row.get('commission_recipient') and recipient is None:
+            row_errors.append(f"Commission recipient {row['commission_recipient']} not found.")
+        if (row.get('trader_commission') or 0) > 0 and recipient is None:
+            row_errors.append("برای ثبت کمیسیون تریدر، دریافت‌کننده کمیسیون باید مشخص شود.")
+        if trading_account is not None and not {'1010', '4010', '5010', '2000'} <= charts[trading_account.id].keys():
+            row_errors.append(f"حسابداری برای {trading_account.name} به درستی تنظیم نشده است.")
+        if row_errors:
+            errors[index] = row_errors
+            continue
+
+        trades.append(Trade(
+            trading_account=trading_account,
+            asset=asset,
+            status=Trade.CLOSED,
+            position_side=row['position_side'],
+            quantity=row.get('quantity'),
+            entry_price=row.get('entry_price'),
+            entry_date=row['exit_date'],
+            exit_price=row.get('exit_price'),
+            exit_date=row['exit_date'],
+            exit_description=row.get('exit_description'),
+            gross_profit_or_loss=row['gross_profit_or_loss'],
+            broker_commission=row.get('broker_commission'),
+            trader_commission=row.get('trader_commission'),
+            commission_recipient=recipient
+        ))
+    if errors:
+        raise TradeImportError(errors)
+    if not trades:
+        return []
+
+    with transaction.atomic():
+        Trade.objects.bulk_create(trades, batch_size=1000)
+        # اسناد پس از درج معاملات ساخته می‌شوند تا شناسه معامله در شرح و کلید مبدا سند باشد
+        post_entries([build_closed_trade_entry(trade, charts[trade.trading_account_id]) for trade in trades])
+    return trades
+
+
 def delete_trading_account(trading_account: TradingAccount):
     """
     یک حساب معاملاتی و تمام داده‌های مرتبط با آن را به ترتیب صحیح حذف می‌کند.
     این نسخه اصلاح شده، با مدل یکپارچه Trade کار می‌کند.
     """
     with transaction.atomic():
+        # ۰. حذف دوره‌های مالی بسته شده تا قفل دوره مانع حذف آرتیکل‌ها نشود
+        FiscalPeriod.objects.filter(trading_account=trading_account).delete()
+
         # ۱. پیدا کردن تمام سندهای حسابداری مرتبط با این حساب
         related_journal_entries = JournalEntry.objects.filter(
             journalentryline__account__trading_account=trading_account
@@ -274,31 +709,24 @@ def make_deposit(trading_account, amount, description, user):
             raise ValueError("Amount must be a positive number.")
 
         try:
-            cash_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='1010')
-            equity_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='3010')
-
-            entry = JournalEntry.objects.create(
-                entry_date=timezone.now().date(),
-                description=description,
-                posted_by=user
+            cash_account = get_account(trading_account, '1010')
+            equity_account = get_account(trading_account, '3010')
+
+            return post_entry(
+                JournalEntry(
+                    entry_date=timezone.now().date(),
+                    description=description,
+                    posted_by=user,
+                    entry_type=JournalEntry.DEPOSIT
+                ),
+                [
+                    # Debit: Cash account increases
+                    JournalEntryLine(account=cash_account, debit_amount=amount),
+                    # Credit: Equity account increases
+                    JournalEntryLine(account=equity_account, credit_amount=amount),
+                ]
             )
 
-            # Debit: Cash account increases
-            JournalEntryLine.objects.create(
-                journal_entry=entry,
-                account=cash_account,
-                debit_amount=amount
-            )
-
-            # Credit: Equity account increases
-            JournalEntryLine.objects.create(
-                journal_entry=entry,
-                account=equity_account,
-                credit_amount=amount
-            )
-            
-            return entry
-
         except ChartOfAccount.DoesNotExist:
             raise ValueError(f"Required accounts are not set up for {trading_account.name}.")
 
@@ -355,45 +783,37 @@ def transfer_funds_between_accounts(from_trading_account: TradingAccount, to_tra
         if from_trading_account == to_trading_account:
             raise ValueError("Cannot transfer funds to the same account.")
 
+        lock_trading_accounts(from_trading_account, to_trading_account)
+
         try:
             # Get cash accounts for both trading accounts
-            from_cash_account = ChartOfAccount.objects.get(trading_account=from_trading_account, account_number='1010')
-            to_cash_account = ChartOfAccount.objects.get(trading_account=to_trading_account, account_number='1010')
+            from_cash_account = get_account(from_trading_account, '1010')
+            to_cash_account = get_account(to_trading_account, '1010')
 
             # Check if from_trading_account has sufficient funds (simplified check for cash balance)
             # This assumes '1010' is the primary cash account and its balance reflects available funds.
             # A more robust check might involve summing all cash-equivalent accounts.
-            current_balance = from_cash_account.journalentryline_set.aggregate(
-                balance=Sum('debit_amount') - Sum('credit_amount')
-            )['balance'] or Decimal('0.00')
+            current_balance = get_account_balance(from_cash_account)
 
             if current_balance < amount:
                 raise ValueError(f"Insufficient funds in {from_trading_account.name}. Available: {current_balance}, Attempted transfer: {amount}")
 
             # Create a single journal entry for the transfer
-            entry = JournalEntry.objects.create(
-                entry_date=timezone.now().date(),
-                description=f"Inter-account transfer: {description}",
-                posted_by=user
-            )
-
-            # Journal Entry Lines:
-            # 1. Credit the 'from' account's cash account (funds leaving)
-            JournalEntryLine.objects.create(
-                journal_entry=entry,
-                account=from_cash_account,
-                credit_amount=amount
+            return post_entry(
+                JournalEntry(
+                    entry_date=timezone.now().date(),
+                    description=f"Inter-account transfer: {description}",
+                    posted_by=user,
+                    entry_type=JournalEntry.TRANSFER
+                ),
+                [
+                    # 1. Credit the 'from' account's cash account (funds leaving)
+                    JournalEntryLine(account=from_cash_account, credit_amount=amount),
+                    # 2. Debit the 'to' account's cash account (funds entering)
+                    JournalEntryLine(account=to_cash_account, debit_amount=amount),
+                ]
             )
 
-            # 2. Debit the 'to' account's cash account (funds entering)
-            JournalEntryLine.objects.create(
-                journal_entry=entry,
-                account=to_cash_account,
-                debit_amount=amount
-            )
-            
-            return entry
-
         except ChartOfAccount.DoesNotExist:
             raise ValueError("One or both trading accounts do not have a cash account (account number 1010) set up.")
 
@@ -406,40 +826,33 @@ def make_withdrawal(trading_account, amount, description, user):
         if not amount or float(amount) <= 0:
             raise ValueError("Amount must be a positive number.")
 
+        lock_trading_accounts(trading_account)
+
         try:
-            cash_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='1010')
-            equity_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='3010')
+            cash_account = get_account(trading_account, '1010')
+            equity_account = get_account(trading_account, '3010')
 
             # Check for sufficient funds (simplified)
-            current_balance = cash_account.journalentryline_set.aggregate(
-                balance=Sum('debit_amount') - Sum('credit_amount')
-            )['balance'] or Decimal('0.00')
+            current_balance = get_account_balance(cash_account)
 
             if current_balance < amount:
                 raise ValueError(f"Insufficient funds in {trading_account.name}. Available: {current_balance}, Attempted withdrawal: {amount}")
 
-            entry = JournalEntry.objects.create(
-                entry_date=timezone.now().date(),
-                description=description,
-                posted_by=user
-            )
-
-            # Credit: Cash account decreases
-            JournalEntryLine.objects.create(
-                journal_entry=entry,
-                account=cash_account,
-                credit_amount=amount
+            return post_entry(
+                JournalEntry(
+                    entry_date=timezone.now().date(),
+                    description=description,
+                    posted_by=user,
+                    entry_type=JournalEntry.WITHDRAWAL
+                ),
+                [
+                    # Credit: Cash account decreases
+                    JournalEntryLine(account=cash_account, credit_amount=amount),
+                    # Debit: Equity account decreases (or a specific withdrawal account)
+                    JournalEntryLine(account=equity_account, debit_amount=amount),
+                ]
             )
 
-            # Debit: Equity account decreases (or a specific withdrawal account)
-            JournalEntryLine.objects.create(
-                journal_entry=entry,
-                account=equity_account,
-                debit_amount=amount
-            )
-            
-            return entry
-
         except ChartOfAccount.DoesNotExist:
             raise ValueError(f"Required accounts are not set up for {trading_account.name}.")
 
@@ -457,7 +870,7 @@ def deposit_spot_asset(trading_account, asset, quantity, price_usd, description,
             raise ValueError("Asset must be of type SPOT for this operation.")
 
         # ۱. ایجاد AssetLot برای دارایی واریز شده (این بخش درست بود)
-        AssetLot.objects.create(
+        lot = AssetLot.objects.create(
             asset=asset,
             trading_account=trading_account,
             quantity=quantity,
@@ -467,32 +880,27 @@ def deposit_spot_asset(trading_account, asset, quantity, price_usd, description,
         try:
             # ۲. پیدا کردن حساب‌های صحیح
             # به جای حساب نقد، حساب نگهداری دارایی‌های اسپات را پیدا می‌کنیم
-            asset_holding_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='1020')
-            equity_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='3010')
+            asset_holding_account = get_account(trading_account, '1020')
+            equity_account = get_account(trading_account, '3010')
 
-            total_value = quantity * price_usd
+            total_value = _money(quantity * price_usd)
 
             # ۳. ایجاد سند حسابداری صحیح
-            entry = JournalEntry.objects.create(
-                entry_date=timezone.now().date(),
-                description=f"Deposit of {quantity} {asset.symbol}: {description}",
-                posted_by=user
+            return post_entry(
+                JournalEntry(
+                    entry_date=timezone.now().date(),
+                    description=f"Deposit of {quantity} {asset.symbol}: {description}",
+                    posted_by=user,
+                    entry_type=JournalEntry.SPOT_DEPOSIT,
+                    asset_lot=lot
+                ),
+                [
+                    # بدهکار: حساب نگهداری دارایی‌های اسپات افزایش می‌یابد
+                    JournalEntryLine(account=asset_holding_account, debit_amount=total_value),
+                    # بستانکار: سرمایه کاربر در سیستم افزایش می‌یابد
+                    JournalEntryLine(account=equity_account, credit_amount=total_value),
+                ]
             )
-
-            # بدهکار: حساب نگهداری دارایی‌های اسپات افزایش می‌یابد
-            JournalEntryLine.objects.create(
-                journal_entry=entry,
-                account=asset_holding_account,
-                debit_amount=total_value
-            )
-
-            # بستانکار: سرمایه کاربر در سیستم افزایش می‌یابد
-            JournalEntryLine.objects.create(
-                journal_entry=entry,
-                account=equity_account,
-                credit_amount=total_value
-            )
-            return entry
             
         except ChartOfAccount.DoesNotExist as e:
             raise ValueError(f"حسابداری برای {trading_account.name} به درستی تنظیم نشده است. جزئیات: {e}")
@@ -509,81 +917,71 @@ def withdraw_spot_asset(trading_account, asset, quantity, price_usd, description
         if quantity <= 0 or price_usd <= 0:
             raise ValueError("مقدار و قیمت باید اعداد مثبت باشند.")
 
+        # ۱. قفل حساب تا هیچ تراکنش دیگری همزمان از همین دسته‌ها برداشت نکند
+        lock_trading_accounts(trading_account)
+
         # ۲. بررسی موجودی کافی دارایی در تمام دسته‌های خرید (Lots)
-        available_quantity = AssetLot.objects.filter(
-            trading_account=trading_account,
-            asset=asset,
-            remaining_quantity__gt=0
-        ).aggregate(total=Sum('remaining_quantity'))['total'] or Decimal('0.00')
+        lot_queue = LotQueue.load(trading_account, asset, for_update=True)
 
-        if available_quantity < quantity:
-            raise ValueError(f"موجودی {asset.symbol} برای برداشت کافی نیست. موجودی: {available_quantity}، تلاش برای برداشت: {quantity}")
+        if lot_queue.quantity < quantity:
+            raise ValueError(f"موجودی {asset.symbol} برای برداشت کافی نیست. موجودی: {lot_queue.quantity}، تلاش برای برداشت: {quantity}")
 
         try:
             # ۳. محاسبه هزینه تمام شده (COGS) دارایی‌های برداشتی
-            lots_to_withdraw_from = AssetLot.objects.filter(
-                trading_account=trading_account,
-                asset=asset,
-                remaining_quantity__gt=0
-            ).order_by('purchase_date')
-
-            remaining_to_withdraw = quantity
-            cost_of_asset_withdrawn = Decimal('0.00')
-
-            for lot in lots_to_withdraw_from:
-                if remaining_to_withdraw <= 0:
-                    break
-                
-                withdraw_from_this_lot = min(lot.remaining_quantity, remaining_to_withdraw)
-                cost_of_asset_withdrawn += withdraw_from_this_lot * lot.purchase_price_usd
-                lot.remaining_quantity -= withdraw_from_this_lot
-                lot.save()
-                remaining_to_withdraw -= withdraw_from_this_lot
+            consumptions = _consume_lots(lot_queue, quantity)
+            cost_of_asset_withdrawn = sum((consumption.cost for consumption in consumptions), Decimal('0.00'))
 
             # ۴. محاسبه سود یا زیان شناسایی‌شده از این واگذاری
-            total_value_withdrawn = quantity * price_usd
+            # مبالغ پیش از محاسبه سود/زیان گرد می‌شوند تا سند دقیقا تراز بماند
+            total_value_withdrawn = _money(quantity * price_usd)
+            cost_of_asset_withdrawn = _money(cost_of_asset_withdrawn)
             realized_pnl = total_value_withdrawn - cost_of_asset_withdrawn
             
             # ۵. پیدا کردن یا ساختن حساب‌های لازم
-            asset_holding_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='1020')
-            equity_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='3010')
+            asset_holding_account = get_account(trading_account, '1020')
+            equity_account = get_account(trading_account, '3010')
             
             if realized_pnl > 0:
-                parent_revenue_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='4000')
-                pnl_account, _ = ChartOfAccount.objects.get_or_create(
-                    trading_account=trading_account, account_number='4030', 
-                    defaults={'account_name': 'Realized Gain on Spot Sale', 'account_type': REVENUE, 'parent_account': parent_revenue_account}
+                pnl_account = get_or_create_account(
+                    trading_account, '4030',
+                    account_name='Realized Gain on Spot Sale', account_type=REVENUE,
+                    parent_account=get_account(trading_account, '4000')
                 )
             elif realized_pnl < 0:
-                parent_expense_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='5000')
-                pnl_account, _ = ChartOfAccount.objects.get_or_create(
-                    trading_account=trading_account, account_number='5030', 
-                    defaults={'account_name': 'Realized Loss on Spot Sale', 'account_type': EXPENSE, 'parent_account': parent_expense_account}
+                pnl_account = get_or_create_account(
+                    trading_account, '5030',
+                    account_name='Realized Loss on Spot Sale', account_type=EXPENSE,
+                    parent_account=get_account(trading_account, '5000')
                 )
             else:
                 pnl_account = None
 
-            # ۶. ایجاد هدر سند حسابداری
-            entry = JournalEntry.objects.create(
-                entry_date=timezone.now().date(),
-                description=f"Withdrawal: {quantity} {asset.symbol} | PnL: {realized_pnl} | {description}",
-                posted_by=user
-            )
-
-            # ۷. ثبت آرتیکل‌های سند حسابداری
-            # بدهکار: سرمایه کاربر به اندازه ارزش روز دارایی برداشت شده، کاهش می‌یابد
-            JournalEntryLine.objects.create(journal_entry=entry, account=equity_account, debit_amount=total_value_withdrawn)
-            
-            # بستانکار: دارایی از دفاتر با قیمت تمام شده اولیه خارج می‌شود
-            JournalEntryLine.objects.create(journal_entry=entry, account=asset_holding_account, credit_amount=cost_of_asset_withdrawn)
+            # ۶. آرتیکل‌های سند حسابداری
+            lines = [
+                # بدهکار: سرمایه کاربر به اندازه ارزش روز دارایی برداشت شده، کاهش می‌یابد
+                JournalEntryLine(account=equity_account, debit_amount=total_value_withdrawn),
+                # بستانکار: دارایی از دفاتر با قیمت تمام شده اولیه خارج می‌شود
+                JournalEntryLine(account=asset_holding_account, credit_amount=cost_of_asset_withdrawn),
+            ]
             
             # ثبت سود یا زیان شناسایی‌شده برای تراز کردن سند
             if realized_pnl > 0:
-                JournalEntryLine.objects.create(journal_entry=entry, account=pnl_account, credit_amount=realized_pnl)
+                lines.append(JournalEntryLine(account=pnl_account, credit_amount=realized_pnl))
             elif realized_pnl < 0:
-                JournalEntryLine.objects.create(journal_entry=entry, account=pnl_account, debit_amount=abs(realized_pnl))
-            
-            return entry
+                lines.append(JournalEntryLine(account=pnl_account, debit_amount=abs(realized_pnl)))
+
+            # ۷. ثبت سند حسابداری و دسته‌های مصرف‌شده آن
+            journal_entry = post_entry(
+                JournalEntry(
+                    entry_date=timezone.now().date(),
+                    description=f"Withdrawal: {quantity} {asset.symbol} | PnL: {realized_pnl} | {description}",
+                    posted_by=user,
+                    entry_type=JournalEntry.SPOT_WITHDRAWAL
+                ),
+                lines
+            )
+            _record_lot_consumptions(journal_entry, consumptions)
+            return journal_entry
 
         except ChartOfAccount.DoesNotExist as e:
             raise ValueError(f"حسابداری برای {trading_account.name} به درستی تنظیم نشده است. جزئیات: {e}")
@@ -601,7 +999,8 @@ def execute_spot_buy(trading_account, asset, quantity: Decimal, trade_cost: Deci
         if quantity <= 0 or trade_cost <= 0:
             raise ValueError("مقدار و هزینه معامله باید اعداد مثبت باشند.")
 
-        # ۲. بررسی موجودی نقد با استفاده از تابع کمکی
+        # ۲. بررسی موجودی نقد با استفاده از تابع کمکی (پس از قفل حساب، تا موجودی تا ثبت سند تغییر نکند)
+        lock_trading_accounts(trading_account)
         current_cash_balance = get_cash_balance(trading_account)
         if current_cash_balance < trade_cost:
             raise ValueError(f"موجودی نقد کافی نیست. موجودی: {current_cash_balance}, مورد نیاز: {trade_cost}")
@@ -609,12 +1008,12 @@ def execute_spot_buy(trading_account, asset, quantity: Decimal, trade_cost: Deci
         try:
             # ۳. پیدا کردن حساب‌های مورد نیاز از سرفصل‌ها
             # ما از .get() استفاده می‌کنیم چون مطمئن هستیم این حساب‌ها باید از قبل وجود داشته باشند
-            cash_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='1010')
-            asset_holding_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='1020')
+            cash_account = get_account(trading_account, '1010')
+            asset_holding_account = get_account(trading_account, '1020')
 
             # ۴. ایجاد دسته خرید (AssetLot) برای دارایی خریداری شده
             purchase_price_usd = trade_cost / quantity
-            AssetLot.objects.create(
+            lot = AssetLot.objects.create(
                 asset=asset,
                 trading_account=trading_account,
                 quantity=quantity,
@@ -622,28 +1021,22 @@ def execute_spot_buy(trading_account, asset, quantity: Decimal, trade_cost: Deci
                 # فیلد remaining_quantity به صورت خودکار در متد save مدل پر می‌شود
             )
 
-            # ۵. ایجاد هدر سند حسابداری
-            entry = JournalEntry.objects.create(
-                entry_date=timezone.now().date(),
-                description=f"Spot Buy: {quantity} {asset.symbol} | {description}",
-                posted_by=user
-            )
-
-            # ۶. ثبت آرتیکل‌های سند حسابداری
-            # بدهکار: ارزش دارایی‌های اسپات ما افزایش می‌یابد
-            JournalEntryLine.objects.create(
-                journal_entry=entry,
-                account=asset_holding_account,
-                debit_amount=trade_cost
-            )
-            # بستانکار: موجودی نقد ما کاهش می‌یابد
-            JournalEntryLine.objects.create(
-                journal_entry=entry,
-                account=cash_account,
-                credit_amount=trade_cost
+            # ۵. ثبت سند حسابداری به همراه آرتیکل‌ها
+            return post_entry(
+                JournalEntry(
+                    entry_date=timezone.now().date(),
+                    description=f"Spot Buy: {quantity} {asset.symbol} | {description}",
+                    posted_by=user,
+                    entry_type=JournalEntry.SPOT_BUY,
+                    asset_lot=lot
+                ),
+                [
+                    # بدهکار: ارزش دارایی‌های اسپات ما افزایش می‌یابد
+                    JournalEntryLine(account=asset_holding_account, debit_amount=trade_cost),
+                    # بستانکار: موجودی نقد ما کاهش می‌یابد
+                    JournalEntryLine(account=cash_account, credit_amount=trade_cost),
+                ]
             )
-            
-            return entry
 
         except ChartOfAccount.DoesNotExist as e:
             # این خطا یعنی ساختار حسابداری برای این حساب کامل نیست
@@ -658,155 +1051,1027 @@ def execute_spot_sell(trading_account, asset, quantity: Decimal, sale_proceeds:
         if quantity <= 0 or sale_proceeds <= 0:
             raise ValueError("مقدار و مبلغ فروش باید اعداد مثبت باشند.")
 
+        # قفل حساب تا هیچ تراکنش دیگری همزمان از همین دسته‌ها نفروشد
+        lock_trading_accounts(trading_account)
+
         # ۲. بررسی موجودی کافی دارایی در تمام دسته‌های خرید (Lots)
-        available_quantity = AssetLot.objects.filter(
-            trading_account=trading_account,
-            asset=asset,
-            remaining_quantity__gt=0
-        ).aggregate(total=Sum('remaining_quantity'))['total'] or Decimal('0.00')
+        lot_queue = LotQueue.load(trading_account, asset, for_update=True)
 
-        if available_quantity < quantity:
-            raise ValueError(f"موجودی {asset.symbol} برای فروش کافی نیست. موجودی: {available_quantity}، تلاش برای فروش: {quantity}")
+        if lot_queue.quantity < quantity:
+            raise ValueError(f"موجودی {asset.symbol} برای فروش کافی نیست. موجودی: {lot_queue.quantity}، تلاش برای فروش: {quantity}")
 
         try:
-            # ۳. محاسبه هزینه تمام شده (COGS) قبل از هر تغییری در دیتابیس
-            lots_to_sell_from = AssetLot.objects.filter(
-                trading_account=trading_account,
-                asset=asset,
-                remaining_quantity__gt=0
-            ).order_by('purchase_date')
-
-            remaining_to_sell = quantity
-            cost_of_goods_sold = Decimal('0.00')
-
-            for lot in lots_to_sell_from:
-                if remaining_to_sell <= 0:
-                    break
-                
-                sell_from_this_lot = min(lot.remaining_quantity, remaining_to_sell)
-                cost_of_goods_sold += sell_from_this_lot * lot.purchase_price_usd
-                lot.remaining_quantity -= sell_from_this_lot
-                lot.save()
-                remaining_to_sell -= sell_from_this_lot
+            # ۳. محاسبه هزینه تمام شده (COGS) به روش FIFO
+            consumptions = _consume_lots(lot_queue, quantity)
+            cost_of_goods_sold = sum((consumption.cost for consumption in consumptions), Decimal('0.00'))
 
             # ۴. محاسبه سود یا زیان شناسایی‌شده
+            # مبالغ پیش از محاسبه سود/زیان گرد می‌شوند تا سند دقیقا تراز بماند
+            sale_proceeds = _money(sale_proceeds)
+            cost_of_goods_sold = _money(cost_of_goods_sold)
             realized_pnl = sale_proceeds - cost_of_goods_sold
             
             # ۵. پیدا کردن حساب‌های اصلی و ایجاد حساب‌های سود/زیان در صورت نیاز
-            cash_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='1010')
-            asset_holding_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='1020')
+            cash_account = get_account(trading_account, '1010')
+            asset_holding_account = get_account(trading_account, '1020')
 
             if realized_pnl > 0:
-                # پیدا کردن حساب مادر "درآمدها"
-                parent_revenue_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='4000')
-                # ساخت حساب سود به عنوان زیرمجموعه آن
-                pnl_account, _ = ChartOfAccount.objects.get_or_create(
-                    trading_account=trading_account,
-                    account_number='4030', 
-                    defaults={
-                        'account_name': 'Realized Gain on Spot Sale', 
-                        'account_type': REVENUE,
-                        'parent_account': parent_revenue_account
-                    }
+                # ساخت حساب سود به عنوان زیرمجموعه حساب مادر "درآمدها"
+                pnl_account = get_or_create_account(
+                    trading_account, '4030',
+                    account_name='Realized Gain on Spot Sale',
+                    account_type=REVENUE,
+                    parent_account=get_account(trading_account, '4000')
                 )
             elif realized_pnl < 0:
-                # پیدا کردن حساب مادر "هزینه‌ها"
-                parent_expense_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='5000')
-                # ساخت حساب زیان به عنوان زیرمجموعه آن
-                pnl_account, _ = ChartOfAccount.objects.get_or_create(
-                    trading_account=trading_account,
-                    account_number='5030', 
-                    defaults={
-                        'account_name': 'Realized Loss on Spot Sale', 
-                        'account_type': EXPENSE,
-                        'parent_account': parent_expense_account
-                    }
+                # ساخت حساب زیان به عنوان زیرمجموعه حساب مادر "هزینه‌ها"
+                pnl_account = get_or_create_account(
+                    trading_account, '5030',
+                    account_name='Realized Loss on Spot Sale',
+                    account_type=EXPENSE,
+                    parent_account=get_account(trading_account, '5000')
                 )
             else:
                 pnl_account = None # برای معاملات سر به سر
 
-            # ۶. ایجاد هدر سند حسابداری
-            entry = JournalEntry.objects.create(
-                entry_date=timezone.now().date(),
-                description=f"Spot Sell: {quantity} {asset.symbol} | PnL: {realized_pnl} | {description}",
-                posted_by=user
-            )
-
-            # ۷. ثبت آرتیکل‌های سند حسابداری
-            JournalEntryLine.objects.create(journal_entry=entry, account=cash_account, debit_amount=sale_proceeds)
-            JournalEntryLine.objects.create(journal_entry=entry, account=asset_holding_account, credit_amount=cost_of_goods_sold)
+            # ۶. آرتیکل‌های سند حسابداری
+            lines = [
+                JournalEntryLine(account=cash_account, debit_amount=sale_proceeds),
+                JournalEntryLine(account=asset_holding_account, credit_amount=cost_of_goods_sold),
+            ]
             
             if realized_pnl > 0:
-                JournalEntryLine.objects.create(journal_entry=entry, account=pnl_account, credit_amount=realized_pnl)
+                lines.append(JournalEntryLine(account=pnl_account, credit_amount=realized_pnl))
             elif realized_pnl < 0:
-                JournalEntryLine.objects.create(journal_entry=entry, account=pnl_account, debit_amount=abs(realized_pnl))
-            
-            return entry
+                lines.append(JournalEntryLine(account=pnl_account, debit_amount=abs(realized_pnl)))
+
+            # ۷. ثبت سند حسابداری و دسته‌های مصرف‌شده آن
+            journal_entry = post_entry(
+                JournalEntry(
+                    entry_date=timezone.now().date(),
+                    description=f"Spot Sell: {quantity} {asset.symbol} | PnL: {realized_pnl} | {description}",
+                    posted_by=user,
+                    entry_type=JournalEntry.SPOT_SELL
+                ),
+                lines
+            )
+            _record_lot_consumptions(journal_entry, consumptions)
+            return journal_entry
 
         except ChartOfAccount.DoesNotExist as e:
             raise ValueError(f"حسابداری برای {trading_account.name} به درستی تنظیم نشده است. جزئیات: {e}")
-        
-        
+
+
+def reverse_spot_disposal(journal_entry, user, description=''):
+    """
+    یک سند فروش یا برداشت اسپات را برگشت می‌زند: مقادیر مصرف‌شده از روی جدول
+    LotConsumption به همان دسته‌ها بازگردانده می‌شوند (بدون اجرای مجدد FIFO)
+    و یک سند معکوس با همان مبالغ صادر می‌شود.
+    """
+    with transaction.atomic():
+        if journal_entry.entry_type not in (JournalEntry.SPOT_SELL, JournalEntry.SPOT_WITHDRAWAL):
+            raise ValueError("فقط اسناد فروش یا برداشت اسپات قابل برگشت هستند.")
+
+        consumptions = list(journal_entry.lot_consumptions.select_related('lot__trading_account'))
+        if not consumptions:
+            raise ValueError(f"برای سند #{journal_entry.id} سابقه مصرف دسته‌های خرید ثبت نشده است.")
+
+        lock_trading_accounts(consumptions[0].lot.trading_account)
+        if journal_entry.reversals.exists():
+            raise ValueError(f"سند #{journal_entry.id} قبلا برگشت خورده است.")
+
+        # ۱. بازگرداندن مقادیر به دسته‌ها با یک خواندن قفل‌شده و یک bulk_update
+        lots = AssetLot.objects.select_for_update().in_bulk([consumption.lot_id for consumption in consumptions])
+        for consumption in consumptions:
+            lots[consumption.lot_id].remaining_quantity += consumption.quantity
+        AssetLot.objects.bulk_update(lots.values(), ['remaining_quantity'])
+
+        # ۲. سند معکوس: جای بدهکار و بستانکار هر آرتیکل عوض می‌شود
+        return post_entry(
+            JournalEntry(
+                entry_date=timezone.now().date(),
+                description=f"Reversal of Entry #{journal_entry.id}: {description or journal_entry.description}",
+                posted_by=user,
+                entry_type=JournalEntry.REVERSAL,
+                reversal_of=journal_entry
+            ),
+            [
+                JournalEntryLine(account_id=line.account_id, debit_amount=line.credit_amount, credit_amount=line.debit_amount)
+                for line in journal_entry.journalentryline_set.all()
+            ]
+        )
+
+
+RETAINED_EARNINGS_ACCOUNT = '3090'
+
+
+def close_fiscal_period(trading_account, end_date, user):
+    """
+    دوره مالی بعدی حساب معاملاتی را تا end_date (شامل) می‌بندد.
+    دوره از روز بعد از آخرین دوره بسته شده (یا تاریخ اولین سند) شروع می‌شود.
+    مانده تمام سرفصل‌های درآمد و هزینه با یک سند CLOSING به سود انباشته (3090)
+    منتقل می‌شود، مانده‌های پایان دوره در PeriodClosingBalance ذخیره می‌شوند و
+    از این پس هیچ آرتیکلی با تاریخ داخل دوره قابل ثبت، ویرایش یا حذف نیست.
+    """
+    if end_date > timezone.now().date():
+        raise ValueError("دوره مالی آینده را نمی‌توان بست.")
+
+    with transaction.atomic():
+        lock_trading_accounts(trading_account)
+
+        last_end = FiscalPeriod.objects.filter(trading_account=trading_account).aggregate(last_end=Max('end_date'))['last_end']
+        if last_end is not None:
+            if end_date <= last_end:
+                raise ValueError(f"دوره مالی تا تاریخ {last_end} قبلا بسته شده است.")
+            start_date = last_end + timedelta(days=1)
+        else:
+            first_date = JournalEntryLine.objects.filter(
+                account__trading_account=trading_account
+            ).aggregate(first_date=Min('journal_entry__entry_date'))['first_date']
+            start_date = min(first_date or end_date, end_date)
+
+        accounts = get_chart_of_accounts(trading_account)
+        retained_earnings = get_or_create_account(
+            trading_account,
+            RETAINED_EARNINGS_ACCOUNT,
+            account_name='Retained Earnings',
+            account_name_fa=translate_account_name_to_farsi('Retained Earnings'),
+            account_type=EQUITY,
+            parent_account=accounts.get('3000')
+        )
+        accounts_by_id = {account.id: account for account in accounts.values()}
+        accounts_by_id[retained_earnings.id] = retained_earnings
+
+        # دوره‌های قبلی بسته شده‌اند، پس مانده تجمعی درآمد/هزینه همان خالص این دوره است
+        totals = get_account_totals(trading_account, as_of=end_date)
+        closing_lines = []
+        net_income = Decimal('0.00')
+        for account_id, (debit_total, credit_total) in totals.items():
+            account = accounts_by_id.get(account_id)
+            if account is None or account.account_type not in (REVENUE, EXPENSE):
+                continue
+            balance = debit_total - credit_total
+            if not balance:
+                continue
+            net_income -= balance
+            closing_lines.append(JournalEntryLine(
+                account=account,
+                debit_amount=-balance if balance < 0 else Decimal('0.00'),
+                credit_amount=balance if balance > 0 else Decimal('0.00')
+            ))
+
+        closing_entry = None
+        if closing_lines:
+            closing_lines.append(JournalEntryLine(
+                account=retained_earnings,
+                debit_amount=-net_income if net_income < 0 else Decimal('0.00'),
+                credit_amount=net_income if net_income > 0 else Decimal('0.00')
+            ))
+            closing_entry = post_entry(
+                JournalEntry(
+                    entry_date=end_date,
+                    description=f"Closing entry for period {start_date} - {end_date}",
+                    posted_by=user,
+                    entry_type=JournalEntry.CLOSING
+                ),
+                closing_lines
+            )
+
+        period = FiscalPeriod.objects.create(
+            trading_account=trading_account,
+            start_date=start_date,
+            end_date=end_date,
+            closed_by=user,
+            closing_entry=closing_entry
+        )
+
+        # گردش دوره (بدون سند بستن) با یک پرس‌وجوی گروه‌بندی شده
+        activity = {
+            account_id: (debit, credit)
+            for account_id, debit, credit in JournalEntryLine.objects.filter(
+                account__trading_account=trading_account,
+                journal_entry__entry_date__gte=start_date,
+                journal_entry__entry_date__lte=end_date
+            ).exclude(
+                journal_entry__entry_type=JournalEntry.CLOSING
+            ).values('account_id').annotate(
+                debit=Sum('debit_amount'), credit=Sum('credit_amount')
+            ).values_list('account_id', 'debit', 'credit').order_by()
+        }
+        for line in closing_lines:
+            debit_total, credit_total = totals.get(line.account_id, (Decimal('0.00'), Decimal('0.00')))
+            totals[line.account_id] = (debit_total + line.debit_amount, credit_total + line.credit_amount)
+
+        PeriodClosingBalance.objects.bulk_create([
+            PeriodClosingBalance(
+                period=period,
+                account_id=account_id,
+                debit_total=totals.get(account_id, (Decimal('0.00'), Decimal('0.00')))[0],
+                credit_total=totals.get(account_id, (Decimal('0.00'), Decimal('0.00')))[1],
+                period_debit=activity.get(account_id, (Decimal('0.00'), Decimal('0.00')))[0],
+                period_credit=activity.get(account_id, (Decimal('0.00'), Decimal('0.00')))[1]
+            )
+            for account_id in sorted(set(totals) | set(activity))
+        ], batch_size=1000)
+        bump_ledger_version(trading_account.pk)
+
+    return period
+
+
+def reopen_fiscal_period(trading_account):
+    """
+    آخرین دوره مالی بسته شده را دوباره باز می‌کند: دوره و مانده‌های ذخیره شده آن
+    حذف می‌شوند و سند بستن آن برگشت داده می‌شود (حذف می‌شود).
+    """
+    with transaction.atomic():
+        lock_trading_accounts(trading_account)
+        period = FiscalPeriod.objects.filter(trading_account=trading_account).order_by('-end_date').first()
+        if period is None:
+            raise ValueError("هیچ دوره مالی بسته شده‌ای برای این حساب وجود ندارد.")
+        closing_entry = period.closing_entry
+        period.delete()
+        if closing_entry is not None:
+            closing_entry.delete()
+        bump_ledger_version(trading_account.pk)
+    return period
+
+
 def generate_income_statement(trading_account, start_date, end_date):
     """
     Generates an income statement for a given trading account within a specified date range.
+    مبالغ هر سرفصل درآمد/هزینه با یک پرس‌وجوی گروه‌بندی شده در دیتابیس جمع زده می‌شوند
+    (تعداد پرس‌وجوها به حجم تاریخچه بستگی ندارد) و سپس در درخت parent_account به سمت
+    سرفصل‌های مادر جمع می‌شوند. برای دوره‌های مالی بسته شده داخل بازه، گردش ذخیره شده
+    در PeriodClosingBalance جایگزین جمع آرتیکل‌ها می‌شود و سند بستن دوره نادیده گرفته می‌شود.
+
+    خروجی:
+        revenues / expenses: {account_name: amount} برای سرفصل‌هایی که در بازه آرتیکل دارند
+        total_revenues / total_expenses / net_profit_loss
+        revenue_tree / expense_tree: گره‌های ریشه؛ هر گره شامل amount (مبلغ خود سرفصل)،
+            total (مبلغ خود و تمام زیرمجموعه‌ها) و children است
     """
+    # دوره‌های بسته شده‌ای که کاملا داخل بازه هستند پشت سر هم‌اند؛ گردش آن‌ها از
+    # PeriodClosingBalance خوانده می‌شود و آرتیکل‌ها فقط بیرون از این بلوک جمع زده می‌شوند
+    periods = list(FiscalPeriod.objects.filter(
+        trading_account=trading_account,
+        start_date__gte=start_date,
+        end_date__lte=end_date
+    ).order_by('start_date').values_list('id', 'start_date', 'end_date'))
+
+    in_range = Q(
+        journalentryline__journal_entry__entry_date__gte=start_date,
+        journalentryline__journal_entry__entry_date__lte=end_date
+    )
+    if periods:
+        in_range &= (
+            Q(journalentryline__journal_entry__entry_date__lt=periods[0][1]) |
+            Q(journalentryline__journal_entry__entry_date__gt=periods[-1][2])
+        )
+    in_range &= ~Q(journalentryline__journal_entry__entry_type=JournalEntry.CLOSING)
+
+    stored = {}
+    if periods:
+        stored = {
+            account_id: (debit, credit)
+            for account_id, debit, credit in PeriodClosingBalance.objects.filter(
+                period_id__in=[period_id for period_id, _, _ in periods],
+                account__account_type__in=[REVENUE, EXPENSE]
+            ).values('account_id').annotate(
+                debit=Sum('period_debit'), credit=Sum('period_credit')
+            ).values_list('account_id', 'debit', 'credit').order_by()
+        }
+
+    accounts = ChartOfAccount.objects.filter(
+        trading_account=trading_account,
+        account_type__in=[REVENUE, EXPENSE]
+    ).annotate(
+        total_debit=Sum('journalentryline__debit_amount', filter=in_range),
+        total_credit=Sum('journalentryline__credit_amount', filter=in_range)
+    ).values_list(
+        'id', 'account_number', 'account_name', 'account_type', 'parent_account_id', 'total_debit', 'total_credit'
+    ).order_by('account_number')
+
     income_statement_data = {
         'revenues': {},
         'expenses': {},
-        'net_profit_loss': Decimal('0.00')
+        'total_revenues': Decimal('0.00'),
+        'total_expenses': Decimal('0.00'),
+        'net_profit_loss': Decimal('0.00'),
+        'revenue_tree': [],
+        'expense_tree': [],
     }
 
-    # Get all journal entry lines for the trading account within the date range
-    # that are related to Revenue or Expense accounts.
-    relevant_lines = JournalEntryLine.objects.filter(
-        journal_entry__entry_date__range=[start_date, end_date],
-        account__trading_account=trading_account,
-        account__account_type__in=[ChartOfAccount.REVENUE, ChartOfAccount.EXPENSE]
-    )
-
-    total_revenues = Decimal('0.00')
-    total_expenses = Decimal('0.00')
+    nodes = {}
+    for account_id, number, name, account_type, parent_id, total_debit, total_credit in accounts:
+        amount = Decimal('0.00')
+        if account_id in stored:
+            stored_debit, stored_credit = stored[account_id]
+            total_debit = (total_debit or Decimal('0.00')) + stored_debit
+            total_credit = (total_credit or Decimal('0.00')) + stored_credit
+        if total_debit is not None:
+            if account_type == REVENUE:
+                # Revenues increase with credits, decrease with debits
+                amount = total_credit - total_debit
+                income_statement_data['revenues'][name] = income_statement_data['revenues'].get(name, Decimal('0.00')) + amount
+                income_statement_data['total_revenues'] += amount
+            else:
+                # Expenses increase with debits, decrease with credits
+                amount = total_debit - total_credit
+                income_statement_data['expenses'][name] = income_statement_data['expenses'].get(name, Decimal('0.00')) + amount
+                income_statement_data['total_expenses'] += amount
+
+        nodes[account_id] = {
+            'account_id': account_id,
+            'account_number': number,
+            'account_name': name,
+            'account_type': account_type,
+            'parent_id': parent_id,
+            'amount': amount,
+            'total': amount,
+            'children': [],
+        }
+
+    # ساخت درخت و جمع کردن مبالغ هر سرفصل در تمام سرفصل‌های مادر آن
+    for node in nodes.values():
+        parent = nodes.get(node['parent_id'])
+        if parent is not None:
+            parent['children'].append(node)
+        else:
+            tree = 'revenue_tree' if node['account_type'] == REVENUE else 'expense_tree'
+            income_statement_data[tree].append(node)
 
-    for line in relevant_lines:
-        account_name = line.account.account_name
-        if line.account.account_type == ChartOfAccount.REVENUE:
-            # Revenues increase with credits, decrease with debits
-            amount = line.credit_amount - line.debit_amount
-            income_statement_data['revenues'][account_name] = income_statement_data['revenues'].get(account_name, Decimal('0.00')) + amount
-            total_revenues += amount
-        elif line.account.account_type == ChartOfAccount.EXPENSE:
-            # Expenses increase with debits, decrease with credits
-            amount = line.debit_amount - line.credit_amount
-            income_statement_data['expenses'][account_name] = income_statement_data['expenses'].get(account_name, Decimal('0.00')) + amount
-            total_expenses += amount
+        ancestor, seen = parent, {node['account_id']}
+        while ancestor is not None and ancestor['account_id'] not in seen:
+            ancestor['total'] += node['amount']
+            seen.add(ancestor['account_id'])
+            ancestor = nodes.get(ancestor['parent_id'])
 
-    income_statement_data['net_profit_loss'] = total_revenues - total_expenses
+    income_statement_data['net_profit_loss'] = income_statement_data['total_revenues'] - income_statement_data['total_expenses']
 
     return income_statement_data
 
 
+def _template_account_names(template=CHART_OF_ACCOUNTS_TEMPLATE, names=None):
+    """
+    نام عمومی هر شماره حساب الگو، بدون نام حساب معاملاتی (مثلا 'Cash' برای 1010).
+    """
+    if names is None:
+        names = {}
+    for spec in template:
+        names[spec['number']] = spec['name'].replace(' - {account_name}', '')
+        _template_account_names(spec.get('children', []), names)
+    return names
+
+
+TEMPLATE_ACCOUNT_NAMES = _template_account_names()
+
+
+def _consolidate_rows(rows, trading_account_ids, per_account):
+    """
+    ردیف‌های گروه‌بندی شده (account_number, account_type, trading_account_id, account_name, amount)
+    را به ازای شماره و نوع حساب جمع می‌زند. در صورت per_account، مبلغ هر حساب معاملاتی
+    در per_account (به ترتیب trading_account_ids) هم برگردانده می‌شود.
+    """
+    consolidated = {}
+    for number, account_type, trading_account_id, name, amount in rows:
+        row = consolidated.get((number, account_type))
+        if row is None:
+            row = consolidated[(number, account_type)] = {
+                'account_number': number,
+                'account_name': TEMPLATE_ACCOUNT_NAMES.get(number, name),
+                'account_type': account_type,
+                'amount': Decimal('0.00'),
+            }
+            if per_account:
+                row['per_account'] = dict.fromkeys(trading_account_ids, Decimal('0.00'))
+        row['amount'] += amount
+        if per_account:
+            row['per_account'][trading_account_id] += amount
+
+    rows = [consolidated[key] for key in sorted(consolidated)]
+    if per_account:
+        for row in rows:
+            row['per_account'] = [row['per_account'][trading_account_id] for trading_account_id in trading_account_ids]
+    return rows
+
+
+def _sum_rows(rows, per_account, count):
+    total = sum((row['amount'] for row in rows), Decimal('0.00'))
+    if not per_account:
+        return total, None
+    return total, [sum((row['per_account'][i] for row in rows), Decimal('0.00')) for i in range(count)]
+
+
+def generate_consolidated_income_statement(trading_accounts, start_date, end_date, per_account=False):
+    """
+    صورت سود و زیان تجمیعی چند حساب معاملاتی.
+    آرتیکل‌های درآمد/هزینه همه حساب‌ها با یک پرس‌وجوی گروه‌بندی شده (شماره حساب، نوع و
+    در صورت per_account حساب معاملاتی) جمع زده می‌شوند؛ اسناد بستن دوره نادیده گرفته می‌شوند.
+
+    خروجی:
+        trading_account_ids: ترتیب ستون‌های per_account
+        revenues / expenses: لیست ردیف‌ها با account_number، account_name، account_type، amount
+            (و per_account در صورت درخواست)
+        total_revenues / total_expenses / net_profit_loss (و *_per_account در صورت درخواست)
+    """
+    trading_account_ids = sorted({getattr(trading_account, 'pk', trading_account) for trading_account in trading_accounts})
+    group_by = ['account__account_number', 'account__account_type']
+    if per_account:
+        group_by.append('account__trading_account_id')
+
+    rows = JournalEntryLine.objects.filter(
+        account__trading_account__in=trading_account_ids,
+        account__account_type__in=[REVENUE, EXPENSE],
+        journal_entry__entry_date__gte=start_date,
+        journal_entry__entry_date__lte=end_date
+    ).exclude(
+        journal_entry__entry_type=JournalEntry.CLOSING
+    ).values(*group_by).annotate(
+        name=Min('account__account_name'),
+        debit=Sum('debit_amount'),
+        credit=Sum('credit_amount')
+    ).values_list(*group_by, 'name', 'debit', 'credit').order_by()
+
+    revenue_rows, expense_rows = [], []
+    for row in rows:
+        if per_account:
+            number, account_type, trading_account_id, name, debit, credit = row
+        else:
+            (number, account_type, name, debit, credit), trading_account_id = row, None
+        if account_type == REVENUE:
+            revenue_rows.append((number, account_type, trading_account_id, name, credit - debit))
+        else:
+            expense_rows.append((number, account_type, trading_account_id, name, debit - credit))
+
+    report = {
+        'trading_account_ids': trading_account_ids,
+        'revenues': _consolidate_rows(revenue_rows, trading_account_ids, per_account),
+        'expenses': _consolidate_rows(expense_rows, trading_account_ids, per_account),
+    }
+    count = len(trading_account_ids)
+    report['total_revenues'], revenues_per_account = _sum_rows(report['revenues'], per_account, count)
+    report['total_expenses'], expenses_per_account = _sum_rows(report['expenses'], per_account, count)
+    report['net_profit_loss'] = report['total_revenues'] - report['total_expenses']
+    if per_account:
+        report['total_revenues_per_account'] = revenues_per_account
+        report['total_expenses_per_account'] = expenses_per_account
+        report['net_profit_loss_per_account'] = [
+            revenue - expense for revenue, expense in zip(revenues_per_account, expenses_per_account)
+        ]
+    return report
+
+
+def generate_consolidated_balance_sheet(trading_accounts, as_of=None, per_account=False):
+    """
+    ترازنامه تجمیعی چند حساب معاملاتی.
+    مانده سرفصل‌های دارایی، بدهی و حقوق صاحبان سهام همه حساب‌ها با یک پرس‌وجوی
+    گروه‌بندی شده از مانده‌های جاری (یا مانده روزانه as_of) خوانده می‌شود.
+
+    خروجی:
+        trading_account_ids، assets / liabilities / equity (ردیف‌ها مانند صورت سود و زیان تجمیعی)،
+        total_assets / total_liabilities / total_equity / total_liabilities_and_equity
+        (و *_per_account در صورت درخواست)
+    """
+    trading_account_ids = sorted({getattr(trading_account, 'pk', trading_account) for trading_account in trading_accounts})
+    group_by = ['account_number', 'account_type']
+    if per_account:
+        group_by.append('trading_account_id')
+
+    accounts = ChartOfAccount.objects.filter(
+        trading_account__in=trading_account_ids,
+        account_type__in=[ASSET, LIABILITY, EQUITY]
+    )
+    if as_of is not None:
+        snapshots = AccountDailyBalance.objects.filter(account=OuterRef('pk'), date__lte=as_of).order_by('-date')
+        accounts = accounts.annotate(
+            debit_total=Subquery(snapshots.values('debit_total')[:1]),
+            credit_total=Subquery(snapshots.values('credit_total')[:1])
+        )
+    else:
+        accounts = accounts.annotate(
+            debit_total=F('running_balance__debit_total'),
+            credit_total=F('running_balance__credit_total')
+        )
+    rows = accounts.values(*group_by).annotate(
+        name=Min('account_name'),
+        debit=Coalesce(Sum('debit_total'), Value(Decimal('0.00'))),
+        credit=Coalesce(Sum('credit_total'), Value(Decimal('0.00')))
+    ).values_list(*group_by, 'name', 'debit', 'credit').order_by()
+
+    sections = {ASSET: [], LIABILITY: [], EQUITY: []}
+    for row in rows:
+        if per_account:
+            number, account_type, trading_account_id, name, debit, credit = row
+        else:
+            (number, account_type, name, debit, credit), trading_account_id = row, None
+        amount = debit - credit if account_type == ASSET else credit - debit
+        sections[account_type].append((number, account_type, trading_account_id, name, amount))
+
+    report = {
+        'trading_account_ids': trading_account_ids,
+        'assets': _consolidate_rows(sections[ASSET], trading_account_ids, per_account),
+        'liabilities': _consolidate_rows(sections[LIABILITY], trading_account_ids, per_account),
+        'equity': _consolidate_rows(sections[EQUITY], trading_account_ids, per_account),
+    }
+    count = len(trading_account_ids)
+    for section in ('assets', 'liabilities', 'equity'):
+        total, per_account_totals = _sum_rows(report[section], per_account, count)
+        report[f'total_{section}'] = total
+        if per_account:
+            report[f'total_{section}_per_account'] = per_account_totals
+    report['total_liabilities_and_equity'] = report['total_liabilities'] + report['total_equity']
+    if per_account:
+        report['total_liabilities_and_equity_per_account'] = [
+            liabilities + equity
+            for liabilities, equity in zip(report['total_liabilities_per_account'], report['total_equity_per_account'])
+        ]
+    return report
+
+
+def generate_trial_balance(trading_account, as_of=None):
+    """
+    تراز آزمایشی یک حساب معاملاتی از مانده‌های جاری (یا مانده روزانه as_of).
+    خروجی: accounts (لیست سرفصل‌ها به ترتیب شماره با parent_id برای ساخت درخت)،
+    total_debit و total_credit.
+    """
+    totals = get_account_totals(trading_account, as_of=as_of)
+    zero = Decimal('0.00')
+    report = {'accounts': [], 'total_debit': zero, 'total_credit': zero}
+    for account in sorted(get_chart_of_accounts(trading_account).values(), key=lambda account: account.account_number):
+        debit, credit = totals.get(account.id, (zero, zero))
+        report['accounts'].append({
+            'account_id': account.id,
+            'account_number': account.account_number,
+            'account_name': account.account_name,
+            'account_type': account.account_type,
+            'parent_id': account.parent_account_id,
+            'debit': debit,
+            'credit': credit,
+            'balance': debit - credit if account.account_type in (ASSET, EXPENSE) else credit - debit,
+        })
+        report['total_debit'] += debit
+        report['total_credit'] += credit
+    return report
 
 
 def get_cash_balance(trading_account):
     """
-    موجودی نقد فعلی یک حساب معاملاتی مشخص را محاسبه کرده و برمی‌گرداند.
-    این تابع، مجموع بدهکارها و بستانکارهای حساب نقد (1010) را محاسبه می‌کند.
+    موجودی نقد فعلی یک حساب معاملاتی مشخص را برمی‌گرداند.
+    موجودی از جدول مانده‌های جاری (AccountBalance) خوانده می‌شود و
+    نیازی به جمع زدن آرتیکل‌های حساب نقد (1010) نیست.
     """
-    try:
-        # پیدا کردن حساب نقد مختص این حساب معاملاتی
-        cash_account = ChartOfAccount.objects.get(trading_account=trading_account, account_number='1010')
-        
-        # محاسبه مجموع بدهکارها و بستانکارها در یک کوئری بهینه
-        balance_agg = cash_account.journalentryline_set.aggregate(
-            total_debit=Coalesce(Sum('debit_amount'), Value(Decimal('0.0'))),
-            total_credit=Coalesce(Sum('credit_amount'), Value(Decimal('0.0')))
+    totals = AccountBalance.objects.filter(
+        account__trading_account=trading_account,
+        account__account_number='1010'
+    ).values_list('debit_total', 'credit_total').first()
+
+    if totals is None:
+        # اگر حساب نقد یا مانده آن وجود نداشته باشد، موجودی صفر است
+        return Decimal('0.00')
+    return totals[0] - totals[1]
+
+
+def get_account_balance(account):
+    """
+    مانده جاری (بدهکار منهای بستانکار) یک سرفصل را برمی‌گرداند.
+    """
+    totals = AccountBalance.objects.filter(account=account).values_list('debit_total', 'credit_total').first()
+    if totals is None:
+        return Decimal('0.00')
+    return totals[0] - totals[1]
+
+
+def get_account_totals(trading_account, as_of=None):
+    """
+    جمع بدهکار و بستانکار همه سرفصل‌های یک حساب معاملاتی را با یک کوئری به صورت
+    {account_id: (debit_total, credit_total)} برمی‌گرداند. بدون as_of مانده‌های جاری خوانده می‌شوند؛
+    با as_of مانده پایان آخرین روزی که در آن تاریخ یا پیش از آن ثبت شده استفاده می‌شود.
+    """
+    if as_of is not None:
+        snapshots = AccountDailyBalance.objects.filter(account=OuterRef('pk'), date__lte=as_of).order_by('-date')
+        rows = ChartOfAccount.objects.filter(trading_account=trading_account).annotate(
+            snapshot_debit=Subquery(snapshots.values('debit_total')[:1]),
+            snapshot_credit=Subquery(snapshots.values('credit_total')[:1])
+        ).filter(snapshot_debit__isnull=False).values_list('id', 'snapshot_debit', 'snapshot_credit')
+        return {account_id: (debit_total, credit_total) for account_id, debit_total, credit_total in rows}
+
+    return {
+        account_id: (debit_total, credit_total)
+        for account_id, debit_total, credit_total in AccountBalance.objects.filter(
+            account__trading_account=trading_account
+        ).values_list('account_id', 'debit_total', 'credit_total')
+    }
+
+
+def apply_balance_deltas(deltas):
+    """
+    مبالغ ثبت شده را به مانده‌های جاری اضافه می‌کند.
+    deltas: {account_id: (debit, credit)}. باید در همان تراکنشی اجرا شود که آرتیکل‌ها را می‌نویسد
+    تا مانده‌ها همراه آن‌ها commit (یا rollback) شوند.
+    """
+    # ترتیب ثابت برای جلوگیری از بن‌بست بین تراکنش‌های همزمان
+    for account_id in sorted(deltas):
+        debit, credit = deltas[account_id]
+        updated = AccountBalance.objects.filter(account_id=account_id).update(
+            debit_total=F('debit_total') + debit,
+            credit_total=F('credit_total') + credit
         )
-        
-        # موجودی نهایی برای یک حساب دارایی برابر است با: بدهکار - بستانکار
-        balance = balance_agg['total_debit'] - balance_agg['total_credit']
-        return balance
+        if updated:
+            continue
+        try:
+            with transaction.atomic():
+                AccountBalance.objects.create(account_id=account_id, debit_total=debit, credit_total=credit)
+        except IntegrityError:
+            # ردیف توسط تراکنش دیگری ساخته شد؛ دوباره به‌روزرسانی می‌کنیم
+            AccountBalance.objects.filter(account_id=account_id).update(
+                debit_total=F('debit_total') + debit,
+                credit_total=F('credit_total') + credit
+            )
+
+
+def apply_daily_balance_deltas(deltas):
+    """
+    مبالغ ثبت شده را به مانده‌های پایان روز اضافه می‌کند.
+    deltas: {(account_id, entry_date): (debit, credit)}. اگر ردیف تاریخ سند وجود نداشته باشد از مانده
+    روز قبل ساخته می‌شود و همه ردیف‌های بعدی سرفصل هم جابه‌جا می‌شوند تا ثبت‌های با تاریخ گذشته درست بمانند.
+    """
+    for account_id, entry_date in sorted(deltas):
+        debit, credit = deltas[(account_id, entry_date)]
+        shift = {'debit_total': F('debit_total') + debit, 'credit_total': F('credit_total') + credit}
+
+        AccountDailyBalance.objects.filter(account_id=account_id, date__gt=entry_date).update(**shift)
+        if AccountDailyBalance.objects.filter(account_id=account_id, date=entry_date).update(**shift):
+            continue
+
+        previous = AccountDailyBalance.objects.filter(
+            account_id=account_id, date__lt=entry_date
+        ).order_by('-date').values_list('debit_total', 'credit_total').first() or (Decimal('0.00'), Decimal('0.00'))
+        try:
+            with transaction.atomic():
+                AccountDailyBalance.objects.create(
+                    account_id=account_id,
+                    date=entry_date,
+                    debit_total=previous[0] + debit,
+                    credit_total=previous[1] + credit
+                )
+        except IntegrityError:
+            AccountDailyBalance.objects.filter(account_id=account_id, date=entry_date).update(**shift)
+
+
+# سرفصل‌های نقد و دارایی‌های اسپات که در منحنی سرمایه (DailyEquity) دنبال می‌شوند
+CASH_ACCOUNT = '1010'
+SPOT_HOLDINGS_ACCOUNT = '1020'
+
+
+def _equity_component(account_number, account_type):
+    """
+    ستون DailyEquity و علامت مبلغ (بدهکار - بستانکار) یک سرفصل؛ None اگر در منحنی سرمایه اثری ندارد.
+    سود انباشته (3090) هم شمرده می‌شود تا بستن دوره مالی سود تحقق یافته تجمعی را تغییر ندهد.
+    """
+    if account_number == CASH_ACCOUNT:
+        return 'cash', 1
+    if account_number == SPOT_HOLDINGS_ACCOUNT:
+        return 'spot_holdings', 1
+    if account_type in (REVENUE, EXPENSE) or account_number == RETAINED_EARNINGS_ACCOUNT:
+        return 'realized_pnl', -1
+    return None
+
+
+def apply_equity_deltas(deltas):
+    """
+    مبالغ ثبت شده را به منحنی روزانه ارزش حساب اضافه می‌کند.
+    deltas: {(account_id, entry_date): (debit, credit)}. مانند مانده‌های روزانه، ردیف تاریخ سند در صورت نبودن
+    از روز قبل ساخته می‌شود و همه ردیف‌های بعدی حساب معاملاتی جابه‌جا می‌شوند.
+    """
+    components = {
+        account_id: (trading_account_id, _equity_component(account_number, account_type))
+        for account_id, trading_account_id, account_number, account_type in ChartOfAccount.objects.filter(
+            id__in={account_id for account_id, _entry_date in deltas}
+        ).values_list('id', 'trading_account_id', 'account_number', 'account_type')
+    }
+
+    changes = {}
+    for (account_id, entry_date), (debit, credit) in deltas.items():
+        trading_account_id, component = components.get(account_id, (None, None))
+        if trading_account_id is None or component is None:
+            continue
+        field, sign = component
+        day = changes.setdefault((trading_account_id, entry_date), {})
+        day[field] = day.get(field, Decimal('0.00')) + sign * (debit - credit)
+
+    for trading_account_id, entry_date in sorted(changes):
+        amounts = {field: amount for field, amount in changes[(trading_account_id, entry_date)].items() if amount}
+        if not amounts:
+            continue
+        shift = {field: F(field) + amount for field, amount in amounts.items()}
+
+        DailyEquity.objects.filter(trading_account_id=trading_account_id, date__gt=entry_date).update(**shift)
+        if DailyEquity.objects.filter(trading_account_id=trading_account_id, date=entry_date).update(**shift):
+            continue
+
+        previous = DailyEquity.objects.filter(
+            trading_account_id=trading_account_id, date__lt=entry_date
+        ).order_by('-date').values('cash', 'spot_holdings', 'realized_pnl').first() or {}
+        row = {
+            field: previous.get(field, Decimal('0.00')) + amounts.get(field, Decimal('0.00'))
+            for field in ('cash', 'spot_holdings', 'realized_pnl')
+        }
+        try:
+            with transaction.atomic():
+                DailyEquity.objects.create(trading_account_id=trading_account_id, date=entry_date, **row)
+        except IntegrityError:
+            DailyEquity.objects.filter(trading_account_id=trading_account_id, date=entry_date).update(**shift)
+
+
+def apply_ledger_deltas(deltas):
+    """
+    نقطه ورود واحد برای همگام نگه داشتن جدول‌های مانده با آرتیکل‌های ثبت شده.
+    deltas: {(account_id, entry_date): (debit, credit)}
+    نسخه دفتر حساب‌های معاملاتی درگیر هم عوض می‌شود تا گزارش‌های کش شده آن‌ها کنار گذاشته شوند.
+    """
+    per_account = {}
+    for (account_id, _entry_date), (debit, credit) in deltas.items():
+        current_debit, current_credit = per_account.get(account_id, (Decimal('0'), Decimal('0')))
+        per_account[account_id] = (current_debit + debit, current_credit + credit)
+    apply_balance_deltas(per_account)
+    apply_daily_balance_deltas(deltas)
+    apply_equity_deltas(deltas)
+    bump_ledger_version_for_accounts(per_account)
+
 
-    except ChartOfAccount.DoesNotExist:
-        # اگر حساب نقد اصلا وجود نداشته باشد، موجودی صفر است
-        return Decimal('0.00')
\ No newline at end of file
+def _bump_rebuilt_ledgers(trading_account=None):
+    if trading_account is not None:
+        bump_ledger_version(trading_account.pk)
+    else:
+        bump_ledger_version(*TradingAccount.objects.values_list('pk', flat=True))
+
+
+def rebuild_daily_balances(trading_account=None):
+    """
+    مانده‌های پایان روز را در یک پیمایش مرتب از روی JournalEntryLine دوباره می‌سازد و تعداد ردیف‌های
+    نوشته شده را برمی‌گرداند.
+    """
+    accounts = ChartOfAccount.objects.all()
+    if trading_account is not None:
+        accounts = accounts.filter(trading_account=trading_account)
+
+    day_totals = JournalEntryLine.objects.filter(account__in=accounts).values(
+        'account_id', 'journal_entry__entry_date'
+    ).annotate(
+        day_debit=Coalesce(Sum('debit_amount'), Value(Decimal('0.00'))),
+        day_credit=Coalesce(Sum('credit_amount'), Value(Decimal('0.00')))
+    ).order_by('account_id', 'journal_entry__entry_date')
+
+    snapshots = []
+    current_account = None
+    running_debit = running_credit = Decimal('0.00')
+    for row in day_totals.iterator(chunk_size=2000):
+        if row['account_id'] != current_account:
+            current_account = row['account_id']
+            running_debit = running_credit = Decimal('0.00')
+        running_debit += row['day_debit']
+        running_credit += row['day_credit']
+        snapshots.append(AccountDailyBalance(
+            account_id=current_account,
+            date=row['journal_entry__entry_date'],
+            debit_total=running_debit,
+            credit_total=running_credit
+        ))
+
+    with transaction.atomic():
+        AccountDailyBalance.objects.filter(account__in=accounts).delete()
+        AccountDailyBalance.objects.bulk_create(snapshots, batch_size=1000)
+        _bump_rebuilt_ledgers(trading_account)
+    return len(snapshots)
+
+
+def rebuild_equity_curve(trading_account=None):
+    """
+    منحنی روزانه ارزش حساب را در یک پیمایش مرتب از روی JournalEntryLine دوباره می‌سازد (یک ردیف برای
+    هر حساب معاملاتی و روز) و تعداد ردیف‌های نوشته شده را برمی‌گرداند.
+    """
+    lines = JournalEntryLine.objects.filter(
+        Q(account__account_number__in=[CASH_ACCOUNT, SPOT_HOLDINGS_ACCOUNT, RETAINED_EARNINGS_ACCOUNT]) |
+        Q(account__account_type__in=[REVENUE, EXPENSE])
+    )
+    if trading_account is not None:
+        lines = lines.filter(account__trading_account=trading_account)
+
+    zero = Value(Decimal('0.00'))
+    amount = F('debit_amount') - F('credit_amount')
+    money = DecimalField(max_digits=20, decimal_places=2)
+    day_totals = lines.values('account__trading_account_id', 'journal_entry__entry_date').annotate(
+        day_cash=Coalesce(Sum(Case(When(account__account_number=CASH_ACCOUNT, then=amount), default=zero, output_field=money)), zero),
+        day_spot=Coalesce(Sum(Case(When(account__account_number=SPOT_HOLDINGS_ACCOUNT, then=amount), default=zero, output_field=money)), zero),
+        day_realized=Coalesce(Sum(Case(
+            When(Q(account__account_type__in=[REVENUE, EXPENSE]) | Q(account__account_number=RETAINED_EARNINGS_ACCOUNT), then=-amount),
+            default=zero, output_field=money
+        )), zero),
+    ).order_by('account__trading_account_id', 'journal_entry__entry_date')
+
+    rows = []
+    current_account = None
+    cash = spot_holdings = realized_pnl = Decimal('0.00')
+    for row in day_totals.iterator(chunk_size=2000):
+        if row['account__trading_account_id'] != current_account:
+            current_account = row['account__trading_account_id']
+            cash = spot_holdings = realized_pnl = Decimal('0.00')
+        # مانند به‌روزرسانی تدریجی، روزهایی که اثری ندارند (مثلا سند بستن دوره) نقطه نمی‌سازند
+        if not (row['day_cash'] or row['day_spot'] or row['day_realized']):
+            continue
+        cash += row['day_cash']
+        spot_holdings += row['day_spot']
+        realized_pnl += row['day_realized']
+        rows.append(DailyEquity(
+            trading_account_id=current_account,
+            date=row['journal_entry__entry_date'],
+            cash=cash,
+            spot_holdings=spot_holdings,
+            realized_pnl=realized_pnl
+        ))
+
+    stale = DailyEquity.objects.all()
+    if trading_account is not None:
+        stale = stale.filter(trading_account=trading_account)
+    with transaction.atomic():
+        stale.delete()
+        DailyEquity.objects.bulk_create(rows, batch_size=1000)
+        _bump_rebuilt_ledgers(trading_account)
+    return len(rows)
+
+
+EQUITY_CURVE_INTERVALS = ('day', 'week', 'month')
+
+
+def _interval_bucket(day, interval):
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    if interval == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def get_equity_curve(trading_account, start_date=None, end_date=None, interval='day'):
+    """
+    نقاط منحنی سرمایه در بازه تاریخ؛ با interval هفتگی یا ماهانه فقط آخرین نقطه هر بازه
+    (سرمایه پایان هفته/ماه) برگردانده می‌شود. اگر start_date داده شود، مانده ابتدای بازه
+    (آخرین ردیف قبل از آن) به عنوان اولین نقطه با تاریخ start_date اضافه می‌شود.
+    """
+    if interval not in EQUITY_CURVE_INTERVALS:
+        raise ValueError(f"interval must be one of {', '.join(EQUITY_CURVE_INTERVALS)}.")
+    if start_date and end_date and start_date > end_date:
+        raise ValueError("start_date must not be after end_date.")
+
+    fields = ('date', 'cash', 'spot_holdings', 'realized_pnl')
+    rows = DailyEquity.objects.filter(trading_account=trading_account)
+    if end_date is not None:
+        rows = rows.filter(date__lte=end_date)
+    opening = None
+    if start_date is not None:
+        opening = rows.filter(date__lt=start_date).order_by('-date').values(*fields).first()
+        rows = rows.filter(date__gte=start_date)
+
+    points = {}
+    if opening is not None:
+        opening['date'] = start_date
+        points[_interval_bucket(start_date, interval)] = opening
+    # ردیف‌ها به ترتیب تاریخ خوانده می‌شوند؛ آخرین ردیف هر بازه جای قبلی‌ها را می‌گیرد
+    for row in rows.order_by('date').values(*fields).iterator(chunk_size=2000):
+        points[_interval_bucket(row['date'], interval)] = row
+
+    for point in points.values():
+        point['equity'] = point['cash'] + point['spot_holdings']
+    return {
+        'trading_account_id': trading_account.id,
+        'interval': interval,
+        'start_date': start_date,
+        'end_date': end_date,
+        'points': list(points.values()),
+    }
+
+
+def rebuild_account_balances(trading_account=None, dry_run=False):
+    """
+    مانده‌های جاری را از روی JournalEntryLine دوباره محاسبه می‌کند و سرفصل‌هایی را که مانده ذخیره شده‌شان
+    نمی‌خواند به صورت [(account_id, (بدهکار ذخیره شده، بستانکار ذخیره شده), (بدهکار واقعی، بستانکار واقعی))]
+    برمی‌گرداند. با dry_run=True جدول فقط بررسی می‌شود و بازنویسی نمی‌شود.
+    """
+    accounts = ChartOfAccount.objects.all()
+    if trading_account is not None:
+        accounts = accounts.filter(trading_account=trading_account)
+
+    zero = Decimal('0.00')
+    actual = {account_id: (zero, zero) for account_id in accounts.values_list('id', flat=True)}
+    line_totals = JournalEntryLine.objects.filter(account__in=accounts).values('account_id').annotate(
+        total_debit=Coalesce(Sum('debit_amount'), Value(zero)),
+        total_credit=Coalesce(Sum('credit_amount'), Value(zero))
+    )
+    for row in line_totals:
+        actual[row['account_id']] = (row['total_debit'], row['total_credit'])
+
+    stored = {
+        account_id: (debit_total, credit_total)
+        for account_id, debit_total, credit_total in AccountBalance.objects.filter(
+            account__in=accounts
+        ).values_list('account_id', 'debit_total', 'credit_total')
+    }
+
+    mismatches = []
+    for account_id, totals in actual.items():
+        current = stored.get(account_id, (zero, zero))
+        if current != totals:
+            mismatches.append((account_id, current, totals))
+
+    if not dry_run:
+        with transaction.atomic():
+            AccountBalance.objects.filter(account__in=accounts).delete()
+            AccountBalance.objects.bulk_create([
+                AccountBalance(account_id=account_id, debit_total=debit, credit_total=credit)
+                for account_id, (debit, credit) in actual.items()
+            ], batch_size=1000)
+            _bump_rebuilt_ledgers(trading_account)
+
+    return mismatches
+
+
+# --- الگوهای شرح اسناد قدیمی که پیش از اضافه شدن نوع سند و کلیدهای مبدا ثبت شده‌اند ---
+LEGACY_DESCRIPTION_PATTERNS = [
+    (re.compile(r'Trade #(\d+)'), JournalEntry.TRADE_CLOSE),
+    (re.compile(r'^Inter-account transfer:'), JournalEntry.TRANSFER),
+    (re.compile(r'^Spot Buy: ([\d.]+) (\S+)'), JournalEntry.SPOT_BUY),
+    (re.compile(r'^Spot Sell: '), JournalEntry.SPOT_SELL),
+    (re.compile(r'^Deposit of ([\d.]+) (\S+):'), JournalEntry.SPOT_DEPOSIT),
+    (re.compile(r'^Withdrawal: [\d.]+ \S+ \| PnL:'), JournalEntry.SPOT_WITHDRAWAL),
+]
+
+
+def _find_legacy_lot(entry, quantity, symbol, claimed_lot_ids):
+    """
+    دسته خریدی را که یک سند خرید/واریز اسپات قدیمی ایجاد کرده پیدا می‌کند.
+    فقط در صورتی که دقیقا یک دسته با مشخصات سند مطابقت داشته باشد برگردانده می‌شود.
+    """
+    holding_line = next((line for line in entry.journalentryline_set.all() if line.account.account_number == '1020'), None)
+    if holding_line is None or holding_line.debit_amount <= 0:
+        return None
+
+    candidates = AssetLot.objects.filter(
+        trading_account_id=holding_line.account.trading_account_id,
+        asset__symbol=symbol,
+        quantity=quantity,
+        purchase_date__date=entry.entry_date,
+        journal_entries__isnull=True
+    ).exclude(id__in=claimed_lot_ids)
+    matches = [lot for lot in candidates if _money(lot.quantity * lot.purchase_price_usd) == holding_line.debit_amount]
+    return matches[0] if len(matches) == 1 else None
+
+
+def link_journal_entries(trading_account=None, dry_run=False):
+    """
+    اسنادی که پیش از وجود فیلدهای entry_type، trade و asset_lot ثبت شده‌اند را
+    با تجزیه شرح و آرتیکل‌هایشان به معامله، دسته خرید و نوع صحیح متصل می‌کند.
+    تعداد اسناد متصل شده به تفکیک نوع را برمی‌گرداند.
+    """
+    entries = JournalEntry.objects.filter(
+        entry_type=JournalEntry.MANUAL, trade__isnull=True, asset_lot__isnull=True
+    ).prefetch_related('journalentryline_set__account').order_by('id')
+    if trading_account is not None:
+        entries = entries.filter(journalentryline__account__trading_account=trading_account).distinct()
+
+    existing_trade_ids = set(Trade.objects.values_list('id', flat=True))
+    claimed_lot_ids = set()
+    linked = []
+    counts = {}
+
+    for entry in entries.iterator(chunk_size=500):
+        for pattern, entry_type in LEGACY_DESCRIPTION_PATTERNS:
+            match = pattern.search(entry.description)
+            if match:
+                break
+        else:
+            match, entry_type = None, None
+            # واریز و برداشت نقد شرح آزاد دارند و فقط از روی آرتیکل‌ها (نقد در برابر سرمایه) شناخته می‌شوند
+            lines = {line.account.account_number: line for line in entry.journalentryline_set.all()}
+            if len(lines) == 2 and set(lines) == {'1010', '3010'}:
+                entry_type = JournalEntry.DEPOSIT if lines['1010'].debit_amount > 0 else JournalEntry.WITHDRAWAL
+
+        if entry_type is None:
+            continue
+
+        entry.entry_type = entry_type
+        if entry_type == JournalEntry.TRADE_CLOSE:
+            trade_id = int(match.group(1))
+            if trade_id in existing_trade_ids:
+                entry.trade_id = trade_id
+        elif entry_type in (JournalEntry.SPOT_BUY, JournalEntry.SPOT_DEPOSIT):
+            lot = _find_legacy_lot(entry, Decimal(match.group(1)), match.group(2), claimed_lot_ids)
+            if lot is not None:
+                entry.asset_lot = lot
+                claimed_lot_ids.add(lot.id)
+
+        linked.append(entry)
+        counts[entry_type] = counts.get(entry_type, 0) + 1
+
+    if not dry_run:
+        JournalEntry.objects.bulk_update(linked, ['entry_type', 'trade', 'asset_lot'], batch_size=500)
+
+    return counts
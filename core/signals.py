@@ -0,0 +1,127 @@
+from decimal import Decimal
+
+from django.db.models.signals import pre_save, pre_delete, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import ChartOfAccount, JournalEntry, JournalEntryLine
+from .services import (
+    apply_ledger_deltas, apply_daily_balance_deltas, apply_equity_deltas, bump_ledger_version, bump_ledger_version_for_accounts,
+    ensure_periods_open, invalidate_chart_of_accounts
+)
+
+
+def _amount(value):
+    # مقادیر ممکن است از فرم‌ها به صورت float یا رشته برسند
+    return Decimal(str(value or 0))
+
+
+def _add_delta(deltas, key, debit, credit):
+    current_debit, current_credit = deltas.get(key, (Decimal('0'), Decimal('0')))
+    deltas[key] = (current_debit + debit, current_credit + credit)
+
+
+@receiver(pre_save, sender=JournalEntryLine)
+def remember_original_line_amounts(sender, instance, raw=False, **kwargs):
+    """
+    مقادیر قبلی آرتیکل را نگه می‌دارد تا در ویرایش، فقط تفاوت به مانده اعمال شود.
+    ثبت یا ویرایش آرتیکل در یک دوره مالی بسته شده (قبل یا بعد از ویرایش) مجاز نیست.
+    """
+    if raw:
+        return
+    postings = [(instance.account_id, instance.journal_entry.entry_date)]
+    if instance.pk:
+        instance._original_amounts = JournalEntryLine.objects.filter(pk=instance.pk).values_list(
+            'account_id', 'journal_entry__entry_date', 'debit_amount', 'credit_amount'
+        ).first()
+        if instance._original_amounts:
+            postings.append(instance._original_amounts[:2])
+    ensure_periods_open(postings)
+
+
+@receiver(pre_delete, sender=JournalEntryLine)
+def protect_closed_period_on_line_delete(sender, instance, **kwargs):
+    ensure_periods_open([(instance.account_id, instance.journal_entry.entry_date)])
+
+
+@receiver(post_save, sender=JournalEntryLine)
+def update_balance_on_line_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    deltas = {}
+    original = getattr(instance, '_original_amounts', None)
+    if not created and original:
+        account_id, entry_date, debit, credit = original
+        _add_delta(deltas, (account_id, entry_date), -debit, -credit)
+    _add_delta(
+        deltas,
+        (instance.account_id, instance.journal_entry.entry_date),
+        _amount(instance.debit_amount),
+        _amount(instance.credit_amount)
+    )
+    instance._original_amounts = None
+    apply_ledger_deltas(deltas)
+
+
+@receiver(post_delete, sender=JournalEntryLine)
+def update_balance_on_line_delete(sender, instance, **kwargs):
+    apply_ledger_deltas({
+        (instance.account_id, instance.journal_entry.entry_date): (
+            -_amount(instance.debit_amount), -_amount(instance.credit_amount)
+        )
+    })
+
+
+@receiver(pre_save, sender=JournalEntry)
+def remember_original_entry_date(sender, instance, raw=False, **kwargs):
+    if raw or not instance.pk:
+        return
+    instance._original_entry_date = JournalEntry.objects.filter(pk=instance.pk).values_list(
+        'entry_date', flat=True
+    ).first()
+    if instance._original_entry_date not in (None, instance.entry_date):
+        account_ids = instance.journalentryline_set.values_list('account_id', flat=True)
+        ensure_periods_open(
+            [(account_id, instance._original_entry_date) for account_id in account_ids] +
+            [(account_id, instance.entry_date) for account_id in account_ids]
+        )
+
+
+@receiver(post_save, sender=JournalEntry)
+def move_daily_balances_on_date_change(sender, instance, created, raw=False, **kwargs):
+    """
+    اگر تاریخ یک سند ویرایش شود، آرتیکل‌های آن از روز قبلی به روز جدید منتقل می‌شوند.
+    مانده جاری تغییری نمی‌کند و فقط مانده‌های روزانه جابه‌جا می‌شوند.
+    """
+    original_date = getattr(instance, '_original_entry_date', None)
+    instance._original_entry_date = None
+    if raw or created or original_date is None or original_date == instance.entry_date:
+        return
+
+    deltas = {}
+    for account_id, debit, credit in instance.journalentryline_set.values_list('account_id', 'debit_amount', 'credit_amount'):
+        _add_delta(deltas, (account_id, original_date), -debit, -credit)
+        _add_delta(deltas, (account_id, instance.entry_date), debit, credit)
+    apply_daily_balance_deltas(deltas)
+    apply_equity_deltas(deltas)
+    bump_ledger_version_for_accounts(account_id for account_id, _entry_date in deltas)
+
+
+@receiver(pre_save, sender=ChartOfAccount)
+def remember_original_trading_account(sender, instance, raw=False, **kwargs):
+    if raw or not instance.pk:
+        return
+    instance._original_trading_account_id = ChartOfAccount.objects.filter(pk=instance.pk).values_list(
+        'trading_account_id', flat=True
+    ).first()
+
+
+@receiver(post_save, sender=ChartOfAccount)
+@receiver(post_delete, sender=ChartOfAccount)
+def invalidate_chart_cache(sender, instance, **kwargs):
+    """
+    کش سرفصل‌های حساب معاملاتی و گزارش‌های کش شده آن را پس از ساخت، ویرایش یا حذف یک سرفصل باطل می‌کند.
+    """
+    trading_account_ids = {instance.trading_account_id, getattr(instance, '_original_trading_account_id', None)}
+    for trading_account_id in trading_account_ids - {None}:
+        invalidate_chart_of_accounts(trading_account_id)
+    bump_ledger_version(*trading_account_ids)
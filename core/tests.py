@@ -1,9 +1,45 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.contrib.auth import get_user_model
+from django.contrib.messages import get_messages
 from django.utils import timezone
+from django.urls import reverse
+from django.utils import translation
+from django.db.models import Sum
 from decimal import Decimal
-from core.models import TradingAccount, ChartOfAccount, Asset, AssetLot, JournalEntry, JournalEntryLine, ASSET, LIABILITY, EQUITY, REVENUE, EXPENSE
-from core.services import calculate_unrealized_pnl, transfer_funds_between_accounts, make_deposit
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from core.models import TradingAccount, ChartOfAccount, Asset, AssetLot, LotConsumption, Trade, JournalEntry, JournalEntryLine, AccountBalance, AccountDailyBalance, DailyEquity, FiscalPeriod, PeriodClosingBalance, ReportJob, ImportCheckpoint, IdempotencyKey, ASSET, LIABILITY, EQUITY, REVENUE, EXPENSE
+from core.lots import LotQueue, LotBook, InsufficientQuantity
+from core.analytics import analyze_trades, generate_trade_analytics, np
+from core.exports import stream_export, iter_ledger_sync, JOURNAL_FIELDS
+from core.pagination import IdCursorPagination
+from core.jobs import claim_next_job, requeue_stale_jobs, run_job, submit_report_job
+from core.imports import Fill, FillImportError, import_fills, post_fills
+from core.idempotency import prune_idempotency_keys
+from core.services import (
+    calculate_unrealized_pnl, transfer_funds_between_accounts, make_deposit, make_withdrawal,
+    get_cash_balance, rebuild_account_balances, rebuild_daily_balances, get_account_totals,
+    post_entry, post_entries, get_account, create_trading_account, create_trading_accounts_bulk,
+    execute_spot_buy, execute_spot_sell, record_direct_closed_trade, link_journal_entries, lock_trading_accounts,
+    get_account_balance, withdraw_spot_asset, reverse_spot_disposal, generate_income_statement,
+    close_fiscal_period, reopen_fiscal_period, delete_trading_account,
+    generate_consolidated_income_statement, generate_consolidated_balance_sheet,
+    cached_report, get_ledger_versions, rebuild_equity_curve, get_equity_curve, deposit_spot_asset,
+    record_closed_trades_bulk, TradeImportError, open_trade
+)
 
 User = get_user_model()
 
@@ -209,7 +245,7 @@ class ServiceTests(TestCase):
 
         transfer_amount = Decimal('100.00')
         with self.assertRaisesRegex(ValueError, "Cannot transfer funds between accounts belonging to different users."):
-            transfer_funds_between_between_accounts(
+            transfer_funds_between_accounts(
                 self.trading_account1, self.trading_account_user2, transfer_amount, "Transfer test", self.user1
             )
         # Ensure no new journal entries were created
@@ -256,4 +292,1897 @@ class ServiceTests(TestCase):
             )
         # Ensure no new journal entries were created beyond the initial deposit
         self.assertEqual(JournalEntry.objects.count(), 1)
-        self.assertEqual(JournalEntryLine.objects.count(), 2)
\ No newline at end of file
+        self.assertEqual(JournalEntryLine.objects.count(), 2)
+
+
+class AccountBalanceTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='balanceuser', password='password123')
+        self.trading_account = TradingAccount.objects.create(
+            user=self.user,
+            name='Balance Account',
+            account_type=TradingAccount.CRYPTO,
+            account_purpose=TradingAccount.SPOT
+        )
+        self.cash_account = ChartOfAccount.objects.create(
+            trading_account=self.trading_account, account_number='1010', account_name='Cash', account_type=ASSET
+        )
+        self.equity_account = ChartOfAccount.objects.create(
+            trading_account=self.trading_account, account_number='3010', account_name='Equity', account_type=EQUITY
+        )
+
+    def test_postings_update_running_balance(self):
+        make_deposit(self.trading_account, Decimal('1000.00'), "Deposit", self.user)
+        make_withdrawal(self.trading_account, Decimal('250.00'), "Withdrawal", self.user)
+
+        balance = AccountBalance.objects.get(account=self.cash_account)
+        self.assertEqual(balance.debit_total, Decimal('1000.00'))
+        self.assertEqual(balance.credit_total, Decimal('250.00'))
+        self.assertEqual(get_cash_balance(self.trading_account), Decimal('750.00'))
+
+    def test_cash_balance_is_single_query(self):
+        make_deposit(self.trading_account, Decimal('1000.00'), "Deposit", self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_cash_balance(self.trading_account), Decimal('1000.00'))
+
+    def test_deleting_entry_reverses_balance(self):
+        entry = make_deposit(self.trading_account, Decimal('1000.00'), "Deposit", self.user)
+        entry.delete()
+        self.assertEqual(get_cash_balance(self.trading_account), Decimal('0.00'))
+
+    def test_rebuild_detects_and_fixes_drift(self):
+        make_deposit(self.trading_account, Decimal('1000.00'), "Deposit", self.user)
+        AccountBalance.objects.filter(account=self.cash_account).update(debit_total=Decimal('1.00'))
+
+        mismatches = rebuild_account_balances(self.trading_account, dry_run=True)
+        self.assertEqual([m[0] for m in mismatches], [self.cash_account.id])
+
+        rebuild_account_balances(self.trading_account)
+        self.assertEqual(rebuild_account_balances(self.trading_account, dry_run=True), [])
+        self.assertEqual(get_cash_balance(self.trading_account), Decimal('1000.00'))
+
+    def _post(self, entry_date, amount):
+        entry = JournalEntry.objects.create(entry_date=entry_date, description="Deposit", posted_by=self.user)
+        JournalEntryLine.objects.create(journal_entry=entry, account=self.cash_account, debit_amount=amount)
+        JournalEntryLine.objects.create(journal_entry=entry, account=self.equity_account, credit_amount=amount)
+        return entry
+
+    def test_daily_snapshots_support_back_dated_postings(self):
+        self._post(date(2025, 1, 10), Decimal('100.00'))
+        self._post(date(2025, 1, 20), Decimal('50.00'))
+        # سند با تاریخ گذشته باید مانده روزهای بعد را هم جابه‌جا کند
+        self._post(date(2025, 1, 15), Decimal('25.00'))
+
+        def cash_as_of(day):
+            debit, credit = get_account_totals(self.trading_account, as_of=day)[self.cash_account.id]
+            return debit - credit
+
+        self.assertEqual(cash_as_of(date(2025, 1, 12)), Decimal('100.00'))
+        self.assertEqual(cash_as_of(date(2025, 1, 15)), Decimal('125.00'))
+        self.assertEqual(cash_as_of(date(2025, 2, 1)), Decimal('175.00'))
+        self.assertNotIn(self.cash_account.id, get_account_totals(self.trading_account, as_of=date(2025, 1, 1)))
+
+        incremental = list(AccountDailyBalance.objects.order_by('account_id', 'date').values_list(
+            'account_id', 'date', 'debit_total', 'credit_total'))
+        rebuild_daily_balances(self.trading_account)
+        rebuilt = list(AccountDailyBalance.objects.order_by('account_id', 'date').values_list(
+            'account_id', 'date', 'debit_total', 'credit_total'))
+        self.assertEqual(incremental, rebuilt)
+
+    def test_post_entry_rejects_unbalanced_entry(self):
+        with self.assertRaisesRegex(ValueError, "نامتوازن"):
+            post_entry(
+                JournalEntry(entry_date=date(2025, 1, 1), description="Broken", posted_by=self.user),
+                [
+                    JournalEntryLine(account=self.cash_account, debit_amount=Decimal('10.00')),
+                    JournalEntryLine(account=self.equity_account, credit_amount=Decimal('9.99')),
+                ]
+            )
+        self.assertEqual(JournalEntry.objects.count(), 0)
+        self.assertEqual(get_cash_balance(self.trading_account), Decimal('0.00'))
+
+    def test_sub_cent_amounts_that_balance_are_posted_with_rounding_residue_allocated(self):
+        entry = post_entry(
+            JournalEntry(entry_date=date(2025, 1, 1), description="Split", posted_by=self.user),
+            [
+                JournalEntryLine(account=self.cash_account, debit_amount=Decimal('10.00')),
+                # هر کدام به تنهایی به 3.34 گرد می‌شوند و جمع گرد شده (10.01) با بدهکار نمی‌خواند
+                JournalEntryLine(account=self.equity_account, credit_amount=Decimal('3.335')),
+                JournalEntryLine(account=self.equity_account, credit_amount=Decimal('3.335')),
+                JournalEntryLine(account=self.equity_account, credit_amount=Decimal('3.33')),
+            ]
+        )
+        credits = sorted(entry.journalentryline_set.filter(account=self.equity_account).values_list('credit_amount', flat=True))
+        self.assertEqual(credits, [Decimal('3.33'), Decimal('3.33'), Decimal('3.34')])
+        self.assertEqual(get_cash_balance(self.trading_account), Decimal('10.00'))
+        self.assertEqual(rebuild_account_balances(dry_run=True), [])
+
+        with self.assertRaisesRegex(ValueError, "نامتوازن"):
+            post_entry(
+                JournalEntry(entry_date=date(2025, 1, 1), description="Broken", posted_by=self.user),
+                [
+                    JournalEntryLine(account=self.cash_account, debit_amount=Decimal('10.00')),
+                    JournalEntryLine(account=self.equity_account, credit_amount=Decimal('9.98')),
+                ]
+            )
+
+    def test_post_entries_batches_many_events(self):
+        entries = [
+            (
+                JournalEntry(entry_date=date(2025, 1, 1), description=f"Deposit {i}", posted_by=self.user),
+                [
+                    JournalEntryLine(account=self.cash_account, debit_amount=Decimal('10.00')),
+                    JournalEntryLine(account=self.equity_account, credit_amount=Decimal('10.00')),
+                ]
+            )
+            for i in range(20)
+        ]
+        posted = post_entries(entries)
+
+        self.assertEqual(len(posted), 20)
+        self.assertTrue(all(entry.pk for entry in posted))
+        self.assertEqual(JournalEntryLine.objects.count(), 40)
+        self.assertEqual(get_cash_balance(self.trading_account), Decimal('200.00'))
+        self.assertEqual(rebuild_account_balances(self.trading_account, dry_run=True), [])
+
+
+class ChartOfAccountCacheTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='cacheuser', password='password123')
+        self.trading_account = TradingAccount.objects.create(
+            user=self.user,
+            name='Cache Account',
+            account_type=TradingAccount.CRYPTO,
+            account_purpose=TradingAccount.SPOT
+        )
+        self.cash_account = ChartOfAccount.objects.create(
+            trading_account=self.trading_account, account_number='1010', account_name='Cash', account_type=ASSET
+        )
+
+    def test_hot_account_costs_no_queries(self):
+        # درون تراکنش (تست) کش پس از commit نوشته می‌شود
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(get_account(self.trading_account, '1010'), self.cash_account)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_account(self.trading_account, '1010').pk, self.cash_account.pk)
+
+    def test_cache_is_invalidated_on_create_update_and_delete(self):
+        get_account(self.trading_account, '1010')
+
+        equity_account = ChartOfAccount.objects.create(
+            trading_account=self.trading_account, account_number='3010', account_name='Equity', account_type=EQUITY
+        )
+        self.assertEqual(get_account(self.trading_account, '3010'), equity_account)
+
+        equity_account.account_number = '3020'
+        equity_account.save()
+        self.assertEqual(get_account(self.trading_account, '3020'), equity_account)
+        with self.assertRaises(ChartOfAccount.DoesNotExist):
+            get_account(self.trading_account, '3010')
+
+        self.cash_account.delete()
+        with self.assertRaises(ChartOfAccount.DoesNotExist):
+            get_account(self.trading_account, '1010')
+
+    def test_accounts_of_a_rolled_back_transaction_are_not_cached(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    ChartOfAccount.objects.create(
+                        trading_account=self.trading_account, account_number='4030', account_name='Gain', account_type=REVENUE
+                    )
+                    self.assertEqual(get_account(self.trading_account, '4030').account_number, '4030')
+                    raise RuntimeError("rollback")
+        self.assertEqual(callbacks, [])
+
+        with self.assertRaises(ChartOfAccount.DoesNotExist):
+            get_account(self.trading_account, '4030')
+
+    def test_cached_chart_expires(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            get_account(self.trading_account, '1010')
+        key = f'chart-of-accounts:{self.trading_account.id}'
+        self.assertIsNotNone(cache.get(key))
+        with override_settings(CHART_CACHE_TIMEOUT=-1):
+            with self.captureOnCommitCallbacks(execute=True):
+                cache.delete(key)
+                get_account(self.trading_account, '1010')
+        self.assertIsNone(cache.get(key))
+
+    def test_bulk_provisioning_builds_full_chart_in_few_queries(self):
+        users = [User.objects.create_user(username=f'bulk{i}', password='password123') for i in range(5)]
+        specs = [
+            {'user': user, 'name': f'{user.username} Spot', 'account_type': TradingAccount.CRYPTO, 'account_purpose': TradingAccount.SPOT}
+            for user in users
+        ]
+        # یک INSERT برای حساب‌ها و یک INSERT برای هر سطح الگو (به همراه savepoint)
+        with self.assertNumQueries(5):
+            accounts = create_trading_accounts_bulk(specs)
+
+        single = create_trading_account(self.user, 'Single', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        expected = sorted(ChartOfAccount.objects.filter(trading_account=single).values_list(
+            'account_number', 'parent_account__account_number', 'account_type'))
+        for account in accounts:
+            chart = sorted(ChartOfAccount.objects.filter(trading_account=account).values_list(
+                'account_number', 'parent_account__account_number', 'account_type'))
+            self.assertEqual(chart, expected)
+        self.assertEqual(get_account(accounts[0], '1010').account_name, 'Cash - bulk0 Spot')
+        self.assertEqual(get_account(accounts[0], '1010').account_name_fa, 'نقد - bulk0 Spot')
+
+
+
+class JournalEntrySourceTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='sourceuser', password='password123')
+        self.trading_account = create_trading_account(self.user, 'Source Account', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        self.btc = Asset.objects.create(symbol='BTC', name='Bitcoin', asset_type=Asset.SPOT)
+        self.future = Asset.objects.create(symbol='BTCUSDT', name='Bitcoin Perpetual', asset_type=Asset.DERIVATIVE)
+        self.deposit = make_deposit(self.trading_account, Decimal('1000.00'), "Initial capital", self.user)
+
+    def _close_trade(self):
+        return record_direct_closed_trade(
+            self.trading_account, self.future, Trade.LONG, Decimal('1'), Decimal('100'),
+            Decimal('110'), timezone.now(), Decimal('10.00'), Decimal('1.00'),
+            Decimal('0'), None, "Closed"
+        )
+
+    def _post(self, url_name, pk):
+        # آدرس‌ها پیشوند زبان دارند؛ زبان فعال از تست‌های قبلی ممکن است en-us مانده باشد
+        with translation.override('en'):
+            return self.client.post(reverse(url_name, args=[pk]))
+
+    def test_services_record_source_references(self):
+        buy = execute_spot_buy(self.trading_account, self.btc, Decimal('0.5'), Decimal('300.00'), "Buy", self.user)
+        trade = self._close_trade()
+
+        self.assertEqual(self.deposit.entry_type, JournalEntry.DEPOSIT)
+        self.assertEqual(buy.entry_type, JournalEntry.SPOT_BUY)
+        self.assertEqual(buy.asset_lot.quantity, Decimal('0.5'))
+        self.assertEqual(list(trade.journal_entries.values_list('entry_type', flat=True)), [JournalEntry.TRADE_CLOSE])
+
+    def test_trade_delete_removes_linked_entries(self):
+        trade = self._close_trade()
+        self._post('trade_delete', trade.pk)
+
+        self.assertFalse(Trade.objects.filter(pk=trade.pk).exists())
+        self.assertFalse(JournalEntry.objects.filter(entry_type=JournalEntry.TRADE_CLOSE).exists())
+        self.assertEqual(get_cash_balance(self.trading_account), Decimal('1000.00'))
+
+    def test_journal_entry_delete_removes_unconsumed_lot(self):
+        buy = execute_spot_buy(self.trading_account, self.btc, Decimal('0.5'), Decimal('300.00'), "Buy", self.user)
+        lot_id = buy.asset_lot_id
+        self._post('journal_entry_delete', buy.pk)
+
+        self.assertFalse(JournalEntry.objects.filter(pk=buy.pk).exists())
+        self.assertFalse(AssetLot.objects.filter(pk=lot_id).exists())
+
+    def test_journal_entry_delete_of_a_sell_restores_lot_quantities(self):
+        first = execute_spot_buy(self.trading_account, self.btc, Decimal('0.5'), Decimal('300.00'), "Buy", self.user)
+        second = execute_spot_buy(self.trading_account, self.btc, Decimal('0.5'), Decimal('400.00'), "Buy", self.user)
+        sell = execute_spot_sell(self.trading_account, self.btc, Decimal('0.7'), Decimal('600.00'), "Sell", self.user)
+
+        self._post('journal_entry_delete', sell.pk)
+
+        self.assertEqual(
+            list(AssetLot.objects.filter(pk__in=[first.asset_lot_id, second.asset_lot_id]).order_by('id').values_list(
+                'remaining_quantity', flat=True
+            )),
+            [Decimal('0.5'), Decimal('0.5')]
+        )
+        self.assertTrue(JournalEntry.objects.filter(reversal_of=sell).exists())
+        self.assertEqual(get_account_balance(get_account(self.trading_account, '1020')), Decimal('700.00'))
+        self.assertEqual(get_cash_balance(self.trading_account), Decimal('300.00'))
+
+        # برگشت دوباره مجاز نیست و مقادیر دوباره اضافه نمی‌شوند
+        self._post('journal_entry_delete', sell.pk)
+        self.assertEqual(AssetLot.objects.get(pk=first.asset_lot_id).remaining_quantity, Decimal('0.5'))
+
+    def test_journal_entry_delete_refuses_reversals_and_reversed_entries(self):
+        buy = execute_spot_buy(self.trading_account, self.btc, Decimal('0.5'), Decimal('300.00'), "Buy", self.user)
+        sell = execute_spot_sell(self.trading_account, self.btc, Decimal('0.2'), Decimal('200.00'), "Sell", self.user)
+        reversal = reverse_spot_disposal(sell, self.user)
+
+        for entry in (reversal, sell):
+            with self.subTest(entry_type=entry.entry_type):
+                response = self._post('journal_entry_delete', entry.pk)
+                self.assertEqual(response.status_code, 302)
+                self.assertIn("cannot be deleted", [str(message) for message in get_messages(response.wsgi_request)][-1])
+        self.assertEqual(JournalEntry.objects.filter(pk__in=[sell.pk, reversal.pk]).count(), 2)
+        self.assertEqual(AssetLot.objects.get(pk=buy.asset_lot_id).remaining_quantity, Decimal('0.5'))
+        self.assertEqual(get_account_balance(get_account(self.trading_account, '1020')), Decimal('300.00'))
+
+    def test_journal_entry_delete_reports_restricted_trade_entries(self):
+        trade = self._close_trade()
+        closing = trade.journal_entries.get()
+        # سند دیگری از همان معامله که برگشت خورده است؛ حذف اسناد معامله با RESTRICT متوقف می‌شود
+        adjustment = JournalEntry.objects.create(
+            entry_date=closing.entry_date, description="Adjustment", posted_by=self.user, trade=trade
+        )
+        JournalEntry.objects.create(
+            entry_date=closing.entry_date, description="Reversal", posted_by=self.user,
+            entry_type=JournalEntry.REVERSAL, reversal_of=adjustment
+        )
+
+        response = self._post('journal_entry_delete', closing.pk)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertIn("reversal", [str(message) for message in get_messages(response.wsgi_request)][-1])
+        self.assertTrue(Trade.objects.filter(pk=trade.pk).exists())
+        self.assertTrue(JournalEntry.objects.filter(pk=closing.pk).exists())
+
+    def test_backfill_links_legacy_entries(self):
+        buy = execute_spot_buy(self.trading_account, self.btc, Decimal('0.5'), Decimal('300.00'), "Buy", self.user)
+        trade = self._close_trade()
+        # اسناد قدیمی هیچ ارجاعی به مبدا خود ندارند
+        JournalEntry.objects.update(entry_type=JournalEntry.MANUAL, trade=None, asset_lot=None)
+
+        counts = link_journal_entries()
+
+        self.assertEqual(counts, {JournalEntry.DEPOSIT: 1, JournalEntry.SPOT_BUY: 1, JournalEntry.TRADE_CLOSE: 1})
+        buy.refresh_from_db()
+        self.assertEqual(buy.entry_type, JournalEntry.SPOT_BUY)
+        self.assertIsNotNone(buy.asset_lot_id)
+        self.assertEqual(trade.journal_entries.count(), 1)
+        self.assertEqual(link_journal_entries(), {})
+
+
+class LotConsumptionTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='lotuser', password='password123')
+        self.trading_account = create_trading_account(self.user, 'Lot Account', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        self.btc = Asset.objects.create(symbol='BTC', name='Bitcoin', asset_type=Asset.SPOT)
+        make_deposit(self.trading_account, Decimal('10000.00'), "Initial capital", self.user)
+        # خرید پله‌ای (DCA): دسته‌های کوچک با قیمت‌های متفاوت
+        for i in range(30):
+            execute_spot_buy(self.trading_account, self.btc, Decimal('0.1'), Decimal(10 + i), "DCA", self.user)
+
+    def test_sell_depletes_lots_with_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            entry = execute_spot_sell(self.trading_account, self.btc, Decimal('2.55'), Decimal('1000.00'), "Sell", self.user)
+
+        lot_updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE') and 'core_assetlot' in q['sql']]
+        self.assertEqual(len(lot_updates), 1)
+
+        consumptions = list(entry.lot_consumptions.order_by('lot__purchase_date', 'lot_id'))
+        self.assertEqual(len(consumptions), 26)
+        self.assertEqual(sum(c.quantity for c in consumptions), Decimal('2.55'))
+        self.assertEqual(consumptions[-1].quantity, Decimal('0.05'))
+        # بهای تمام شده: 25 دسته کامل (10..34 دلار) و نیمی از دسته بعدی (35 دلار)
+        self.assertEqual(sum(c.cost_usd for c in consumptions), Decimal('567.50'))
+        self.assertEqual(
+            entry.journalentryline_set.get(account__account_number='1020').credit_amount, Decimal('567.50')
+        )
+
+    def test_lot_queue_loads_open_lots_in_one_query(self):
+        execute_spot_sell(self.trading_account, self.btc, Decimal('0.25'), Decimal('100.00'), "Sell", self.user)
+        with self.assertNumQueries(1):
+            queue = LotQueue.load(self.trading_account, self.btc)
+        self.assertEqual(len(queue), 28)
+        self.assertEqual(queue.quantity, Decimal('2.75'))
+        self.assertEqual(queue.cost_basis, get_account_balance(get_account(self.trading_account, '1020')))
+
+    def test_reversal_restores_consumed_lots(self):
+        entry = withdraw_spot_asset(self.trading_account, self.btc, Decimal('1.25'), Decimal('50'), "Withdraw", self.user)
+        holding_account = get_account(self.trading_account, '1020')
+        holding_before = get_account_balance(holding_account)
+
+        reversal = reverse_spot_disposal(entry, self.user)
+
+        self.assertEqual(reversal.reversal_of, entry)
+        self.assertFalse(AssetLot.objects.filter(trading_account=self.trading_account).exclude(
+            remaining_quantity=Decimal('0.1')
+        ).exists())
+        self.assertEqual(get_account_balance(holding_account), holding_before + Decimal('197.00'))
+        self.assertEqual(rebuild_account_balances(dry_run=True), [])
+        with self.assertRaises(ValueError):
+            reverse_spot_disposal(entry, self.user)
+
+
+class LotEngineTests(SimpleTestCase):
+
+    def test_consume_is_fifo_and_tracks_cost_basis(self):
+        queue = LotQueue([(1, Decimal('1'), Decimal('100')), (2, Decimal('2'), Decimal('130'))])
+        self.assertEqual(queue.cost_basis, Decimal('360'))
+        self.assertEqual(queue.average_cost, Decimal('120'))
+        self.assertEqual(queue.cost_of(Decimal('1.5')), Decimal('165'))
+
+        consumptions = queue.consume(Decimal('1.5'))
+
+        self.assertEqual([(c.lot_id, c.quantity, c.cost, c.remaining) for c in consumptions], [
+            (1, Decimal('1'), Decimal('100'), Decimal('0')),
+            (2, Decimal('0.5'), Decimal('65'), Decimal('1.5')),
+        ])
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(queue.quantity, Decimal('1.5'))
+        self.assertEqual(queue.cost_basis, Decimal('195'))
+
+    def test_insufficient_quantity_leaves_queue_untouched(self):
+        queue = LotQueue([(1, Decimal('1'), Decimal('100'))])
+        with self.assertRaises(InsufficientQuantity):
+            queue.consume(Decimal('1.1'))
+        self.assertEqual(list(queue), [(1, Decimal('1'), Decimal('100'))])
+
+    def test_replay_realizes_pnl_per_account_and_asset(self):
+        book = LotBook().replay([
+            ('A', 'BTC', LotBook.BUY, Decimal('1'), Decimal('100')),
+            ('B', 'BTC', LotBook.BUY, Decimal('1'), Decimal('50')),
+            ('A', 'BTC', LotBook.BUY, Decimal('1'), Decimal('200')),
+            ('A', 'BTC', LotBook.SELL, Decimal('1.5'), Decimal('300')),
+            ('B', 'BTC', LotBook.SELL, Decimal('1'), Decimal('40')),
+        ])
+        self.assertEqual(book.realized_pnl, {('A', 'BTC'): Decimal('250'), ('B', 'BTC'): Decimal('-10')})
+        self.assertEqual(book.queue('A', 'BTC').cost_basis, Decimal('100'))
+
+    def test_replay_fills_rejects_bad_side_with_line_number(self):
+        for side_cell in ('HOLD', ''):
+            with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+                handle.write("account,asset,side,quantity,price\n")
+                handle.write("A,BTC,buy,1,100\n")
+                handle.write(f"A,BTC,{side_cell},1,100\n")
+            self.addCleanup(os.remove, handle.name)
+            with self.subTest(side=side_cell), self.assertRaisesMessage(CommandError, "line 3"):
+                call_command('replay_fills', handle.name, stdout=io.StringIO())
+
+    def test_replay_rejects_non_positive_quantity_or_price(self):
+        for quantity, price in ((Decimal('-1'), Decimal('100')), (Decimal('0'), Decimal('100')), (Decimal('1'), Decimal('0'))):
+            book = LotBook()
+            with self.subTest(quantity=quantity, price=price), self.assertRaisesMessage(ValueError, "Fill #2"):
+                book.replay([
+                    ('A', 'BTC', LotBook.BUY, Decimal('1'), Decimal('100')),
+                    ('A', 'BTC', LotBook.SELL, quantity, price),
+                ])
+            self.assertEqual(book.realized_pnl, {})
+            self.assertEqual(book.queue('A', 'BTC').quantity, Decimal('1'))
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+            handle.write("account,asset,side,quantity,price\nA,BTC,BUY,1,100\nA,BTC,SELL,-1,100\n")
+        self.addCleanup(os.remove, handle.name)
+        with self.assertRaisesMessage(CommandError, "line 3"):
+            call_command('replay_fills', handle.name, stdout=io.StringIO())
+
+    def test_replay_fills_rejects_missing_side_column(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+            handle.write("account,asset,quantity,price\nA,BTC,1,100\n")
+        self.addCleanup(os.remove, handle.name)
+        with self.assertRaisesMessage(CommandError, "line 2"):
+            call_command('replay_fills', handle.name, stdout=io.StringIO())
+
+
+class IncomeStatementTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='incomeuser', password='password123')
+        self.trading_account = create_trading_account(self.user, 'Income Account', TradingAccount.CRYPTO, TradingAccount.FUTURES)
+        self.future = Asset.objects.create(symbol='ETHUSDT', name='Ether Perpetual', asset_type=Asset.DERIVATIVE)
+        make_deposit(self.trading_account, Decimal('1000.00'), "Initial capital", self.user)
+
+    def _close_trades(self, count, pnl):
+        for _ in range(count):
+            record_direct_closed_trade(
+                self.trading_account, self.future, Trade.LONG, Decimal('1'), Decimal('100'),
+                Decimal('110'), timezone.now(), pnl, Decimal('1.00'), Decimal('0'), None, "Closed"
+            )
+
+    def test_totals_and_parent_rollups(self):
+        self._close_trades(3, Decimal('10.00'))
+        self._close_trades(1, Decimal('-4.00'))
+        today = timezone.now().date()
+
+        report = generate_income_statement(self.trading_account, today, today)
+
+        self.assertEqual(report['total_revenues'], Decimal('26.00'))
+        self.assertEqual(report['total_expenses'], Decimal('4.00'))
+        self.assertEqual(report['net_profit_loss'], Decimal('22.00'))
+        self.assertEqual(report['revenues'], {'Realized PnL - Derivatives - Income Account': Decimal('26.00')})
+
+        revenue_root, = report['revenue_tree']
+        self.assertEqual(revenue_root['account_number'], '4000')
+        self.assertEqual(revenue_root['amount'], Decimal('0.00'))
+        self.assertEqual(revenue_root['total'], Decimal('26.00'))
+        self.assertEqual(report['expense_tree'][0]['total'], Decimal('4.00'))
+
+    def test_query_count_does_not_grow_with_history(self):
+        today = timezone.now().date()
+        self._close_trades(2, Decimal('5.00'))
+        # دوره‌های بسته شده + جمع گروه‌بندی شده سرفصل‌ها
+        with self.assertNumQueries(2):
+            generate_income_statement(self.trading_account, today, today)
+
+        self._close_trades(20, Decimal('5.00'))
+        with self.assertNumQueries(2):
+            report = generate_income_statement(self.trading_account, today, today)
+        self.assertEqual(report['total_revenues'], Decimal('110.00'))
+
+    def test_excludes_entries_outside_range(self):
+        self._close_trades(1, Decimal('10.00'))
+        report = generate_income_statement(self.trading_account, date(2000, 1, 1), date(2000, 12, 31))
+        self.assertEqual(report['net_profit_loss'], Decimal('0.00'))
+        self.assertEqual(report['revenues'], {})
+
+
+class FiscalPeriodTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='perioduser', password='password123')
+        self.trading_account = create_trading_account(self.user, 'Period Account', TradingAccount.CRYPTO, TradingAccount.FUTURES)
+        self.cash = get_account(self.trading_account, '1010')
+        self.capital = get_account(self.trading_account, '3010')
+        self.revenue = get_account(self.trading_account, '4010')
+        self.expense = get_account(self.trading_account, '5010')
+        self._post(date(2026, 1, 10), self.cash, self.capital, '1000.00')
+        self._post(date(2026, 2, 1), self.cash, self.revenue, '100.00')
+        self._post(date(2026, 2, 15), self.expense, self.cash, '30.00')
+
+    def _post(self, entry_date, debit_account, credit_account, amount):
+        return post_entry(
+            JournalEntry(entry_date=entry_date, description="Test", posted_by=self.user),
+            [
+                JournalEntryLine(account=debit_account, debit_amount=Decimal(amount)),
+                JournalEntryLine(account=credit_account, credit_amount=Decimal(amount)),
+            ]
+        )
+
+    def test_close_moves_income_to_retained_earnings(self):
+        period = close_fiscal_period(self.trading_account, date(2026, 3, 31), self.user)
+
+        self.assertEqual(period.start_date, date(2026, 1, 10))
+        self.assertEqual(period.closing_entry.entry_type, JournalEntry.CLOSING)
+        retained = get_account(self.trading_account, '3090')
+        self.assertEqual(retained.account_type, EQUITY)
+        self.assertEqual(retained.parent_account.account_number, '3000')
+        self.assertEqual(get_account_balance(retained), Decimal('-70.00'))
+        self.assertEqual(get_account_balance(self.revenue), Decimal('0.00'))
+        self.assertEqual(get_account_balance(self.expense), Decimal('0.00'))
+
+        stored = {b.account_id: b for b in period.closing_balances.all()}
+        self.assertEqual((stored[self.cash.id].debit_total, stored[self.cash.id].credit_total), (Decimal('1100.00'), Decimal('30.00')))
+        self.assertEqual(stored[self.revenue.id].balance, Decimal('0.00'))
+        self.assertEqual(stored[self.revenue.id].period_credit, Decimal('100.00'))
+        self.assertEqual(stored[retained.id].period_credit, Decimal('0.00'))
+
+    def test_closed_period_rejects_postings_edits_and_deletes(self):
+        close_fiscal_period(self.trading_account, date(2026, 3, 31), self.user)
+
+        with self.assertRaises(ValueError):
+            self._post(date(2026, 3, 31), self.cash, self.revenue, '5.00')
+        late = self._post(date(2026, 4, 1), self.cash, self.revenue, '5.00')
+
+        # save/delete تراکنش بیرونی را خراب می‌کنند؛ مثل ویوها داخل یک savepoint اجرا می‌شوند
+        late.entry_date = date(2026, 3, 1)
+        with self.assertRaises(ValueError), transaction.atomic():
+            late.save()
+        early = JournalEntry.objects.get(entry_date=date(2026, 2, 1))
+        with self.assertRaises(ValueError), transaction.atomic():
+            early.delete()
+        with self.assertRaises(ValueError):
+            close_fiscal_period(self.trading_account, date(2026, 3, 15), self.user)
+
+        reopen_fiscal_period(self.trading_account)
+        self.assertFalse(FiscalPeriod.objects.exists())
+        self.assertFalse(JournalEntry.objects.filter(entry_type=JournalEntry.CLOSING).exists())
+        self.assertEqual(get_account_balance(self.revenue), Decimal('-105.00'))
+        self._post(date(2026, 3, 1), self.cash, self.revenue, '5.00')
+
+    def test_income_statement_reads_stored_period_activity(self):
+        close_fiscal_period(self.trading_account, date(2026, 1, 31), self.user)
+        close_fiscal_period(self.trading_account, date(2026, 3, 31), self.user)
+        self._post(date(2026, 4, 5), self.cash, self.revenue, '20.00')
+
+        # دوره‌ها + مانده‌های ذخیره شده + آرتیکل‌های بعد از آخرین دوره بسته شده
+        with self.assertNumQueries(3):
+            report = generate_income_statement(self.trading_account, date(2026, 1, 1), date(2026, 12, 31))
+        self.assertEqual(report['total_revenues'], Decimal('120.00'))
+        self.assertEqual(report['total_expenses'], Decimal('30.00'))
+
+        # بازه‌ای که دوره را فقط تا نیمه پوشش می‌دهد از آرتیکل‌ها خوانده می‌شود (بدون سند بستن)
+        report = generate_income_statement(self.trading_account, date(2026, 2, 1), date(2026, 3, 31))
+        self.assertEqual(report['net_profit_loss'], Decimal('70.00'))
+        report = generate_income_statement(self.trading_account, date(2026, 3, 31), date(2026, 3, 31))
+        self.assertEqual(report['net_profit_loss'], Decimal('0.00'))
+
+    def test_delete_trading_account_removes_closed_periods(self):
+        close_fiscal_period(self.trading_account, date(2026, 3, 31), self.user)
+        delete_trading_account(self.trading_account)
+        self.assertFalse(FiscalPeriod.objects.exists())
+        self.assertFalse(PeriodClosingBalance.objects.exists())
+
+
+class EquityCurveTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='equityuser', password='password123')
+        self.trading_account = create_trading_account(self.user, 'Equity Account', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        self.cash = get_account(self.trading_account, '1010')
+        self.spot = get_account(self.trading_account, '1020')
+        self.capital = get_account(self.trading_account, '3010')
+        self.revenue = get_account(self.trading_account, '4010')
+        self.expense = get_account(self.trading_account, '5010')
+        self._post(date(2026, 1, 5), self.cash, self.capital, '1000.00')
+        self._post(date(2026, 1, 20), self.spot, self.cash, '300.00')
+        self.trade_entry = self._post(date(2026, 2, 10), self.cash, self.revenue, '50.00')
+        self._post(date(2026, 2, 10), self.expense, self.cash, '5.00')
+
+    def _post(self, entry_date, debit_account, credit_account, amount):
+        return post_entry(
+            JournalEntry(entry_date=entry_date, description="Test", posted_by=self.user),
+            [
+                JournalEntryLine(account=debit_account, debit_amount=Decimal(amount)),
+                JournalEntryLine(account=credit_account, credit_amount=Decimal(amount)),
+            ]
+        )
+
+    def _curve(self):
+        return list(DailyEquity.objects.filter(trading_account=self.trading_account).order_by('date').values_list(
+            'date', 'cash', 'spot_holdings', 'realized_pnl'
+        ))
+
+    def test_postings_append_daily_points(self):
+        self.assertEqual(self._curve(), [
+            (date(2026, 1, 5), Decimal('1000.00'), Decimal('0.00'), Decimal('0.00')),
+            (date(2026, 1, 20), Decimal('700.00'), Decimal('300.00'), Decimal('0.00')),
+            (date(2026, 2, 10), Decimal('745.00'), Decimal('300.00'), Decimal('45.00')),
+        ])
+        self.assertEqual(DailyEquity.objects.get(trading_account=self.trading_account, date=date(2026, 2, 10)).equity, Decimal('1045.00'))
+
+    def test_back_dated_changes_shift_later_points(self):
+        self._post(date(2026, 1, 10), self.cash, self.capital, '100.00')
+        self.trade_entry.entry_date = date(2026, 1, 25)
+        self.trade_entry.save()
+
+        self.assertEqual([row[1] for row in self._curve()], [
+            Decimal('1000.00'), Decimal('1100.00'), Decimal('800.00'), Decimal('850.00'), Decimal('845.00')
+        ])
+        self.assertEqual(self._curve()[3][3], Decimal('50.00'))
+
+        incremental = self._curve()
+        self.assertEqual(rebuild_equity_curve(self.trading_account), 5)
+        self.assertEqual(self._curve(), incremental)
+
+    def test_period_close_keeps_realized_pnl(self):
+        before = self._curve()
+        # سند بستن درآمد و هزینه را به سود انباشته منتقل می‌کند؛ جمع سود تحقق یافته تغییری نمی‌کند
+        close_fiscal_period(self.trading_account, date(2026, 2, 28), self.user)
+        self.assertEqual(self._curve(), before)
+        self.assertEqual(rebuild_equity_curve(self.trading_account), 3)
+        self.assertEqual(self._curve(), before)
+
+    def test_curve_is_downsampled_from_the_opening_balance(self):
+        curve = get_equity_curve(self.trading_account, start_date=date(2026, 1, 10), interval='week')
+        self.assertEqual(
+            [(point['date'], point['equity']) for point in curve['points']],
+            [(date(2026, 1, 10), Decimal('1000.00')), (date(2026, 1, 20), Decimal('1000.00')), (date(2026, 2, 10), Decimal('1045.00'))]
+        )
+
+        curve = get_equity_curve(self.trading_account, interval='month')
+        self.assertEqual([point['date'] for point in curve['points']], [date(2026, 1, 20), date(2026, 2, 10)])
+
+        with self.assertRaises(ValueError):
+            get_equity_curve(self.trading_account, interval='hour')
+
+    def test_backfill_command_and_api(self):
+        DailyEquity.objects.all().delete()
+        out = io.StringIO()
+        call_command('backfill_equity_curve', '--trading-account', str(self.trading_account.id), stdout=out)
+        self.assertIn('3 equity curve point(s) written', out.getvalue())
+
+        self.client.force_login(self.user)
+        with translation.override('en'):
+            url = reverse('tradingaccount-equity-curve', args=[self.trading_account.id])
+        response = self.client.get(url, {'end_date': '2026-01-31'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([point['equity'] for point in response.json()['points']], [1000.0, 1000.0])
+        self.assertEqual(self.client.get(url, {'interval': 'hour'}).status_code, 400)
+
+
+class ConsolidatedReportTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='groupuser', password='password123')
+        self.future = Asset.objects.create(symbol='SOLUSDT', name='Sol Perpetual', asset_type=Asset.DERIVATIVE)
+        self.accounts = [
+            create_trading_account(self.user, f'Group {i}', TradingAccount.CRYPTO, TradingAccount.FUTURES)
+            for i in range(3)
+        ]
+        for i, trading_account in enumerate(self.accounts):
+            make_deposit(trading_account, Decimal('100.00') * (i + 1), "Capital", self.user)
+            record_direct_closed_trade(
+                trading_account, self.future, Trade.LONG, Decimal('1'), Decimal('100'),
+                Decimal('110'), timezone.now(), Decimal('10.00') * (i + 1), Decimal('1.00'), Decimal('0'), None, "Closed"
+            )
+        self.today = timezone.now().date()
+
+    def test_income_statement_is_one_grouped_query(self):
+        with self.assertNumQueries(1):
+            report = generate_consolidated_income_statement(self.accounts, self.today, self.today)
+
+        revenue, = report['revenues']
+        self.assertEqual(revenue['account_number'], '4010')
+        self.assertEqual(revenue['account_name'], 'Realized PnL - Derivatives')
+        self.assertEqual(report['total_revenues'], Decimal('60.00'))
+        self.assertEqual(report['total_expenses'], Decimal('3.00'))
+        self.assertEqual(report['net_profit_loss'], Decimal('57.00'))
+        self.assertNotIn('per_account', revenue)
+
+    def test_income_statement_per_account_columns(self):
+        selected = [self.accounts[2], self.accounts[0]]
+        with self.assertNumQueries(1):
+            report = generate_consolidated_income_statement(selected, self.today, self.today, per_account=True)
+
+        self.assertEqual(report['trading_account_ids'], [self.accounts[0].id, self.accounts[2].id])
+        self.assertEqual(report['revenues'][0]['per_account'], [Decimal('10.00'), Decimal('30.00')])
+        self.assertEqual(report['net_profit_loss_per_account'], [Decimal('9.00'), Decimal('29.00')])
+        self.assertEqual(report['net_profit_loss'], Decimal('38.00'))
+
+    def test_balance_sheet_matches_single_account_totals(self):
+        with self.assertNumQueries(1):
+            report = generate_consolidated_balance_sheet(self.accounts, per_account=True)
+
+        cash = next(row for row in report['assets'] if row['account_number'] == '1010')
+        self.assertEqual(cash['account_name'], 'Cash')
+        self.assertEqual(cash['per_account'], [get_cash_balance(account) for account in self.accounts])
+        self.assertEqual(cash['amount'], Decimal('657.00'))
+        self.assertEqual(report['total_equity'], Decimal('600.00'))
+
+        report = generate_consolidated_balance_sheet(self.accounts, as_of=date(2000, 1, 1))
+        self.assertEqual(report['total_assets'], Decimal('0.00'))
+        report = generate_consolidated_balance_sheet(self.accounts, as_of=self.today)
+        self.assertEqual(report['total_assets'], Decimal('657.00'))
+
+
+class ReportCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cacheuser', password='password123')
+        self.trading_account = create_trading_account(self.user, 'Cache Account', TradingAccount.CRYPTO, TradingAccount.FUTURES)
+        self.other_account = create_trading_account(self.user, 'Other Cache Account', TradingAccount.CRYPTO, TradingAccount.FUTURES)
+        self.calls = 0
+
+    def _report(self, trading_accounts, params=('2026-01-01',)):
+        def compute():
+            self.calls += 1
+            return {'cash': get_cash_balance(trading_accounts[0])}
+        return cached_report('test_report', trading_accounts, params, compute)
+
+    def _exercise_cache(self):
+        make_deposit(self.trading_account, Decimal('100.00'), "Deposit", self.user)
+        self.assertEqual(self._report([self.trading_account]), {'cash': Decimal('100.00')})
+        # فقط نسخه دفتر خوانده می‌شود
+        with self.assertNumQueries(1):
+            self.assertEqual(self._report([self.trading_account]), {'cash': Decimal('100.00')})
+        self.assertEqual(self.calls, 1)
+
+        # پارامتر دیگر یا حساب دیگر، ورودی جداگانه دارد
+        self._report([self.trading_account], params=('2026-02-01',))
+        self._report([self.trading_account, self.other_account])
+        self.assertEqual(self.calls, 3)
+
+        # ثبت در یک حساب فقط گزارش‌های شامل آن حساب را بی‌اعتبار می‌کند
+        make_deposit(self.other_account, Decimal('1.00'), "Deposit", self.user)
+        self._report([self.trading_account])
+        self.assertEqual(self.calls, 3)
+        self._report([self.trading_account, self.other_account])
+        self.assertEqual(self.calls, 4)
+
+        make_withdrawal(self.trading_account, Decimal('40.00'), "Withdrawal", self.user)
+        self.assertEqual(self._report([self.trading_account]), {'cash': Decimal('60.00')})
+        self.assertEqual(self.calls, 5)
+
+    def test_postings_invalidate_cached_reports(self):
+        self._exercise_cache()
+
+    def test_works_with_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as location:
+            with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}):
+                self._exercise_cache()
+
+    def test_version_written_by_another_process_invalidates_local_cache(self):
+        make_deposit(self.trading_account, Decimal('100.00'), "Deposit", self.user)
+        self._report([self.trading_account])
+        # پروسه دیگری با کش جداگانه خودش ثبت کرده است؛ فقط ردیف دیتابیس عوض شده، نه کش این پروسه
+        TradingAccount.objects.filter(pk=self.trading_account.pk).update(ledger_version='written-elsewhere')
+        self._report([self.trading_account])
+        self.assertEqual(self.calls, 2)
+
+    def test_rolled_back_posting_restores_version(self):
+        version, = get_ledger_versions([self.trading_account.id])
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                make_deposit(self.trading_account, Decimal('100.00'), "Deposit", self.user)
+                self.assertNotEqual(get_ledger_versions([self.trading_account.id]), [version])
+                raise RuntimeError("rollback")
+        self.assertEqual(get_ledger_versions([self.trading_account.id]), [version])
+
+    def test_line_edits_and_chart_changes_bump_version(self):
+        entry = make_deposit(self.trading_account, Decimal('100.00'), "Deposit", self.user)
+        version, = get_ledger_versions([self.trading_account.id])
+
+        line = entry.journalentryline_set.get(account__account_number='1010')
+        line.debit_amount = Decimal('90.00')
+        line.save()
+        edited, = get_ledger_versions([self.trading_account.id])
+        self.assertNotEqual(edited, version)
+
+        account = get_account(self.trading_account, '5060')
+        account.account_name = 'Renamed'
+        account.save()
+        self.assertNotEqual(get_ledger_versions([self.trading_account.id]), [edited])
+
+
+class ExportTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='exportuser', password='password123')
+        self.trading_account = create_trading_account(self.user, 'Export Account', TradingAccount.CRYPTO, TradingAccount.FUTURES)
+        self.future = Asset.objects.create(symbol='XRPUSDT', name='XRP Perpetual', asset_type=Asset.DERIVATIVE)
+        self.deposits = [
+            make_deposit(self.trading_account, Decimal('10.00') * (i + 1), f"Deposit {i}", self.user)
+            for i in range(5)
+        ]
+        JournalEntry.objects.filter(pk=self.deposits[0].pk).update(entry_date=date(2025, 12, 31))
+        self.trade = record_direct_closed_trade(
+            self.trading_account, self.future, Trade.SHORT, Decimal('2'), Decimal('1.5'),
+            Decimal('1.2'), timezone.now(), Decimal('0.60'), Decimal('0.10'), Decimal('0'), None, "Closed"
+        )
+
+    def test_journal_csv_has_one_row_per_line(self):
+        rows = list(csv.reader(io.StringIO(''.join(stream_export('journal', 'csv', self.trading_account, chunk_size=2)))))
+
+        self.assertEqual(rows[0], JOURNAL_FIELDS)
+        # هر واریز دو آرتیکل دارد؛ سند واریز قدیمی اول می‌آید
+        self.assertEqual(rows[1][0], str(self.deposits[0].pk))
+        self.assertEqual(rows[1][1], '2025-12-31')
+        self.assertEqual(len([row for row in rows[1:] if row[2] == JournalEntry.DEPOSIT]), 10)
+
+    def test_journal_ndjson_groups_lines_by_entry_within_range(self):
+        today = timezone.now().date()
+        chunks = stream_export('journal', 'ndjson', self.trading_account, date(2026, 1, 1), today, chunk_size=3)
+        entries = [json.loads(line) for line in ''.join(chunks).splitlines()]
+
+        self.assertEqual(entries[0]['entry_id'], self.deposits[1].pk)
+        self.assertEqual(len([e for e in entries if e['entry_type'] == JournalEntry.DEPOSIT]), 4)
+        self.assertEqual(
+            {(line['account_number'], line['debit'], line['credit']) for line in entries[0]['lines']},
+            {('1010', '20.00', '0.00'), ('3010', '0.00', '20.00')}
+        )
+        trade_entry = next(e for e in entries if e['trade_id'] == self.trade.pk)
+        self.assertGreaterEqual(len(trade_entry['lines']), 2)
+
+    def test_trades_export_and_command(self):
+        trades = [json.loads(line) for line in stream_export('trades', 'ndjson', self.trading_account)]
+        self.assertEqual([t['trade_id'] for t in trades], [self.trade.pk])
+        self.assertEqual(trades[0]['gross_profit_or_loss'], '0.60')
+        self.assertEqual(list(stream_export('trades', 'ndjson', self.trading_account, end_date=date(2000, 1, 1))), [])
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'journal.csv')
+            call_command('export_ledger', self.trading_account.pk, '--output', path, '--chunk-size', '2', stderr=io.StringIO())
+            with open(path, encoding='utf-8', newline='') as exported:
+                self.assertEqual(exported.read(), ''.join(stream_export('journal', 'csv', self.trading_account)))
+
+
+@skipUnless(np is not None, "Trade analytics require NumPy")
+class TradeAnalyticsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='analyticsuser', password='password123')
+        self.trading_account = create_trading_account(self.user, 'Analytics Account', TradingAccount.CRYPTO, TradingAccount.FUTURES)
+        self.btc = Asset.objects.create(symbol='BTCUSDT', name='BTC Perpetual', asset_type=Asset.DERIVATIVE)
+        self.eth = Asset.objects.create(symbol='ETHUSDT', name='ETH Perpetual', asset_type=Asset.DERIVATIVE)
+        make_deposit(self.trading_account, Decimal('1000.00'), "Capital", self.user)
+        # سود خالص به ترتیب: 99، -51، 29، -81
+        for asset, exit_date, gross in [
+            (self.btc, datetime(2026, 1, 10, 12, tzinfo=dt_timezone.utc), Decimal('100.00')),
+            (self.eth, datetime(2026, 1, 20, 12, tzinfo=dt_timezone.utc), Decimal('-50.00')),
+            (self.btc, datetime(2026, 2, 5, 12, tzinfo=dt_timezone.utc), Decimal('30.00')),
+            (self.btc, datetime(2026, 2, 15, 12, tzinfo=dt_timezone.utc), Decimal('-80.00')),
+        ]:
+            record_direct_closed_trade(
+                self.trading_account, asset, Trade.LONG, Decimal('1'), Decimal('100'), Decimal('100'),
+                exit_date, gross, Decimal('0.50'), Decimal('0.50'), self.user, "Closed"
+            )
+
+    def test_metrics_come_from_one_query(self):
+        with self.assertNumQueries(1):
+            report = generate_trade_analytics(self.trading_account)
+
+        summary = report['summary']
+        self.assertEqual((summary['trades'], summary['wins'], summary['losses']), (4, 2, 2))
+        self.assertEqual(summary['win_rate'], 0.5)
+        self.assertEqual(summary['average_win'], 64.0)
+        self.assertEqual(summary['average_loss'], -66.0)
+        self.assertEqual(summary['expectancy'], -1.0)
+        self.assertEqual(summary['profit_factor'], round(128 / 132, 4))
+        # سقف 99 پس از معامله اول، کف -4 پس از معامله آخر
+        self.assertEqual(summary['max_drawdown'], 103.0)
+        self.assertEqual(summary['commissions'], 4.0)
+        self.assertEqual(summary['net_profit_or_loss'], -4.0)
+
+        self.assertEqual(
+            [(row['asset'], row['trades'], row['net_profit_or_loss']) for row in report['by_asset']],
+            [('BTCUSDT', 3, 47.0), ('ETHUSDT', 1, -51.0)]
+        )
+        self.assertEqual(
+            [(row['month'], row['trades'], row['win_rate'], row['commissions']) for row in report['by_month']],
+            [('2026-01', 2, 0.5, 2.0), ('2026-02', 2, 0.5, 2.0)]
+        )
+
+    def test_date_range_and_empty_accounts(self):
+        report = generate_trade_analytics(self.trading_account, start_date=date(2026, 2, 1), end_date=date(2026, 2, 28))
+        self.assertEqual(report['summary']['trades'], 2)
+        self.assertEqual(report['summary']['profit_factor'], round(29 / 81, 4))
+
+        empty = create_trading_account(self.user, 'Empty Analytics', TradingAccount.CRYPTO, TradingAccount.FUTURES)
+        report = generate_trade_analytics(empty)
+        self.assertEqual(report['summary']['trades'], 0)
+        self.assertIsNone(report['summary']['win_rate'])
+        self.assertEqual((report['by_asset'], report['by_month']), ([], []))
+
+    def test_million_trades_are_analyzed_vectorized(self):
+        size = 1_000_000
+        rng = np.random.default_rng(7)
+        asset_ids = rng.integers(1, 20, size)
+        symbols = np.array([f'SYM{i}' for i in range(20)], dtype=object)[asset_ids]
+        months = np.sort(rng.integers(2020 * 12, 2026 * 12, size))
+        gross = rng.normal(0, 100, size)
+        commissions = np.abs(rng.normal(1, 0.1, size))
+
+        started = time.perf_counter()
+        report = analyze_trades(asset_ids, symbols, months, gross, commissions, commissions)
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertEqual(sum(row['trades'] for row in report['by_asset']), size)
+        self.assertEqual(len(report['by_month']), 72)
+
+    def test_api_endpoint(self):
+        self.client.force_login(self.user)
+        with translation.override('en'):
+            url = reverse('tradingaccount-trade-analytics', args=[self.trading_account.id])
+        response = self.client.get(url, {'start_date': '2026-01-01', 'end_date': '2026-01-31'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['summary']['trades'], 2)
+        self.assertEqual(self.client.get(url, {'start_date': 'january'}).status_code, 400)
+
+
+class FillImportTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='importuser', password='password123')
+        self.btc = Asset.objects.create(symbol='BTC', name='Bitcoin', asset_type=Asset.SPOT)
+        self.trading_account = create_trading_account(self.user, 'Imported', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def _write(self, name, rows):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', newline='', encoding='utf-8') as handle:
+            if name.endswith('.csv'):
+                writer = csv.DictWriter(handle, fieldnames=['account', 'type', 'asset', 'quantity', 'amount', 'date', 'description'])
+                writer.writeheader()
+                writer.writerows(rows)
+            else:
+                handle.writelines(json.dumps(row) + '\n' for row in rows)
+        return path
+
+    def _events(self, trading_account):
+        account = trading_account.id
+        return [
+            {'account': account, 'type': 'DEPOSIT', 'amount': '1000', 'date': '2025-01-02', 'description': 'Funding'},
+            {'account': account, 'type': 'BUY', 'asset': 'BTC', 'quantity': '0.5', 'amount': '300', 'date': '2025-01-03'},
+            {'account': account, 'type': 'BUY', 'asset': 'BTC', 'quantity': '0.5', 'amount': '400', 'date': '2025-01-04'},
+            {'account': account, 'type': 'SELL', 'asset': 'BTC', 'quantity': '0.7', 'amount': '600', 'date': '2025-01-05T10:00:00Z'},
+            {'account': account, 'type': 'WITHDRAWAL', 'amount': '100', 'date': '2025-01-06'},
+        ]
+
+    def test_postings_match_the_spot_services(self):
+        manual = create_trading_account(self.user, 'Manual', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        make_deposit(manual, Decimal('1000'), "Funding", self.user)
+        execute_spot_buy(manual, self.btc, Decimal('0.5'), Decimal('300'), "", self.user)
+        execute_spot_buy(manual, self.btc, Decimal('0.5'), Decimal('400'), "", self.user)
+        execute_spot_sell(manual, self.btc, Decimal('0.7'), Decimal('600'), "", self.user)
+        make_withdrawal(manual, Decimal('100'), "", self.user)
+
+        path = self._write('fills.csv', self._events(self.trading_account))
+        self.assertEqual(import_fills(path, batch_size=3), 5)
+
+        for number in ['1010', '1020', '3010', '4030']:
+            self.assertEqual(
+                get_account_balance(get_account(self.trading_account, number)),
+                get_account_balance(get_account(manual, number)),
+                number
+            )
+        self.assertEqual(
+            sorted(AssetLot.objects.filter(trading_account=self.trading_account).values_list('remaining_quantity', flat=True)),
+            sorted(AssetLot.objects.filter(trading_account=manual).values_list('remaining_quantity', flat=True))
+        )
+        sell = JournalEntry.objects.filter(
+            journalentryline__account__trading_account=self.trading_account, entry_type=JournalEntry.SPOT_SELL
+        ).distinct().get()
+        self.assertEqual(sell.entry_date, date(2025, 1, 5))
+        self.assertEqual(sell.posted_by, self.user)
+        self.assertEqual(sell.lot_consumptions.count(), 2)
+        self.assertEqual(
+            AccountDailyBalance.objects.filter(account=get_account(self.trading_account, '1010')).count(), 5
+        )
+
+    def test_resumes_from_checkpoint_after_a_failed_batch(self):
+        events = self._events(self.trading_account)
+        events[3]['quantity'] = '5'  # بیش از موجودی؛ دسته دوم rollback می‌شود
+        path = self._write('fills.jsonl', events)
+
+        with self.assertRaises(CommandError):
+            call_command('import_fills', path, '--batch-size', '2', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(ImportCheckpoint.objects.get(name=os.path.abspath(path)).rows_committed, 2)
+        self.assertEqual(AssetLot.objects.filter(trading_account=self.trading_account).count(), 1)
+        self.assertEqual(get_cash_balance(self.trading_account), Decimal('700.00'))
+
+        events[3]['quantity'] = '0.7'
+        self._write('fills.jsonl', events)
+        out = io.StringIO()
+        call_command('import_fills', path, '--batch-size', '2', stdout=out, stderr=io.StringIO())
+        self.assertIn("Imported 3 record(s)", out.getvalue())
+        self.assertEqual(ImportCheckpoint.objects.get(name=os.path.abspath(path)).rows_committed, 5)
+        self.assertEqual(AssetLot.objects.filter(trading_account=self.trading_account).count(), 2)
+        self.assertEqual(get_cash_balance(self.trading_account), Decimal('800.00'))
+
+        # اجرای دوباره چیزی را تکرار نمی‌کند
+        self.assertEqual(import_fills(path), 0)
+
+    def test_rolled_back_batch_leaves_no_stale_chart(self):
+        events = self._events(self.trading_account)[:4]
+        # فروش سودآور سرفصل 4030 را می‌سازد و رکورد بعدی (برداشت بیش از موجودی) کل دسته را rollback می‌کند
+        events.append({'account': self.trading_account.id, 'type': 'WITHDRAWAL', 'amount': '5000', 'date': '2025-01-06'})
+        path = self._write('rollback.jsonl', events)
+        with self.assertRaises(FillImportError):
+            import_fills(path)
+        self.assertFalse(ChartOfAccount.objects.filter(trading_account=self.trading_account, account_number='4030').exists())
+
+        make_deposit(self.trading_account, Decimal('1000'), "Deposit", self.user)
+        execute_spot_buy(self.trading_account, self.btc, Decimal('1'), Decimal('100'), "", self.user)
+        execute_spot_sell(self.trading_account, self.btc, Decimal('1'), Decimal('150'), "", self.user)
+        self.assertEqual(get_account_balance(get_account(self.trading_account, '4030')), Decimal('-50.00'))
+
+    def test_invalid_records_report_their_line(self):
+        path = self._write('bad.csv', [
+            {'account': self.trading_account.id, 'type': 'DEPOSIT', 'amount': '10', 'date': '2025-01-02'},
+            {'account': self.trading_account.id, 'type': 'SWAP', 'amount': '10', 'date': '2025-01-02'},
+        ])
+        with self.assertRaises(FillImportError) as raised:
+            import_fills(path)
+        self.assertEqual(raised.exception.line_number, 3)
+        self.assertFalse(JournalEntry.objects.exists())
+
+        with self.assertRaises(FillImportError):
+            post_fills([Fill(2, self.trading_account.id, 'WITHDRAWAL', None, None, Decimal('5'), date(2025, 1, 2), '')])
+
+    def test_statement_count_does_not_grow_with_batch_size(self):
+        def fills(count):
+            return [
+                Fill(i, self.trading_account.id, 'DEPOSIT' if i % 2 else 'BUY', None if i % 2 else 'BTC',
+                     None if i % 2 else Decimal('0.1'), Decimal('10'), date(2025, 2, 1), '')
+                for i in range(1, count + 1)
+            ]
+        post_fills(fills(2))
+        with CaptureQueriesContext(connection) as small:
+            post_fills(fills(6))
+        small_batch_queries = len(small)
+        with self.assertNumQueries(small_batch_queries):
+            post_fills(fills(40))
+
+
+class IdempotencyKeyTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='idemuser', password='password123')
+        self.btc = Asset.objects.create(symbol='BTC', name='Bitcoin', asset_type=Asset.SPOT)
+        self.trading_account = create_trading_account(self.user, 'Idempotent', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        self.client.force_login(self.user)
+
+    def _url(self, name, *args):
+        with translation.override('en'):
+            return reverse(name, args=args)
+
+    def _post(self, name, pk, data, key=None):
+        headers = {'Idempotency-Key': key} if key else {}
+        return self.client.post(self._url(name, pk), data, content_type='application/json', headers=headers)
+
+    def _entries(self, entry_type):
+        return JournalEntry.objects.filter(entry_type=entry_type).count()
+
+    def test_retried_deposit_posts_once(self):
+        first = self._post('tradingaccount-deposit', self.trading_account.id, {'amount': '100.00'}, key='dep-1')
+        with CaptureQueriesContext(connection) as replay_queries:
+            retry = self._post('tradingaccount-deposit', self.trading_account.id, {'amount': '100.00'}, key='dep-1')
+
+        self.assertEqual(retry.status_code, first.status_code)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(self._entries(JournalEntry.DEPOSIT), 1)
+        self.assertEqual(get_cash_balance(self.trading_account), Decimal('100.00'))
+        self.assertFalse([q for q in replay_queries.captured_queries if 'core_journalentry' in q['sql']])
+
+        # بدون کلید هر درخواست جداگانه ثبت می‌شود
+        self._post('tradingaccount-deposit', self.trading_account.id, {'amount': '100.00'})
+        self._post('tradingaccount-deposit', self.trading_account.id, {'amount': '100.00'})
+        self.assertEqual(self._entries(JournalEntry.DEPOSIT), 3)
+
+    def test_key_reused_for_a_different_request_is_rejected(self):
+        self._post('tradingaccount-deposit', self.trading_account.id, {'amount': '100.00'}, key='same')
+        response = self._post('tradingaccount-deposit', self.trading_account.id, {'amount': '999.00'}, key='same')
+        self.assertEqual(response.status_code, 422)
+        response = self._post('tradingaccount-withdraw', self.trading_account.id, {'amount': '100.00'}, key='same')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(get_cash_balance(self.trading_account), Decimal('100.00'))
+
+    def test_failed_requests_are_not_stored(self):
+        response = self._post('tradingaccount-withdraw', self.trading_account.id, {'amount': '50.00'}, key='wd-1')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        make_deposit(self.trading_account, Decimal('80.00'), "Deposit", self.user)
+        self.assertEqual(self._post('tradingaccount-withdraw', self.trading_account.id, {'amount': '50.00'}, key='wd-1').status_code, 200)
+        self.assertEqual(self._post('tradingaccount-withdraw', self.trading_account.id, {'amount': '50.00'}, key='wd-1').status_code, 200)
+        self.assertEqual(get_cash_balance(self.trading_account), Decimal('30.00'))
+
+    def test_keys_are_scoped_per_user(self):
+        other = User.objects.create_user(username='idemother', password='password123')
+        other_account = create_trading_account(other, 'Other Idempotent', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        self._post('tradingaccount-deposit', self.trading_account.id, {'amount': '10.00'}, key='shared')
+        self.client.force_login(other)
+        self._post('tradingaccount-deposit', other_account.id, {'amount': '10.00'}, key='shared')
+        self.assertEqual(get_cash_balance(other_account), Decimal('10.00'))
+
+    def test_spot_trades_and_trade_close(self):
+        make_deposit(self.trading_account, Decimal('1000.00'), "Deposit", self.user)
+        buy = {'asset_id': self.btc.id, 'quantity': '1', 'trade_cost': '400.00'}
+        sell = {'asset_id': self.btc.id, 'quantity': '0.5', 'trade_cost': '300.00'}
+        for _ in range(2):
+            self.assertEqual(self._post('tradingaccount-execute-spot-buy', self.trading_account.id, buy, key='buy').status_code, 200)
+            self.assertEqual(self._post('tradingaccount-execute-spot-sell', self.trading_account.id, sell, key='sell').status_code, 200)
+        self.assertEqual(self._entries(JournalEntry.SPOT_BUY), 1)
+        self.assertEqual(self._entries(JournalEntry.SPOT_SELL), 1)
+        self.assertEqual(get_cash_balance(self.trading_account), Decimal('900.00'))
+
+        future = Asset.objects.create(symbol='BTCUSDT', name='BTC Perpetual', asset_type=Asset.DERIVATIVE)
+        futures_account = create_trading_account(self.user, 'Futures Idempotent', TradingAccount.CRYPTO, TradingAccount.FUTURES)
+        trade = open_trade(futures_account, future, Trade.LONG, Decimal('1'), Decimal('100'))
+        close = {'gross_profit_or_loss': '25.00', 'broker_commission': '1.00', 'trader_commission': '2.00',
+                 'commission_recipient': self.user.id}
+        first = self._post('trade-close', trade.id, close, key='close-1')
+        retry = self._post('trade-close', trade.id, close, key='close-1')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(trade.journal_entries.count(), 1)
+
+    def test_prune_removes_expired_keys(self):
+        self._post('tradingaccount-deposit', self.trading_account.id, {'amount': '10.00'}, key='old')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=30))
+        self._post('tradingaccount-deposit', self.trading_account.id, {'amount': '10.00'}, key='new')
+
+        self.assertEqual(prune_idempotency_keys(), 1)
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['new'])
+
+
+@override_settings(LEDGER_SYNC_LAG_SECONDS=0)
+class LedgerStreamTests(TestCase):
+
+    def setUp(self):
+        self.accountant = User.objects.create_user(username='syncaccountant', password='password123', role='Accountant')
+        self.accounts = [
+            create_trading_account(self.accountant, f'Sync {i}', TradingAccount.CRYPTO, TradingAccount.SPOT)
+            for i in range(2)
+        ]
+        self.client.force_login(self.accountant)
+        with translation.override('en'):
+            self.url = reverse('journalentry-stream')
+
+    def _stream(self, params=None):
+        response = self.client.get(self.url, params or {})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_full_and_incremental_sync(self):
+        for i in range(3):
+            make_deposit(self.accounts[0], Decimal('10.00'), f"Deposit {i}", self.accountant)
+        transfer = transfer_funds_between_accounts(self.accounts[0], self.accounts[1], Decimal('5.00'), "Move", self.accountant)
+
+        records = self._stream()
+        self.assertEqual([record['entry_id'] for record in records], list(
+            JournalEntry.objects.order_by('id').values_list('id', flat=True)
+        ))
+        self.assertTrue(all(len(record['lines']) == 2 for record in records))
+        self.assertEqual(records[-1]['entry_type'], JournalEntry.TRANSFER)
+        self.assertEqual(
+            {line['trading_account_id'] for line in records[-1]['lines']}, {self.accounts[0].id, self.accounts[1].id}
+        )
+
+        make_deposit(self.accounts[1], Decimal('7.00'), "Later", self.accountant)
+        later = self._stream({'since_id': records[-1]['entry_id']})
+        self.assertEqual([record['description'] for record in later], ["Later"])
+        self.assertEqual(later[0]['lines'][0]['debit'], '7.00')
+
+        # سند انتقال با همه آرتیکل‌هایش در خروجی حساب مقصد هم می‌آید
+        second = self._stream({'trading_account': self.accounts[1].id})
+        self.assertEqual([record['entry_id'] for record in second], [transfer.id, later[0]['entry_id']])
+        self.assertEqual(len(second[0]['lines']), 2)
+
+    def test_query_count_does_not_grow_with_entries(self):
+        make_deposit(self.accounts[0], Decimal('1.00'), "Deposit", self.accountant)
+        with CaptureQueriesContext(connection) as baseline:
+            self._stream()
+        baseline_queries = len(baseline)
+
+        for i in range(30):
+            make_deposit(self.accounts[0], Decimal('1.00'), f"Deposit {i}", self.accountant)
+        with self.assertNumQueries(baseline_queries):
+            self.assertEqual(len(self._stream()), 31)
+        # با دسته‌های کوچک، سند‌هایی که بین دو دسته شکسته می‌شوند همچنان یک رکورد هستند
+        self.assertEqual(len(list(iter_ledger_sync(chunk_size=3))), 31)
+
+    def test_recent_entries_wait_for_the_safety_lag(self):
+        settled = make_deposit(self.accounts[0], Decimal('1.00'), "Settled", self.accountant)
+        recent = make_deposit(self.accounts[0], Decimal('2.00'), "Recent", self.accountant)
+        later = make_deposit(self.accounts[1], Decimal('3.00'), "Later", self.accountant)
+        old = timezone.now() - timedelta(minutes=5)
+        JournalEntry.objects.filter(pk__in=[settled.id, later.id]).update(created_at=old)
+
+        # شناسه recent پیش از later گرفته شده؛ اگر تراکنشش هنوز باز بود، ارسال later به مصرف‌کننده
+        # (و جلو رفتن since_id او) باعث می‌شد recent هرگز همگام نشود. پس همگام‌سازی پیش از recent می‌ایستد.
+        with override_settings(LEDGER_SYNC_LAG_SECONDS=60):
+            self.assertEqual([record['entry_id'] for record in self._stream()], [settled.id])
+
+            JournalEntry.objects.filter(pk=recent.id).update(created_at=old)
+            self.assertEqual(
+                [record['entry_id'] for record in self._stream({'since_id': settled.id})], [recent.id, later.id]
+            )
+
+    def test_rejects_bad_params_and_other_roles(self):
+        self.assertEqual(self.client.get(self.url, {'since_id': 'abc'}).status_code, 400)
+        trader = User.objects.create_user(username='synctrader', password='password123', role='Trader')
+        self.client.force_login(trader)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class BulkTradeImportTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='bulkuser', password='password123')
+        self.trader = User.objects.create_user(username='bulktrader', password='password123', role='Trader')
+        self.future = Asset.objects.create(symbol='ETHUSDT', name='ETH Perpetual', asset_type=Asset.DERIVATIVE)
+        self.spot = Asset.objects.create(symbol='ETH', name='Ether', asset_type=Asset.SPOT)
+        self.trading_account = create_trading_account(self.user, 'Bulk Account', TradingAccount.CRYPTO, TradingAccount.FUTURES)
+        self.exit_date = datetime(2026, 3, 2, 16, tzinfo=dt_timezone.utc)
+
+    def _rows(self, trading_account, count):
+        return [
+            {
+                'trading_account': trading_account.id, 'asset': self.future.id, 'position_side': Trade.LONG,
+                'quantity': Decimal('1'), 'entry_price': Decimal('100'), 'exit_price': Decimal('101'),
+                'exit_date': self.exit_date, 'gross_profit_or_loss': Decimal('10.00') if i % 2 else Decimal('-4.00'),
+                'broker_commission': Decimal('1.00'), 'trader_commission': Decimal('0.50'),
+                'commission_recipient': self.trader.id, 'exit_description': f"Fill {i}",
+            }
+            for i in range(count)
+        ]
+
+    def test_matches_single_trade_posting(self):
+        single = create_trading_account(self.user, 'Single Account', TradingAccount.CRYPTO, TradingAccount.FUTURES)
+        rows = self._rows(self.trading_account, 6)
+        for row in self._rows(single, 6):
+            record_direct_closed_trade(
+                single, self.future, row['position_side'], row['quantity'], row['entry_price'], row['exit_price'],
+                row['exit_date'], row['gross_profit_or_loss'], row['broker_commission'], row['trader_commission'],
+                self.trader, row['exit_description']
+            )
+
+        trades = record_closed_trades_bulk(rows)
+
+        self.assertEqual(len(trades), 6)
+        self.assertTrue(all(trade.journal_entries.get().entry_type == JournalEntry.TRADE_CLOSE for trade in trades))
+        for number in ['1010', '4010', '5010', f'2010-{self.trader.id}']:
+            self.assertEqual(
+                get_account_balance(get_account(self.trading_account, number)),
+                get_account_balance(get_account(single, number)),
+                number
+            )
+        self.assertEqual(get_cash_balance(self.trading_account), Decimal('12.00'))
+
+    def test_statement_count_does_not_grow_with_rows(self):
+        small = create_trading_account(self.user, 'Small Batch', TradingAccount.CRYPTO, TradingAccount.FUTURES)
+        large = create_trading_account(self.user, 'Large Batch', TradingAccount.CRYPTO, TradingAccount.FUTURES)
+        record_closed_trades_bulk(self._rows(self.trading_account, 1))  # سرفصل بدهی به تریدر در هر دو حساب ساخته شود
+        for trading_account in (small, large):
+            record_closed_trades_bulk(self._rows(trading_account, 1))
+
+        # اندازه دسته‌ها زیر سقف پارامترهای SQLite (999) می‌ماند تا bulk_create به چند INSERT شکسته نشود
+        with CaptureQueriesContext(connection) as small_batch:
+            record_closed_trades_bulk(self._rows(small, 5))
+        small_batch_queries = len(small_batch)
+        with self.assertNumQueries(small_batch_queries):
+            record_closed_trades_bulk(self._rows(large, 25))
+        self.assertEqual(Trade.objects.filter(trading_account=large).count(), 26)
+
+    def test_invalid_rows_are_reported_and_nothing_is_written(self):
+        other = User.objects.create_user(username='bulkother', password='password123')
+        foreign = create_trading_account(other, 'Foreign Bulk', TradingAccount.CRYPTO, TradingAccount.FUTURES)
+        rows = self._rows(self.trading_account, 4)
+        rows[1]['asset'] = self.spot.id
+        rows[2]['commission_recipient'] = None
+        rows[3]['trading_account'] = foreign.id
+
+        with self.assertRaises(TradeImportError) as raised:
+            record_closed_trades_bulk(rows, trading_accounts=TradingAccount.objects.filter(user=self.user))
+        self.assertEqual(sorted(raised.exception.errors), [1, 2, 3])
+        self.assertFalse(Trade.objects.exists())
+        self.assertFalse(JournalEntry.objects.filter(entry_type=JournalEntry.TRADE_CLOSE).exists())
+
+    def test_api_endpoint(self):
+        self.client.force_login(self.user)
+        with translation.override('en'):
+            url = reverse('trade-bulk-import')
+        payload = [
+            {**row, 'exit_date': row['exit_date'].isoformat(), **{key: str(row[key]) for key in (
+                'quantity', 'entry_price', 'exit_price', 'gross_profit_or_loss', 'broker_commission', 'trader_commission'
+            )}}
+            for row in self._rows(self.trading_account, 3)
+        ]
+
+        response = self.client.post(url, payload, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 3)
+
+        payload[0]['position_side'] = 'SIDEWAYS'
+        payload[2]['asset'] = self.spot.id
+        response = self.client.post(url, payload, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()['errors']), ['0'])
+        self.assertIn('position_side', response.json()['errors']['0'])
+
+        payload[0]['position_side'] = Trade.SHORT
+        errors = self.client.post(url, payload, content_type='application/json').json()['errors']
+        self.assertEqual(list(errors), ['2'])
+        self.assertIn('non_field_errors', errors['2'])
+        self.assertEqual(Trade.objects.count(), 3)
+
+
+class ApiListTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_user(username='apiadmin', password='password123', role='Admin')
+        self.user = User.objects.create_user(username='apiuser', password='password123')
+        self.trading_account = create_trading_account(self.user, 'API Account', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        self.other_account = create_trading_account(self.user, 'API Other', TradingAccount.CRYPTO, TradingAccount.FUTURES)
+        self.btc = Asset.objects.create(symbol='BTC', name='Bitcoin', asset_type=Asset.SPOT)
+        self.future = Asset.objects.create(symbol='BTCUSDT', name='BTC Perpetual', asset_type=Asset.DERIVATIVE)
+        for i in range(12):
+            make_deposit(self.trading_account, Decimal('10.00') + i, f"Deposit {i}", self.user)
+            deposit_spot_asset(self.trading_account, self.btc, Decimal('0.1'), Decimal('100'), f"Spot {i}", self.user)
+            record_direct_closed_trade(
+                self.other_account, self.future, Trade.LONG, Decimal('1'), Decimal('100'), Decimal('110'),
+                timezone.now(), Decimal('10.00'), Decimal('1.00'), Decimal('0'), None, "Closed"
+            )
+        self.client.force_login(self.admin)
+
+    def _url(self, name):
+        with translation.override('en'):
+            return reverse(name)
+
+    def _walk(self, name, budget, params=None):
+        """
+        همه صفحه‌ها را دنبال می‌کند و بررسی می‌کند هر صفحه دقیقا budget پرس‌وجو دارد.
+        """
+        rows, url, query = [], self._url(name), {'page_size': 5, **(params or {})}
+        while url:
+            with self.assertNumQueries(budget):
+                response = self.client.get(url, query)
+            self.assertEqual(response.status_code, 200)
+            rows.extend(response.json()['results'])
+            url, query = response.json()['next'], None
+        return rows
+
+    def test_every_page_has_a_fixed_query_budget(self):
+        # نشست + کاربر + صفحه (+ آرتیکل‌های اسناد)
+        entries = self._walk('journalentry-list', 4, {'trading_account': self.trading_account.id})
+        self.assertEqual(len(entries), 24)
+        self.assertEqual(len(entries[0]['lines']), 2)
+        self.assertEqual([entry['id'] for entry in entries], sorted((entry['id'] for entry in entries), reverse=True))
+
+        lines = self._walk('journalentryline-list', 3, {'account_number': '1020'})
+        self.assertEqual(len(lines), 12)
+        self.assertEqual(lines[0]['entry_date'], timezone.now().date().isoformat())
+
+        accounts = self._walk('chartofaccount-list', 3, {'trading_account': self.trading_account.id})
+        self.assertEqual(len(accounts), ChartOfAccount.objects.filter(trading_account=self.trading_account).count())
+        lots = self._walk('assetlot-list', 3, {'status': 'open'})
+        self.assertEqual((len(lots), lots[0]['asset_symbol']), (12, 'BTC'))
+        self.assertEqual(len(self._walk('trade-list', 3, {'trading_account': self.other_account.id, 'status': 'CLOSED'})), 12)
+
+    def test_filters(self):
+        today = timezone.now().date()
+        url = self._url('journalentry-list')
+        self.assertEqual(self.client.get(url, {'start_date': (today + timedelta(days=1)).isoformat()}).json()['results'], [])
+        response = self.client.get(url, {'entry_type': JournalEntry.DEPOSIT, 'end_date': today.isoformat()})
+        self.assertEqual(len(response.json()['results']), 12)
+
+        response = self.client.get(self._url('journalentryline-list'), {'trading_account': self.other_account.id, 'account_number': '4010'})
+        self.assertEqual(len(response.json()['results']), 12)
+
+        self.assertEqual(self.client.get(self._url('assetlot-list'), {'status': 'consumed'}).json()['results'], [])
+        self.assertEqual(self.client.get(self._url('trade-list'), {'end_date': (today - timedelta(days=1)).isoformat()}).json()['results'], [])
+
+        for name, params in [
+            ('journalentry-list', {'start_date': 'yesterday'}),
+            ('journalentry-list', {'entry_type': 'BOGUS'}),
+            ('assetlot-list', {'status': 'half'}),
+            ('chartofaccount-list', {'trading_account': 'x'}),
+        ]:
+            self.assertEqual(self.client.get(self._url(name), params).status_code, 400, (name, params))
+
+    def test_page_size_is_capped(self):
+        response = self.client.get(self._url('journalentry-list'), {'page_size': 100000})
+        self.assertEqual(len(response.json()['results']), 36)
+        self.assertLessEqual(IdCursorPagination.max_page_size, 1000)
+        self.assertIsNone(response.json()['next'])
+
+
+class ReportJobTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='jobuser', password='password123')
+        self.trading_account = create_trading_account(self.user, 'Job Account', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        make_deposit(self.trading_account, Decimal('250.00'), "Deposit", self.user)
+        self.client.force_login(self.user)
+
+    def _url(self, name, *args):
+        with translation.override('en'):
+            return reverse(name, args=args)
+
+    def test_submit_run_and_download(self):
+        response = self.client.post(self._url('report-job-list'), {
+            'trading_account': self.trading_account.id,
+            'report_type': ReportJob.TRIAL_BALANCE,
+            'params': {'as_of': timezone.now().date().isoformat()},
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        job_id = response.json()['id']
+        self.assertEqual(response.json()['status'], ReportJob.PENDING)
+
+        response = self.client.get(self._url('report-job-download', job_id))
+        self.assertEqual(response.status_code, 409)
+
+        call_command('run_report_worker', '--once', stdout=io.StringIO())
+
+        self.assertEqual(self.client.get(self._url('report-job-detail', job_id)).json()['status'], ReportJob.SUCCEEDED)
+        response = self.client.get(self._url('report-job-download', job_id))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response['Content-Disposition'])
+        report = response.json()
+        self.assertEqual(Decimal(report['total_debit']), Decimal('250.00'))
+        cash = next(row for row in report['accounts'] if row['account_number'] == '1010')
+        self.assertEqual(Decimal(cash['balance']), Decimal('250.00'))
+
+    def test_rejects_bad_params_and_foreign_accounts(self):
+        response = self.client.post(self._url('report-job-list'), {
+            'trading_account': self.trading_account.id,
+            'report_type': ReportJob.INCOME_STATEMENT,
+            'params': {'start_date': '2026-02-01'},
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        other = User.objects.create_user(username='jobother', password='password123')
+        other_account = create_trading_account(other, 'Other Job Account', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        response = self.client.post(self._url('report-job-list'), {
+            'trading_account': other_account.id, 'report_type': ReportJob.BALANCE_SHEET, 'params': {},
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ReportJob.objects.exists())
+
+    def test_jobs_run_in_order_and_failures_are_recorded(self):
+        first = submit_report_job(self.user, self.trading_account, ReportJob.BALANCE_SHEET)
+        second = ReportJob.objects.create(
+            user=self.user, trading_account=self.trading_account,
+            report_type=ReportJob.INCOME_STATEMENT, params={'start_date': 'not a date', 'end_date': '2026-01-01'}
+        )
+
+        claimed = claim_next_job('test-worker')
+        self.assertEqual((claimed.pk, claimed.status, claimed.worker), (first.pk, ReportJob.RUNNING, 'test-worker'))
+        self.assertEqual(run_job(claimed).result['total_assets'], Decimal('250.00'))
+
+        failed = run_job(claim_next_job())
+        self.assertEqual((failed.pk, failed.status), (second.pk, ReportJob.FAILED))
+        self.assertIn('ValueError', failed.error)
+        self.assertIsNone(claim_next_job())
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = submit_report_job(self.user, self.trading_account, ReportJob.BALANCE_SHEET)
+        claim_next_job()
+        ReportJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(claim_next_job().attempts, 2)
+
+    def test_worker_requeues_jobs_that_go_stale_while_it_runs(self):
+        first = submit_report_job(self.user, self.trading_account, ReportJob.BALANCE_SHEET)
+        # کار دیگری که worker دیگری برداشته و هنوز تازه است؛ در شروع این worker به صف برنمی‌گردد
+        orphan = submit_report_job(self.user, self.trading_account, ReportJob.BALANCE_SHEET)
+        ReportJob.objects.filter(pk=orphan.pk).update(status=ReportJob.RUNNING, worker='crashed', started_at=timezone.now())
+
+        def run_and_let_orphan_go_stale(job):
+            # worker دیگر در همین فاصله از کار افتاده و کارش قدیمی شده است
+            ReportJob.objects.filter(pk=orphan.pk).update(started_at=timezone.now() - timedelta(hours=1))
+            return run_job(job)
+
+        with mock.patch('core.management.commands.run_report_worker.run_job', side_effect=run_and_let_orphan_go_stale):
+            call_command('run_report_worker', '--once', '--requeue-interval', '0', stdout=io.StringIO())
+
+        self.assertEqual(ReportJob.objects.get(pk=first.pk).status, ReportJob.SUCCEEDED)
+        self.assertEqual(ReportJob.objects.get(pk=orphan.pk).status, ReportJob.SUCCEEDED)
+
+
+@skipUnless(connection.vendor == 'postgresql', "EXPLAIN plans are only checked on PostgreSQL")
+class QueryPlanTests(TestCase):
+    """
+    پرس‌وجوهای اصلی سرویس‌ها باید از ایندکس‌ها استفاده کنند؛ اگر ایندکسی حذف
+    یا پرس‌وجویی طوری تغییر کند که به Seq Scan برگردد، این تست‌ها شکست می‌خورند.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        users = [User.objects.create_user(username=f'plan{i}', password='password123') for i in range(10)]
+        cls.trading_accounts = create_trading_accounts_bulk([
+            {'user': user, 'name': f'{user.username} Spot', 'account_type': TradingAccount.CRYPTO, 'account_purpose': TradingAccount.SPOT}
+            for user in users
+        ])
+        cls.trading_account = cls.trading_accounts[0]
+        cls.asset = Asset.objects.create(symbol='BTC', name='Bitcoin', asset_type=Asset.SPOT)
+        cls.future = Asset.objects.create(symbol='BTCUSDT', name='Bitcoin Perpetual', asset_type=Asset.DERIVATIVE)
+
+        entries = []
+        for trading_account in cls.trading_accounts:
+            cash_account = get_account(trading_account, '1010')
+            equity_account = get_account(trading_account, '3010')
+            for day in range(1, 21):
+                entries.append((
+                    JournalEntry(entry_date=date(2024, 1, day), description=f"Deposit {day}", posted_by=users[0]),
+                    [
+                        JournalEntryLine(account=cash_account, debit_amount=Decimal('100.00')),
+                        JournalEntryLine(account=equity_account, credit_amount=Decimal('100.00')),
+                    ]
+                ))
+        post_entries(entries)
+
+        for trading_account in cls.trading_accounts:
+            for i in range(20):
+                AssetLot.objects.create(
+                    trading_account=trading_account, asset=cls.asset,
+                    quantity=Decimal('1'), purchase_price_usd=Decimal('100')
+                )
+                Trade.objects.create(
+                    trading_account=trading_account, asset=cls.future,
+                    position_side=Trade.LONG, status=Trade.CLOSED if i % 2 else Trade.OPEN
+                )
+        AssetLot.objects.filter(trading_account=cls.trading_account).update(remaining_quantity=0)
+
+    def setUp(self):
+        # روی داده‌های کوچک تست، برنامه‌ریز ممکن است Seq Scan یا مرتب‌سازی در حافظه را ارزان‌تر بداند؛
+        # با خاموش کردن آن‌ها فقط زمانی این دو را می‌بینیم که هیچ ایندکس مناسبی وجود نداشته باشد
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+            cursor.execute("SET enable_seqscan = off")
+            cursor.execute("SET enable_sort = off")
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute("RESET enable_seqscan")
+            cursor.execute("RESET enable_sort")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertNotIn('Seq Scan', plan)
+        self.assertIn(index_name, plan)
+
+    def test_chart_of_account_lookup(self):
+        self.assertUsesIndex(
+            ChartOfAccount.objects.filter(trading_account=self.trading_account, account_number='1010'),
+            'unique_account_number_per_trading_account'
+        )
+
+    def test_journal_entry_date_range(self):
+        self.assertUsesIndex(
+            JournalEntry.objects.filter(entry_date__range=[date(2024, 1, 5), date(2024, 1, 10)]),
+            'journalentry_date_idx'
+        )
+
+    def test_account_lines(self):
+        self.assertUsesIndex(
+            JournalEntryLine.objects.filter(
+                account=get_account(self.trading_account, '1010'),
+                journal_entry__entry_date__range=[date(2024, 1, 5), date(2024, 1, 10)]
+            ),
+            'jeline_account_entry_idx'
+        )
+
+    def test_open_lots_in_fifo_order(self):
+        self.assertUsesIndex(
+            AssetLot.objects.filter(
+                trading_account=self.trading_accounts[1], asset=self.asset, remaining_quantity__gt=0
+            ).order_by('purchase_date', 'id'),
+            'assetlot_open_fifo_idx'
+        )
+
+    def test_trades_by_status(self):
+        self.assertUsesIndex(
+            Trade.objects.filter(trading_account=self.trading_account, status=Trade.OPEN).order_by('-entry_date'),
+            'trade_account_status_idx'
+        )
+
+
+
+class LedgerIndexMigrationTests(TransactionTestCase):
+    """
+    مهاجرت 0009 پیش از قید یکتایی، سرفصل‌های تکراری را ادغام می‌کند.
+    """
+
+    def setUp(self):
+        from django.db.migrations.executor import MigrationExecutor
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate([('core', '0008_accountdailybalance')])
+        self.executor.loader.build_graph()
+
+    def tearDown(self):
+        self.executor.loader.build_graph()
+        self.executor.migrate(self.executor.loader.graph.leaf_nodes())
+
+    def test_duplicate_accounts_are_merged_before_the_unique_constraint(self):
+        apps = self.executor.loader.project_state([('core', '0008_accountdailybalance')]).apps
+        HistoricalUser = apps.get_model('core', 'User')
+        HistoricalTradingAccount = apps.get_model('core', 'TradingAccount')
+        HistoricalChart = apps.get_model('core', 'ChartOfAccount')
+        HistoricalEntry = apps.get_model('core', 'JournalEntry')
+        HistoricalLine = apps.get_model('core', 'JournalEntryLine')
+        HistoricalBalance = apps.get_model('core', 'AccountBalance')
+
+        user = HistoricalUser.objects.create(username='migrator')
+        trading_account = HistoricalTradingAccount.objects.create(
+            user=user, name='Legacy', account_type='CRYPTO', account_purpose='SPOT'
+        )
+        equity = HistoricalChart.objects.create(
+            trading_account=trading_account, account_number='3010', account_name='Capital', account_type=EQUITY
+        )
+        cash = HistoricalChart.objects.create(
+            trading_account=trading_account, account_number='1010', account_name='Cash', account_type=ASSET
+        )
+        duplicate_cash = HistoricalChart.objects.create(
+            trading_account=trading_account, account_number='1010', account_name='Cash', account_type=ASSET
+        )
+        child = HistoricalChart.objects.create(
+            trading_account=trading_account, account_number='1011', account_name='Petty cash',
+            account_type=ASSET, parent_account=duplicate_cash
+        )
+        for account, amount, day in ((cash, Decimal('100.00'), date(2025, 1, 1)), (duplicate_cash, Decimal('50.00'), date(2025, 1, 2))):
+            entry = HistoricalEntry.objects.create(entry_date=day, description='Deposit', posted_by=user)
+            HistoricalLine.objects.create(journal_entry=entry, account=account, debit_amount=amount, credit_amount=0)
+            HistoricalLine.objects.create(journal_entry=entry, account=equity, debit_amount=0, credit_amount=amount)
+            HistoricalBalance.objects.create(account=account, debit_total=amount, credit_total=0)
+
+        self.executor.loader.build_graph()
+        self.executor.migrate([('core', '0009_ledger_indexes')])
+
+        apps = self.executor.loader.project_state([('core', '0009_ledger_indexes')]).apps
+        HistoricalChart = apps.get_model('core', 'ChartOfAccount')
+        HistoricalLine = apps.get_model('core', 'JournalEntryLine')
+        HistoricalBalance = apps.get_model('core', 'AccountBalance')
+        HistoricalDailyBalance = apps.get_model('core', 'AccountDailyBalance')
+        self.assertEqual(list(HistoricalChart.objects.filter(account_number='1010').values_list('id', flat=True)), [cash.id])
+        self.assertEqual(HistoricalLine.objects.filter(account_id=cash.id).count(), 2)
+        self.assertEqual(HistoricalChart.objects.get(pk=child.id).parent_account_id, cash.id)
+        self.assertEqual(HistoricalBalance.objects.get(account_id=cash.id).debit_total, Decimal('150.00'))
+        # ردیف‌های روزانه مانده تجمعی پایان هر روز هستند
+        self.assertEqual(list(HistoricalDailyBalance.objects.filter(account_id=cash.id).order_by('date').values_list(
+            'date', 'debit_total', 'credit_total'
+        )), [
+            (date(2025, 1, 1), Decimal('100.00'), Decimal('0.00')),
+            (date(2025, 1, 2), Decimal('150.00'), Decimal('0.00')),
+        ])
+
+
+@skipUnless(connection.vendor == 'postgresql', "Row locks are only exercised on PostgreSQL")
+class ConcurrencyTests(TransactionTestCase):
+    """
+    چند کارگر (thread) همزمان روی حساب‌ها کار می‌کنند؛ هر کارگر اتصال دیتابیس خودش را دارد.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='concurrent', password='password123')
+        self.accounts = [
+            create_trading_account(self.user, f'Concurrent {i}', TradingAccount.CRYPTO, TradingAccount.SPOT)
+            for i in range(4)
+        ]
+        for trading_account in self.accounts:
+            make_deposit(trading_account, Decimal('1000.00'), "Initial capital", self.user)
+        self.btc = Asset.objects.create(symbol='BTC', name='Bitcoin', asset_type=Asset.SPOT)
+
+    def _run_workers(self, jobs):
+        """
+        هر تابع در jobs را در یک thread جداگانه اجرا کرده و خطاهای پیش‌بینی‌نشده را برمی‌گرداند.
+        """
+        errors = []
+        start = threading.Barrier(len(jobs))
+
+        def worker(job):
+            try:
+                start.wait()
+                job()
+            except Exception as e:  # خطاهای پیش‌بینی‌نشده (مثلا بن‌بست) باید تست را شکست دهند
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(job,)) for job in jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=60)
+        return errors
+
+    def test_concurrent_withdrawals_never_overdraw(self):
+        trading_account = self.accounts[0]
+        successes = []
+
+        def withdraw_repeatedly():
+            for _ in range(15):
+                try:
+                    make_withdrawal(trading_account, Decimal('30.00'), "Withdrawal", self.user)
+                    successes.append(1)
+                except ValueError:
+                    pass
+
+        self.assertEqual(self._run_workers([withdraw_repeatedly] * 6), [])
+        # 1000 / 30 = 33 برداشت موفق و 10 دلار باقی‌مانده
+        self.assertEqual(len(successes), 33)
+        self.assertEqual(get_cash_balance(trading_account), Decimal('10.00'))
+        self.assertEqual(rebuild_account_balances(dry_run=True), [])
+
+    def test_workers_skip_jobs_locked_by_other_workers(self):
+        first = submit_report_job(self.user, self.accounts[0], ReportJob.BALANCE_SHEET)
+        second = submit_report_job(self.user, self.accounts[1], ReportJob.BALANCE_SHEET)
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_first_job():
+            # worker دیگری که در حال برداشتن اولین کار است
+            with transaction.atomic():
+                ReportJob.objects.select_for_update().get(pk=first.pk)
+                locked.set()
+                release.wait(timeout=30)
+            connection.close()
+
+        holder = threading.Thread(target=hold_first_job)
+        holder.start()
+        try:
+            self.assertTrue(locked.wait(timeout=30))
+            claimed = claim_next_job('second-worker')
+        finally:
+            release.set()
+            holder.join(timeout=30)
+
+        self.assertEqual(claimed.pk, second.pk)
+        self.assertEqual(claim_next_job('second-worker').pk, first.pk)
+
+    def test_concurrent_retries_with_one_idempotency_key_post_once(self):
+        trading_account = self.accounts[0]
+        with translation.override('en'):
+            url = reverse('tradingaccount-deposit', args=[trading_account.id])
+        statuses = []
+
+        def retry_deposit():
+            client = Client()
+            client.force_login(self.user)
+            response = client.post(url, {'amount': '50.00'}, content_type='application/json',
+                                   headers={'Idempotency-Key': 'concurrent-deposit'})
+            statuses.append(response.status_code)
+
+        self.assertEqual(self._run_workers([retry_deposit] * 6), [])
+        self.assertEqual(statuses, [200] * 6)
+        self.assertEqual(get_cash_balance(trading_account), Decimal('1050.00'))
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_opposite_transfers_do_not_deadlock(self):
+        first, second = self.accounts[0], self.accounts[1]
+
+        def transfer(source, target):
+            def job():
+                for _ in range(20):
+                    transfer_funds_between_accounts(source, target, Decimal('5.00'), "Rebalance", self.user)
+            return job
+
+        self.assertEqual(self._run_workers([transfer(first, second), transfer(second, first)] * 2), [])
+        self.assertEqual(get_cash_balance(first), Decimal('1000.00'))
+        self.assertEqual(get_cash_balance(second), Decimal('1000.00'))
+
+    def test_concurrent_sells_consume_each_lot_once(self):
+        trading_account = self.accounts[0]
+        for _ in range(10):
+            execute_spot_buy(trading_account, self.btc, Decimal('1'), Decimal('50.00'), "DCA", self.user)
+        successes = []
+
+        def sell_repeatedly():
+            for _ in range(5):
+                try:
+                    execute_spot_sell(trading_account, self.btc, Decimal('0.5'), Decimal('30.00'), "Sell", self.user)
+                    successes.append(1)
+                except ValueError:
+                    pass
+
+        self.assertEqual(self._run_workers([sell_repeatedly] * 6), [])
+        self.assertEqual(len(successes), 20)
+        remaining = AssetLot.objects.filter(trading_account=trading_account).aggregate(total=Sum('remaining_quantity'))['total']
+        self.assertEqual(remaining, Decimal('0'))
+        self.assertEqual(get_account_balance(get_account(trading_account, '1020')), Decimal('0.00'))
+
+    def test_workers_on_other_accounts_are_not_blocked(self):
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            with transaction.atomic():
+                lock_trading_accounts(self.accounts[0])
+                locked.set()
+                release.wait(timeout=30)
+            connection.close()
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        try:
+            self.assertTrue(locked.wait(timeout=10))
+            # وقتی حساب اول قفل است، کارگرهای حساب‌های دیگر همزمان و بدون انتظار پیش می‌روند
+            errors = self._run_workers([
+                lambda account=account: make_withdrawal(account, Decimal('10.00'), "Withdrawal", self.user)
+                for account in self.accounts[1:]
+            ])
+            self.assertEqual(errors, [])
+            for account in self.accounts[1:]:
+                self.assertEqual(get_cash_balance(account), Decimal('990.00'))
+        finally:
+            release.set()
+            holder.join()
+
+    def test_throughput_scales_with_independent_accounts(self):
+        workers, rounds, hold = 8, 3, 0.1
+        accounts = self.accounts + [
+            create_trading_account(self.user, f'Concurrent {i}', TradingAccount.CRYPTO, TradingAccount.SPOT)
+            for i in range(len(self.accounts), workers)
+        ]
+        for trading_account in accounts[len(self.accounts):]:
+            make_deposit(trading_account, Decimal('1000.00'), "Initial capital", self.user)
+
+        def post_while_holding_lock(trading_account):
+            # قفل حساب در کل تراکنش نگه داشته می‌شود تا هر گونه سریال شدن بین کارگرها در زمان کل دیده شود
+            for _ in range(rounds):
+                with transaction.atomic():
+                    lock_trading_accounts(trading_account)
+                    time.sleep(hold)
+                    make_withdrawal(trading_account, Decimal('1.00'), "Withdrawal", self.user)
+
+        def elapsed(targets):
+            started = time.monotonic()
+            self.assertEqual(self._run_workers([
+                lambda account=account: post_while_holding_lock(account) for account in targets
+            ]), [])
+            return time.monotonic() - started
+
+        # کنترل: روی یک حساب مشترک کارگرها پشت سر هم اجرا می‌شوند و زمان با تعداد کارگرها خطی رشد می‌کند
+        serialized = elapsed([accounts[0]] * workers)
+        self.assertGreaterEqual(serialized, workers * rounds * hold)
+
+        parallel = elapsed(accounts)
+        # حساب‌های مستقل: زمان کل نزدیک زمان یک کارگر است، نه workers برابر آن
+        self.assertLess(parallel, workers * rounds * hold / 2)
+        for trading_account in accounts[1:]:
+            self.assertEqual(get_cash_balance(trading_account), Decimal('997.00'))
+        self.assertEqual(get_cash_balance(accounts[0]), Decimal('1000.00') - Decimal('1.00') * rounds * (workers + 1))
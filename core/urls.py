@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import TradeViewSet, UserViewSet, CurrencyViewSet, ChartOfAccountViewSet, JournalEntryViewSet, JournalEntryLineViewSet, TradingAccountViewSet, AssetViewSet, AssetLotViewSet
+from .views import TradeViewSet, UserViewSet, CurrencyViewSet, ChartOfAccountViewSet, JournalEntryViewSet, JournalEntryLineViewSet, TradingAccountViewSet, AssetViewSet, AssetLotViewSet, ReportJobViewSet
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
@@ -12,6 +12,7 @@ router.register(r'trading-accounts', TradingAccountViewSet)
 router.register(r'assets', AssetViewSet)
 router.register(r'asset-wallets', AssetLotViewSet)
 router.register(r'trades', TradeViewSet, basename='trade')
+router.register(r'report-jobs', ReportJobViewSet, basename='report-job')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,15 +1,16 @@
 # --- Imports from Django ---
 from django.shortcuts import get_object_or_404, redirect
-from datetime import datetime
+from datetime import date, datetime
 import decimal
+from django.core.exceptions import ImproperlyConfigured
 from django.db import transaction
-from django.utils import timezone
+from django.db.models import Exists, OuterRef, Prefetch, RestrictedError
+from django.http import StreamingHttpResponse
 from django.views.generic import TemplateView
-import re
 
 
 # --- Imports from Django REST Framework ---
-from rest_framework import viewsets, status
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
@@ -23,10 +24,17 @@ from .models import (
     JournalEntryLine, 
     TradingAccount, 
     Asset, 
-    Trade
+    Trade,
+    ReportJob
 )
 from .serializers import *
-from .services import Decimal, close_trade, generate_income_statement, make_deposit, make_withdrawal, deposit_spot_asset, open_trade, withdraw_spot_asset, execute_spot_buy, execute_spot_sell
+from .services import Decimal, close_trade, close_fiscal_period, generate_income_statement, generate_consolidated_income_statement, generate_consolidated_balance_sheet, cached_report, get_equity_curve, record_closed_trades_bulk, TradeImportError, make_deposit, make_withdrawal, deposit_spot_asset, open_trade, withdraw_spot_asset, execute_spot_buy, execute_spot_sell, reverse_spot_disposal
+from .analytics import generate_trade_analytics
+from .dates import filter_days
+from .exports import EXPORT_FORMATS, NDJSON, iter_ledger_sync, stream_ndjson
+from .idempotency import idempotent
+from .filters import choice_parser, date_range_fields, parse_bool
+from .pagination import AscendingIdCursorPagination
 from .permissions import IsAdminUser, IsAccountantUser, IsTraderUser
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -39,20 +47,76 @@ class CurrencyViewSet(viewsets.ModelViewSet):
     serializer_class = CurrencySerializer
     permission_classes = [IsAuthenticated]
 
+def _entries_of_trading_account(queryset, trading_account_id):
+    # سندی که حداقل یک آرتیکل در سرفصل‌های این حساب معاملاتی دارد (بدون DISTINCT روی join)
+    return queryset.filter(Exists(JournalEntryLine.objects.filter(
+        journal_entry=OuterRef('pk'), account__trading_account_id=trading_account_id
+    )))
+
+
+def _trades_in_date_range(bound):
+    # بازه روی خود ستون entry_date اعمال می‌شود تا ایندکس trade_account_status_idx قابل استفاده بماند
+    def apply(queryset, day):
+        if bound == 'start':
+            return filter_days(queryset, 'entry_date', start_date=day)
+        return filter_days(queryset, 'entry_date', end_date=day)
+    return apply
+
+
 class ChartOfAccountViewSet(viewsets.ModelViewSet):
     queryset = ChartOfAccount.objects.all()
     serializer_class = ChartOfAccountSerializer
     permission_classes = [IsAuthenticated, IsAccountantUser | IsAdminUser]
+    pagination_class = AscendingIdCursorPagination
+    filter_fields = {
+        'trading_account': ('trading_account_id', int),
+        'account_number': ('account_number', str),
+        # بدون ایندکس: سرفصل‌های هر حساب معاملاتی چند ده ردیف است و این دو فیلتر روی نتیجه trading_account اعمال می‌شوند
+        'account_type': ('account_type', str),
+        'is_active': ('is_active', parse_bool),
+    }
 
 class JournalEntryViewSet(viewsets.ModelViewSet):
-    queryset = JournalEntry.objects.all()
+    queryset = JournalEntry.objects.select_related('posted_by').prefetch_related(
+        Prefetch('journalentryline_set', queryset=JournalEntryLine.objects.select_related('account').order_by('id'))
+    )
     serializer_class = JournalEntrySerializer
     permission_classes = [IsAuthenticated, IsAccountantUser | IsAdminUser]
+    filter_fields = {
+        'trading_account': (_entries_of_trading_account, int),
+        'entry_type': ('entry_type', choice_parser(dict(JournalEntry.ENTRY_TYPE_CHOICES))),
+        **date_range_fields('entry_date'),
+    }
+
+    @action(detail=False, methods=['get'])
+    def stream(self, request):
+        """
+        همه اسناد با آرتیکل‌هایشان به صورت NDJSON (یک سند در هر خط) و به ترتیب شناسه، در یک پاسخ جریانی.
+        پارامترها: since_id (فقط اسناد با شناسه بزرگ‌تر؛ برای همگام‌سازی افزایشی) و trading_account.
+        اسنادی که کمتر از LEDGER_SYNC_LAG_SECONDS از درجشان گذشته (و همه اسناد بعد از آن‌ها) در درخواست بعدی می‌آیند.
+        """
+        try:
+            since_id = int(request.query_params['since_id']) if request.query_params.get('since_id') else None
+            trading_account_id = int(request.query_params['trading_account']) if request.query_params.get('trading_account') else None
+        except ValueError:
+            return Response({'error': 'since_id and trading_account must be integers.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return StreamingHttpResponse(
+            stream_ndjson(iter_ledger_sync(since_id, trading_account_id)),
+            content_type=EXPORT_FORMATS[NDJSON]
+        )
 
 class JournalEntryLineViewSet(viewsets.ModelViewSet):
-    queryset = JournalEntryLine.objects.all()
+    queryset = JournalEntryLine.objects.select_related('journal_entry', 'account')
     serializer_class = JournalEntryLineSerializer
     permission_classes = [IsAuthenticated, IsAccountantUser | IsAdminUser]
+    filter_fields = {
+        'trading_account': ('account__trading_account_id', int),
+        'account': ('account_id', int),
+        'account_number': ('account__account_number', str),
+        'journal_entry': ('journal_entry_id', int),
+        **date_range_fields('journal_entry__entry_date'),
+    }
 
 class TradingAccountViewSet(viewsets.ModelViewSet):
     queryset = TradingAccount.objects.all()
@@ -90,10 +154,141 @@ class TradingAccountViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        report_data = generate_income_statement(trading_account, start_date, end_date)
+        report_data = cached_report(
+            'income_statement', [trading_account], (start_date, end_date),
+            lambda: generate_income_statement(trading_account, start_date, end_date)
+        )
         
         return Response(report_data, status=status.HTTP_200_OK)
+
+    def _consolidation_accounts(self, request):
+        """
+        حساب‌های انتخاب شده برای گزارش تجمیعی؛ ids به صورت لیست جدا شده با کاما.
+        بدون ids همه حساب‌های قابل دسترس کاربر (برای مدیر همه حساب‌ها) انتخاب می‌شوند.
+        """
+        queryset = self.get_queryset()
+        ids = request.query_params.get('ids')
+        if ids:
+            queryset = queryset.filter(pk__in=[int(pk) for pk in ids.split(',') if pk.strip()])
+        return list(queryset.values_list('pk', flat=True))
+
+    @action(detail=False, methods=['get'])
+    def consolidated_income_statement(self, request):
+        """
+        صورت سود و زیان تجمیعی چند حساب معاملاتی.
+        مثال: /api/trading-accounts/consolidated_income_statement/?ids=1,2&start_date=2025-01-01&end_date=2025-12-31&per_account=1
+        """
+        try:
+            start_date = datetime.strptime(request.query_params.get('start_date', ''), '%Y-%m-%d').date()
+            end_date = datetime.strptime(request.query_params.get('end_date', ''), '%Y-%m-%d').date()
+            trading_account_ids = self._consolidation_accounts(request)
+        except ValueError:
+            return Response(
+                {'error': 'start_date and end_date (YYYY-MM-DD) are required and ids must be integers.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        per_account = request.query_params.get('per_account') == '1'
+        report_data = cached_report(
+            'consolidated_income_statement', trading_account_ids, (start_date, end_date, per_account),
+            lambda: generate_consolidated_income_statement(trading_account_ids, start_date, end_date, per_account=per_account)
+        )
+        return Response(report_data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'])
+    def consolidated_balance_sheet(self, request):
+        """
+        ترازنامه تجمیعی چند حساب معاملاتی؛ as_of اختیاری است.
+        مثال: /api/trading-accounts/consolidated_balance_sheet/?ids=1,2&as_of=2025-12-31&per_account=1
+        """
+        try:
+            as_of_str = request.query_params.get('as_of')
+            as_of = datetime.strptime(as_of_str, '%Y-%m-%d').date() if as_of_str else None
+            trading_account_ids = self._consolidation_accounts(request)
+        except ValueError:
+            return Response(
+                {'error': 'as_of must be in YYYY-MM-DD format and ids must be integers.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        per_account = request.query_params.get('per_account') == '1'
+        report_data = cached_report(
+            'consolidated_balance_sheet', trading_account_ids, (as_of, per_account),
+            lambda: generate_consolidated_balance_sheet(trading_account_ids, as_of=as_of, per_account=per_account)
+        )
+        return Response(report_data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'])
+    def trade_analytics(self, request, pk=None):
+        """
+        تحلیل عملکرد معاملات بسته این حساب (نرخ برد، امید ریاضی، افت سرمایه و تفکیک ماهانه/نمادی).
+        بازه اختیاری بر اساس تاریخ خروج: ?start_date=2025-01-01&end_date=2025-12-31
+        """
+        trading_account = self.get_object()
+        try:
+            start_date, end_date = (
+                datetime.strptime(request.query_params[name], '%Y-%m-%d').date() if request.query_params.get(name) else None
+                for name in ('start_date', 'end_date')
+            )
+        except ValueError:
+            return Response({'error': 'Dates must be in YYYY-MM-DD format.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            report_data = cached_report(
+                'trade_analytics', [trading_account], (start_date, end_date),
+                lambda: generate_trade_analytics(trading_account, start_date, end_date)
+            )
+        except ImproperlyConfigured as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(report_data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'])
+    def equity_curve(self, request, pk=None):
+        """
+        منحنی سرمایه روزانه این حساب؛ با interval=week یا month فقط سرمایه پایان هر هفته/ماه برگردانده می‌شود.
+        مثال: /api/trading-accounts/1/equity_curve/?start_date=2025-01-01&end_date=2025-12-31&interval=week
+        """
+        trading_account = self.get_object()
+        interval = request.query_params.get('interval', 'day')
+        try:
+            start_date, end_date = (
+                datetime.strptime(request.query_params[name], '%Y-%m-%d').date() if request.query_params.get(name) else None
+                for name in ('start_date', 'end_date')
+            )
+            report_data = cached_report(
+                'equity_curve', [trading_account], (start_date, end_date, interval),
+                lambda: get_equity_curve(trading_account, start_date, end_date, interval)
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report_data, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['post'])
+    @idempotent
+    def close_period(self, request, pk=None):
+        """
+        دوره مالی بعدی این حساب را تا end_date (YYYY-MM-DD) می‌بندد.
+        """
+        trading_account = self.get_object()
+        end_date_str = request.data.get('end_date')
+        if not end_date_str:
+            return Response({'error': 'end_date is required in YYYY-MM-DD format.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+            period = close_fiscal_period(trading_account, end_date, request.user)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'id': period.id,
+            'start_date': period.start_date,
+            'end_date': period.end_date,
+            'closing_entry_id': period.closing_entry_id,
+        }, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'])
+    @idempotent
     def withdraw_asset(self, request, pk=None):
         """
         اکشن سفارشی برای برداشت یک دارایی اسپات (کریپتو).
@@ -125,6 +320,7 @@ class TradingAccountViewSet(viewsets.ModelViewSet):
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
     @action(detail=True, methods=['post'])
+    @idempotent
     def deposit_asset(self, request, pk=None):
         """
         اکشن سفارشی برای واریز یک دارایی اسپات (کریپتو).
@@ -157,6 +353,7 @@ class TradingAccountViewSet(viewsets.ModelViewSet):
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
     @action(detail=True, methods=['post'])
+    @idempotent
     def withdraw(self, request, pk=None):
         """
         اکشن سفارشی برای برداشت وجه از یک حساب معاملاتی.
@@ -183,6 +380,7 @@ class TradingAccountViewSet(viewsets.ModelViewSet):
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def deposit(self, request, pk=None):
         trading_account = self.get_object()
         amount = request.data.get('amount')
@@ -213,6 +411,7 @@ class TradingAccountViewSet(viewsets.ModelViewSet):
     
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def execute_spot_buy(self, request, pk=None):
         """
         اکشن سفارشی برای اجرای یک معامله اسپات.
@@ -249,6 +448,7 @@ class TradingAccountViewSet(viewsets.ModelViewSet):
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def execute_spot_sell(self, request, pk=None):
         """
         اکشن سفارشی برای اجرای فروش یک دارایی اسپات.
@@ -269,7 +469,7 @@ class TradingAccountViewSet(viewsets.ModelViewSet):
                 trading_account=trading_account,
                 asset=asset,
                 quantity=decimal.Decimal(quantity),
-                trade_cost=decimal.Decimal(trade_cost),
+                sale_proceeds=decimal.Decimal(trade_cost),
                 description=description,
                 user=request.user
             )
@@ -289,29 +489,46 @@ class AssetLotViewSet(viewsets.ModelViewSet):
     queryset = AssetLot.objects.all()
     serializer_class = AssetLotSerializer
     permission_classes = [IsAuthenticated]
+    filter_fields = {
+        'trading_account': ('trading_account_id', int),
+        'asset': ('asset_id', int),
+        # open: دسته‌های دارای مانده (ایندکس جزئی assetlot_open_fifo_idx)، consumed: مصرف‌شده
+        'status': (
+            lambda queryset, value: queryset.filter(remaining_quantity__gt=0) if value == 'open' else queryset.filter(remaining_quantity=0),
+            choice_parser(('open', 'consumed'))
+        ),
+    }
 
     def get_queryset(self):
+        lots = AssetLot.objects.select_related('asset')
         if self.request.user.role == 'Admin':
-            return AssetLot.objects.all()
-        return AssetLot.objects.filter(trading_account__user=self.request.user)
+            return lots
+        return lots.filter(trading_account__user=self.request.user)
 
 
 class TradeViewSet(viewsets.ModelViewSet):
     """
     این ViewSet تمام عملیات مربوط به معاملات (باز کردن، بستن، مشاهده) را مدیریت می‌کند.
     """
-    queryset = Trade.objects.all().order_by('-entry_date')
+    queryset = Trade.objects.all()
     serializer_class = TradeSerializer
     permission_classes = [IsAuthenticated]
+    filter_fields = {
+        'trading_account': ('trading_account_id', int),
+        'status': ('status', choice_parser(dict(Trade.STATUS_CHOICES))),
+        'start_date': (_trades_in_date_range('start'), date.fromisoformat),
+        'end_date': (_trades_in_date_range('end'), date.fromisoformat),
+    }
 
     def get_queryset(self):
         """
         فقط معاملاتی را نشان می‌دهد که به کاربر لاگین کرده تعلق دارند.
         ادمین همه معاملات را می‌بیند.
         """
+        trades = Trade.objects.select_related('asset', 'trading_account')
         if self.request.user.role == 'Admin':
-            return Trade.objects.all().order_by('-entry_date')
-        return Trade.objects.filter(trading_account__user=self.request.user).order_by('-entry_date')
+            return trades
+        return trades.filter(trading_account__user=self.request.user)
 
     def perform_create(self, serializer):
         """
@@ -327,7 +544,30 @@ class TradeViewSet(viewsets.ModelViewSet):
             entry_price=data['entry_price']
         )
 
+    @action(detail=False, methods=['post'], url_path='bulk')
+    @idempotent
+    def bulk_import(self, request):
+        """
+        ورود گروهی معاملات بسته شده: بدنه درخواست آرایه‌ای از معاملات است.
+        اگر هر ردیفی نامعتبر باشد هیچ معامله‌ای ثبت نمی‌شود و خطاها به ترتیب ردیف‌ها برگردانده می‌شوند.
+        """
+        serializer = ClosedTradeImportSerializer(data=request.data, many=True)
+        if not serializer.is_valid():
+            return Response({'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        trading_accounts = TradingAccount.objects.all()
+        if request.user.role != 'Admin':
+            trading_accounts = trading_accounts.filter(user=request.user)
+        try:
+            trades = record_closed_trades_bulk(serializer.validated_data, trading_accounts=trading_accounts)
+        except TradeImportError as e:
+            # هم‌شکل با خطاهای serializer: {اندیس ردیف: خطاها} فقط برای ردیف‌های نامعتبر
+            errors = {index: {'non_field_errors': messages} for index, messages in e.errors.items()}
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'created': len(trades), 'ids': [trade.id for trade in trades]}, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['post'])
+    @idempotent
     def close(self, request, pk=None):
         """
         یک اکشن سفارشی برای بستن یک معامله باز.
@@ -337,15 +577,16 @@ class TradeViewSet(viewsets.ModelViewSet):
         trade_to_close = self.get_object()
         
         # داده‌های لازم برای بستن معامله را از بدنه درخواست می‌خوانیم
-        exit_price = request.data.get('exit_price')
+        gross_profit_or_loss = request.data.get('gross_profit_or_loss')
         broker_commission = request.data.get('broker_commission')
         trader_commission = request.data.get('trader_commission')
         commission_recipient_id = request.data.get('commission_recipient')
+        exit_description = request.data.get('exit_description', '')
 
         # اعتبارسنجی ورودی‌ها
-        if not all([exit_price, broker_commission, trader_commission, commission_recipient_id]):
+        if not all([gross_profit_or_loss, broker_commission, trader_commission, commission_recipient_id]):
             return Response(
-                {"error": "exit_price, broker_commission, trader_commission, and commission_recipient are required."},
+                {"error": "gross_profit_or_loss, broker_commission, trader_commission, and commission_recipient are required."},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
@@ -354,10 +595,11 @@ class TradeViewSet(viewsets.ModelViewSet):
             # فراخوانی سرویس بستن معامله
             closed_trade = close_trade(
                 trade_to_close=trade_to_close,
-                exit_price=Decimal(exit_price),
+                gross_profit_or_loss=Decimal(gross_profit_or_loss),
                 broker_commission=Decimal(broker_commission),
                 trader_commission=Decimal(trader_commission),
-                commission_recipient=recipient
+                commission_recipient=recipient,
+                exit_description=exit_description
             )
             # نمایش معامله به‌روز شده به کاربر
             serializer = self.get_serializer(closed_trade)
@@ -376,95 +618,108 @@ class DashboardView(TemplateView):
             context['trading_accounts'] = TradingAccount.objects.filter(user=self.request.user)
         return context
 
-import re
+class ReportJobViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    کارهای گزارش پس‌زمینه: ثبت (POST)، پیگیری وضعیت (GET) و دریافت نتیجه (download).
+    کارها توسط دستور run_report_worker اجرا می‌شوند.
+    """
+    serializer_class = ReportJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        if self.request.user.role == 'Admin':
+            return ReportJob.objects.all()
+        return ReportJob.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """
+        نتیجه کار تمام شده را به صورت فایل JSON برمی‌گرداند.
+        URL: GET /api/v1/report-jobs/{id}/download/
+        """
+        job = self.get_object()
+        if job.status != ReportJob.SUCCEEDED:
+            return Response(
+                {'status': job.status, 'error': job.error or 'The report is not ready yet.'},
+                status=status.HTTP_409_CONFLICT
+            )
+        response = Response(job.result, status=status.HTTP_200_OK)
+        response['Content-Disposition'] = f'attachment; filename="{job.report_type}-{job.pk}.json"'
+        return response
+
+
 from django.db import transaction
 
 from decimal import Decimal
 
 from django.contrib import messages
-from decimal import Decimal, InvalidOperation
 
 def journal_entry_delete(request, pk):
-    journal_entry = get_object_or_404(JournalEntry, pk=pk)
+    journal_entry = get_object_or_404(JournalEntry.objects.select_related('trade', 'asset_lot'), pk=pk)
     if request.method == 'POST':
-        with transaction.atomic():
-            # Check for Futures Trade by description
-            trade_id_match = re.search(r'Trade #(\d+)', journal_entry.description)
-            
-            # Check for Spot Asset purchase by looking at the accounts involved
-            is_spot_buy = journal_entry.journalentryline_set.filter(account__account_number='1020', debit_amount__gt=0).exists()
-
-            if trade_id_match:
-                # --- Handle Futures Trade Deletion ---
-                trade_id = int(trade_id_match.group(1))
-                try:
-                    trade_to_delete = Trade.objects.get(id=trade_id)
-                    related_journal_entries = JournalEntry.objects.filter(description__contains=f'Trade #{trade_id}')
-                    related_journal_entries.delete()
+        try:
+            with transaction.atomic():
+                if journal_entry.entry_type == JournalEntry.REVERSAL:
+                    # حذف سند برگشت، دفتر را به حالت قبل برمی‌گرداند ولی مقادیر بازگشته به دسته‌ها باقی می‌ماند
+                    raise ValueError(f"Journal entry #{pk} is a reversal and cannot be deleted.")
+                if journal_entry.reversals.exists():
+                    raise ValueError(f"Journal entry #{pk} has already been reversed and cannot be deleted.")
+
+                if journal_entry.trade_id:
+                    # --- Handle Futures Trade Deletion ---
+                    # اسناد معامله از طریق کلید خارجی trade پیدا می‌شوند (جستجوی ایندکس‌دار به جای LIKE روی شرح سند)
+                    trade_to_delete = journal_entry.trade
+                    trade_to_delete.journal_entries.all().delete()
                     trade_to_delete.delete()
-                    messages.success(request, f"Successfully deleted trade #{trade_id} and its associated journal entries.")
-                except Trade.DoesNotExist:
-                    journal_entry.delete() # Orphaned entry, just delete it
-
-            elif is_spot_buy:
-                # --- Handle Spot Asset Purchase Deletion (New, Safer Logic) ---
-                spot_buy_match = re.search(r'Spot Buy: ([\d.]+) (\w+)', journal_entry.description)
-                lot_deleted = False
-                if spot_buy_match:
-                    try:
-                        quantity = Decimal(spot_buy_match.group(1))
-                        asset_symbol = spot_buy_match.group(2)
-                        
-                        asset_holding_line = journal_entry.journalentryline_set.filter(account__account_number='1020').first()
-
-                        if asset_holding_line and quantity > 0:
-                            trade_cost = asset_holding_line.debit_amount
-                            trading_account = asset_holding_line.account.trading_account
-                            purchase_price = trade_cost / quantity
-
-                            # Build a highly precise filter
-                            matching_lots = AssetLot.objects.filter(
-                                trading_account=trading_account,
-                                asset__symbol=asset_symbol,
-                                quantity=quantity,
-                                purchase_price_usd=purchase_price,
-                                purchase_date__date=journal_entry.entry_date
-                            )
-
-                            # --- SAFETY CHECK --- #
-                            if matching_lots.count() == 1:
-                                matching_lots.first().delete()
-                                lot_deleted = True
-                            else:
-                                # If we find 0 or more than 1, we have an ambiguity.
-                                messages.warning(request, f"Could not uniquely identify the asset lot for journal entry #{journal_entry.id}. The journal entry was deleted, but the asset lot requires manual review.")
-
-                    except (InvalidOperation, IndexError):
-                        messages.error(request, f"Could not parse details from journal entry #{journal_entry.id} description.")
-                
-                journal_entry.delete()
-                if lot_deleted:
-                    messages.success(request, f"Journal entry #{journal_entry.id} and its associated asset lot were successfully deleted.")
+                    messages.success(request, f"Successfully deleted trade #{trade_to_delete.id} and its associated journal entries.")
+
+                elif journal_entry.asset_lot_id:
+                    # --- Handle Spot Asset Purchase/Deposit Deletion ---
+                    lot = journal_entry.asset_lot
+                    journal_entry.delete()
+
+                    # --- SAFETY CHECK --- #
+                    # دسته‌ای که بخشی از آن فروخته یا برداشت شده، قابل حذف خودکار نیست
+                    if lot.remaining_quantity == lot.quantity:
+                        lot.delete()
+                        messages.success(request, f"Journal entry #{pk} and its associated asset lot were successfully deleted.")
+                    else:
+                        messages.warning(request, f"The journal entry #{pk} was deleted, but its asset lot has already been partially consumed and requires manual review.")
+
+                elif journal_entry.entry_type in (JournalEntry.SPOT_SELL, JournalEntry.SPOT_WITHDRAWAL):
+                    # --- Handle Spot Sell/Withdrawal ---
+                    # حذف مستقیم، LotConsumption ها را بدون بازگرداندن مقدار دسته‌ها پاک می‌کرد؛ سند برگشت می‌خورد
+                    # تا مقادیر مصرف‌شده به همان دسته‌ها بازگردند
+                    reversal = reverse_spot_disposal(journal_entry, request.user if request.user.is_authenticated else None)
+                    messages.success(request, f"Journal entry #{pk} was reversed by entry #{reversal.id} and its asset quantities were restored.")
+
                 else:
-                    messages.info(request, f"Journal entry #{journal_entry.id} was deleted.")
+                    # --- Handle all other Journal Entries ---
+                    journal_entry.delete()
+                    messages.success(request, f"Journal entry #{pk} has been deleted.")
+        except ValueError as e:
+            # سند در یک دوره مالی بسته شده است
+            messages.error(request, str(e))
+        except RestrictedError:
+            # سند (یا سندی از همان معامله) سند برگشتی دارد که به آن ارجاع می‌دهد
+            messages.error(request, f"Journal entry #{pk} is referenced by a reversal entry and cannot be deleted.")
 
-            else:
-                # --- Handle all other Journal Entries ---
-                journal_entry.delete()
-                messages.success(request, f"Journal entry #{journal_entry.id} has been deleted.")
-                
         return redirect('transaction_history')
     return redirect('transaction_history')
 
 def trade_delete(request, pk):
     trade = get_object_or_404(Trade, pk=pk)
     if request.method == 'POST':
-        with transaction.atomic():
-            # Find journal entries related to this trade by looking for a unique identifier in the description
-            journal_entries = JournalEntry.objects.filter(description__contains=f'Trade #{trade.id}')
-            # Delete all related journal entries
-            journal_entries.delete()
-            # Delete the trade itself
-            trade.delete()
+        try:
+            with transaction.atomic():
+                # Delete all journal entries issued for this trade
+                trade.journal_entries.all().delete()
+                # Delete the trade itself
+                trade.delete()
+        except ValueError as e:
+            messages.error(request, str(e))
         return redirect('transaction_history')
-    return redirect('transaction_history')
\ No newline at end of file
+    return redirect('transaction_history')
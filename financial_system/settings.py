@@ -51,6 +51,9 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.TokenAuthentication',
         "rest_framework.authentication.SessionAuthentication",
     ],
+    # هیچ فهرستی بدون صفحه‌بندی برگردانده نمی‌شود؛ ViewSet ها فیلترهای خود را در filter_fields تعریف می‌کنند
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.IdCursorPagination',
+    'DEFAULT_FILTER_BACKENDS': ['core.filters.QueryParamFilterBackend'],
     # ... سایر تنظیمات شما
 }
 
@@ -102,6 +105,40 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# کش سرفصل‌ها و نتایج گزارش‌ها؛ بدون نیاز به سرویس خارجی.
+# کلید گزارش‌ها نسخه دفتر ذخیره شده در دیتابیس (TradingAccount.ledger_version) را دارد، پس LocMem در چند
+# پروسه هم گزارش کهنه برنمی‌گرداند؛ فقط هر پروسه کش جداگانه‌ای دارد. برای اشتراک نتایج بین پروسه‌ها
+# از backend فایلی استفاده کنید:
+#     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#     'LOCATION': BASE_DIR / 'cache',
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'financial-system',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    }
+}
+
+# مدت نگهداری گزارش‌های کش شده (ثانیه). با هر ثبت در دفتر یک حساب، گزارش‌های آن
+# بلافاصله بی‌اعتبار می‌شوند؛ این مقدار فقط حافظه ورودی‌های قدیمی را آزاد می‌کند.
+REPORT_CACHE_TIMEOUT = 3600
+
+# مدت نگهداری سرفصل‌های کش شده هر حساب معاملاتی (ثانیه)؛ سقف کهنگی در پروسه‌هایی که باطل شدن را نمی‌بینند
+CHART_CACHE_TIMEOUT = 300
+
+# مدت نگهداری کلیدهای Idempotency-Key (روز)؛ کلیدهای قدیمی‌تر با prune_idempotency_keys حذف می‌شوند
+IDEMPOTENCY_KEY_RETENTION_DAYS = 7
+
+# /journal-entries/stream/ اسنادی را که کمتر از این مدت (ثانیه) از درجشان گذشته ارسال نمی‌کند تا تراکنش‌های
+# هنوز commit نشده با شناسه کوچک‌تر جا نمانند؛ باید از طولانی‌ترین تراکنش ثبت سند بیشتر باشد
+LEDGER_SYNC_LAG_SECONDS = 60
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -1,5 +1,5 @@
 from django import forms
-from core.models import Trade, TradingAccount, Asset, User
+from core.models import Trade, TradingAccount, Asset, User, ChartOfAccount, JournalEntry
 from django.contrib.auth.forms import UserCreationForm
 
 class TradingAccountForm(forms.ModelForm):
@@ -46,6 +46,34 @@ class DirectClosedTradeForm(forms.ModelForm):
             self.fields['asset'].queryset = Asset.objects.filter(asset_type=Asset.DERIVATIVE)
             self.fields['commission_recipient'].queryset = User.objects.filter(role='Trader')
 
+class HistoryFilterForm(forms.Form):
+    """
+    فیلترهای صفحه تاریخچه؛ فقط حساب‌ها و سرفصل‌های خود کاربر قابل انتخاب هستند.
+    """
+    trading_account = forms.ModelChoiceField(queryset=TradingAccount.objects.none(), required=False)
+    account = forms.ModelChoiceField(queryset=ChartOfAccount.objects.none(), required=False)
+    start_date = forms.DateField(required=False)
+    end_date = forms.DateField(required=False)
+    min_amount = forms.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+    max_amount = forms.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+    entry_type = forms.ChoiceField(choices=[('', '---------')] + JournalEntry.ENTRY_TYPE_CHOICES, required=False)
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user')
+        super().__init__(*args, **kwargs)
+        self.fields['trading_account'].queryset = TradingAccount.objects.filter(user=user)
+        self.fields['account'].queryset = ChartOfAccount.objects.filter(trading_account__user=user)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date, end_date = cleaned_data.get('start_date'), cleaned_data.get('end_date')
+        if start_date and end_date and start_date > end_date:
+            raise forms.ValidationError("Start date must be before end date.")
+        min_amount, max_amount = cleaned_data.get('min_amount'), cleaned_data.get('max_amount')
+        if min_amount is not None and max_amount is not None and min_amount > max_amount:
+            raise forms.ValidationError("Minimum amount must not exceed maximum amount.")
+        return cleaned_data
+
 class CustomUserCreationForm(UserCreationForm):
     class Meta(UserCreationForm.Meta):
         model = User
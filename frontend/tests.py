@@ -1,3 +1,256 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.http import QueryDict
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone, translation
+
+from core.history import encode_cursor
+from core.models import TradingAccount
+from core.services import create_trading_account, get_account, make_deposit, make_withdrawal
+
+User = get_user_model()
+
+
+class TrialBalanceViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='trialuser', password='password123')
+        self.trading_account = create_trading_account(self.user, 'Trial Account', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        self.client.force_login(self.user)
+
+    def _url(self, name, *args):
+        # آدرس‌ها پیشوند زبان دارند؛ زبان فعال از تست‌های قبلی ممکن است en-us مانده باشد
+        with translation.override('en'):
+            return reverse(name, args=args)
+
+    def test_page_query_count_does_not_grow_with_history(self):
+        url = self._url('trial_balance') + f'?trading_account_id={self.trading_account.id}'
+        make_deposit(self.trading_account, Decimal('10.00'), "Deposit", self.user)
+        self.client.get(url)
+        # هر دو درخواست گزارش را دوباره محاسبه می‌کنند (بدون کش)
+        cache.clear()
+        with CaptureQueriesContext(connection) as baseline:
+            self.client.get(url)
+
+        for _ in range(30):
+            make_deposit(self.trading_account, Decimal('10.00'), "Deposit", self.user)
+        cache.clear()
+        with self.assertNumQueries(len(baseline)):
+            response = self.client.get(url)
+
+        self.assertNotContains(response, 'data-lines=')
+        self.assertContains(response, self._url('account_lines', get_account(self.trading_account, '1010').id))
+
+    def test_report_is_cached_until_next_posting(self):
+        url = self._url('trial_balance') + f'?trading_account_id={self.trading_account.id}'
+        make_deposit(self.trading_account, Decimal('10.00'), "Deposit", self.user)
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(url)
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get(url)
+
+        report_queries = [q for q in second.captured_queries if 'core_accountbalance' in q['sql']]
+        self.assertEqual(report_queries, [])
+        self.assertLess(len(second), len(first))
+
+        make_deposit(self.trading_account, Decimal('5.00'), "Deposit", self.user)
+        response = self.client.get(url)
+        cash = next(
+            child for root in response.context['root_accounts'] for child in root['children']
+            if child['object'].account_number == '1010'
+        )
+        self.assertEqual(cash['balance'], Decimal('15.00'))
+
+    def test_account_lines_are_paginated(self):
+        for i in range(60):
+            make_deposit(self.trading_account, Decimal('1.00'), f"Deposit {i}", self.user)
+        url = self._url('account_lines', get_account(self.trading_account, '1010').id)
+
+        first = self.client.get(url).json()
+        self.assertEqual(len(first['lines']), 50)
+        self.assertEqual(first['next_page'], 2)
+        self.assertEqual(first['lines'][0]['description'], "Deposit 0")
+
+        second = self.client.get(url, {'page': 2}).json()
+        self.assertEqual(len(second['lines']), 10)
+        self.assertIsNone(second['next_page'])
+
+    def test_account_lines_of_other_users_are_hidden(self):
+        other = User.objects.create_user(username='otheruser', password='password123')
+        other_account = create_trading_account(other, 'Other Account', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        response = self.client.get(self._url('account_lines', get_account(other_account, '1010').id))
+        self.assertEqual(response.status_code, 404)
+
+
+class ConsolidatedReportViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='groupviewuser', password='password123')
+        self.accounts = [
+            create_trading_account(self.user, f'Book {i}', TradingAccount.CRYPTO, TradingAccount.SPOT)
+            for i in range(2)
+        ]
+        for i, trading_account in enumerate(self.accounts):
+            make_deposit(trading_account, Decimal('100.00') * (i + 1), "Deposit", self.user)
+        other = User.objects.create_user(username='groupother', password='password123')
+        self.other_account = create_trading_account(other, 'Foreign Book', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        make_deposit(self.other_account, Decimal('1000.00'), "Deposit", other)
+        self.client.force_login(self.user)
+        with translation.override('en'):
+            self.url = reverse('consolidated_report')
+
+    def test_balance_sheet_consolidates_own_accounts(self):
+        response = self.client.get(self.url, {'report': 'balance_sheet', 'per_account': '1'})
+
+        report = response.context['report_data']
+        self.assertEqual(report['total_assets'], Decimal('300.00'))
+        self.assertEqual(report['total_assets_per_account'], [Decimal('100.00'), Decimal('200.00')])
+        self.assertContains(response, 'Book 1')
+        self.assertNotContains(response, 'Foreign Book')
+
+    def test_foreign_account_ids_are_ignored(self):
+        response = self.client.get(self.url, {
+            'report': 'balance_sheet',
+            'trading_account_id': [self.accounts[1].id, self.other_account.id],
+        })
+        self.assertEqual(response.context['report_data']['trading_account_ids'], [self.accounts[1].id])
+        self.assertEqual(response.context['report_data']['total_assets'], Decimal('200.00'))
+
+    def test_income_statement_requires_dates(self):
+        response = self.client.get(self.url, {'report': 'income_statement'})
+        self.assertNotIn('report_data', response.context)
+
+        today = timezone.now().date().isoformat()
+        response = self.client.get(self.url, {
+            'report': 'income_statement', 'start_date': today, 'end_date': today, 'per_account': '1'
+        })
+        self.assertEqual(response.context['report_data']['net_profit_loss_per_account'], [Decimal('0.00'), Decimal('0.00')])
+        self.assertContains(response, 'Book 0: 0.00')
+
+
+class ExportViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='exportviewuser', password='password123')
+        self.trading_account = create_trading_account(self.user, 'Export View Account', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        make_deposit(self.trading_account, Decimal('25.00'), "Deposit", self.user)
+        self.client.force_login(self.user)
+        with translation.override('en'):
+            self.url = reverse('history_export')
+
+    def test_streams_csv_attachment(self):
+        response = self.client.get(self.url, {'trading_account_id': self.trading_account.id, 'kind': 'journal', 'format': 'csv'})
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn(f'journal_{self.trading_account.id}.csv', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertIn('25.00', lines[1] + lines[2])
+
+    def test_rejects_foreign_accounts_and_bad_params(self):
+        other = User.objects.create_user(username='exportother', password='password123')
+        other_account = create_trading_account(other, 'Other Export', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        response = self.client.get(self.url, {'trading_account_id': other_account.id})
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.get(self.url, {'trading_account_id': self.trading_account.id, 'format': 'xlsx'})
+        self.assertEqual(response.status_code, 400)
+
+
+class HistoryViewTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='historyuser', password='password123')
+        self.trading_account = create_trading_account(self.user, 'History Account', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        self.client.force_login(self.user)
+        with translation.override('en'):
+            self.url = reverse('transaction_history')
+
+    def _walk(self, params=None):
+        seen, query, pages = [], dict(params or {}), 0
+        while True:
+            response = self.client.get(self.url, query)
+            seen.extend(entry.id for entry in response.context['journal_entries'])
+            pages += 1
+            if not response.context['next_page_query']:
+                return seen, pages
+            query = QueryDict(response.context['next_page_query'])
+
+    def test_pages_follow_cursor_without_gaps(self):
+        # همه اسناد در یک روز ثبت می‌شوند، پس ترتیب فقط با شناسه تعیین می‌شود
+        for i in range(120):
+            make_deposit(self.trading_account, Decimal('1.00') + i, f"Deposit {i}", self.user)
+
+        seen, pages = self._walk()
+        self.assertEqual(pages, 3)
+        self.assertEqual(len(seen), 120)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_later_pages_cost_the_same_as_the_first(self):
+        for i in range(110):
+            make_deposit(self.trading_account, Decimal('5.00'), f"Deposit {i}", self.user)
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get(self.url)
+        first_page_queries = len(first)
+        response = self.client.get(self.url, QueryDict(response.context['next_page_query']))
+        with self.assertNumQueries(first_page_queries):
+            self.client.get(self.url, QueryDict(response.context['next_page_query']))
+
+    def test_paging_one_tab_keeps_the_other_tabs_cursor(self):
+        for i in range(60):
+            make_deposit(self.trading_account, Decimal('1.00'), f"Deposit {i}", self.user)
+        trade_cursor = encode_cursor(timezone.now(), 1)
+
+        response = self.client.get(self.url, {'trade_cursor': trade_cursor, 'entry_type': 'DEPOSIT'})
+        next_query = QueryDict(response.context['next_page_query'])
+        self.assertEqual(next_query['trade_cursor'], trade_cursor)
+        self.assertEqual(next_query['entry_type'], 'DEPOSIT')
+        self.assertIn('cursor', next_query)
+
+        first_query = QueryDict(response.context['first_page_query'])
+        self.assertNotIn('cursor', first_query)
+        self.assertNotIn('trade_cursor', first_query)
+        self.assertEqual(first_query['entry_type'], 'DEPOSIT')
+
+    def test_filters(self):
+        cash_account = get_account(self.trading_account, '1010')
+        make_deposit(self.trading_account, Decimal('10.00'), "Small", self.user)
+        make_deposit(self.trading_account, Decimal('500.00'), "Large", self.user)
+        make_withdrawal(self.trading_account, Decimal('20.00'), "Withdraw", self.user)
+
+        response = self.client.get(self.url, {'min_amount': '100', 'max_amount': '1000'})
+        self.assertEqual([e.description for e in response.context['journal_entries']], ["Large"])
+
+        response = self.client.get(self.url, {'entry_type': 'WITHDRAWAL'})
+        self.assertEqual([e.description for e in response.context['journal_entries']], ["Withdraw"])
+
+        response = self.client.get(self.url, {
+            'trading_account': self.trading_account.id, 'account': cash_account.id, 'max_amount': '15',
+        })
+        self.assertEqual([e.description for e in response.context['journal_entries']], ["Small"])
+
+        tomorrow = (timezone.now().date() + timedelta(days=1)).isoformat()
+        response = self.client.get(self.url, {'start_date': tomorrow})
+        self.assertEqual(response.context['journal_entries'], [])
+
+    def test_other_users_entries_and_accounts_are_excluded(self):
+        other = User.objects.create_user(username='historyother', password='password123')
+        other_account = create_trading_account(other, 'Other History', TradingAccount.CRYPTO, TradingAccount.SPOT)
+        make_deposit(other_account, Decimal('75.00'), "Foreign", other)
+        make_deposit(self.trading_account, Decimal('5.00'), "Mine", self.user)
+
+        response = self.client.get(self.url)
+        self.assertEqual([e.description for e in response.context['journal_entries']], ["Mine"])
+
+        # فیلتر روی حساب کاربر دیگر نامعتبر است و نادیده گرفته می‌شود
+        response = self.client.get(self.url, {'trading_account': other_account.id})
+        self.assertEqual([e.description for e in response.context['journal_entries']], ["Mine"])
 
-# Create your tests here.
+        self.assertEqual(self.client.get(self.url, {'cursor': 'garbage'}).status_code, 404)
@@ -7,7 +7,7 @@ from .views import (
     TransferFundsView, CurrencyListView, CurrencyCreateView, CurrencyUpdateView, 
     CurrencyDeleteView, AssetListView, AssetCreateView, AssetUpdateView, AssetDeleteView,
     ChartOfAccountListView, ChartOfAccountCreateView, ChartOfAccountUpdateView, 
-    ChartOfAccountDeleteView, BalanceSheetView, FundManagementView,OpenTradesListView,TrialBalanceView, RegisterView
+    ChartOfAccountDeleteView, BalanceSheetView, FundManagementView,OpenTradesListView,TrialBalanceView, AccountLinesView, ConsolidatedReportView, ExportView, RegisterView
 )
 
 urlpatterns = [
@@ -22,6 +22,7 @@ urlpatterns = [
     path('trade/deposit-spot/', DepositSpotAssetView.as_view(), name='deposit_spot_asset'),
     path('trade/withdraw-spot/', WithdrawSpotAssetView.as_view(), name='withdraw_spot_asset'),
     path('history/', HistoryView.as_view(), name='transaction_history'),
+    path('history/export/', ExportView.as_view(), name='history_export'),
     path('login/', LoginView.as_view(), name='login'),
     path('logout/', logout_view, name='logout'),
     path('create-trading-account/', CreateTradingAccountView.as_view(), name='create_trading_account'),
@@ -48,6 +49,8 @@ urlpatterns = [
     path('trades/record-closed/', DirectClosedTradeView.as_view(), name='record_direct_closed_trade'),
     path('balance-sheet/', BalanceSheetView.as_view(), name='balance_sheet'),
     path('trial-balance/', TrialBalanceView.as_view(), name='trial_balance'),
+    path('trial-balance/accounts/<int:pk>/lines/', AccountLinesView.as_view(), name='account_lines'),
+    path('consolidated-reports/', ConsolidatedReportView.as_view(), name='consolidated_report'),
     path('spot-assets/', SpotAssetListView.as_view(), name='spot_asset_list'),
     path('journal-entry/<int:pk>/delete/', journal_entry_delete, name='journal_entry_delete'),
     path('trade/<int:pk>/delete/', trade_delete, name='trade_delete'),
@@ -27,14 +27,21 @@ from core.services import (
     execute_spot_sell,
     calculate_unrealized_pnl,
     transfer_funds_between_accounts,
-    record_direct_closed_trade
+    record_direct_closed_trade,
+    get_account_totals,
+    generate_consolidated_income_statement,
+    generate_consolidated_balance_sheet,
+    cached_report
 )
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import HttpResponseRedirect
+from django.core.paginator import Paginator
+from django.http import Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from datetime import datetime
-from .forms import OpenTradeForm, TradingAccountForm,CloseTradeForm,DirectClosedTradeForm, CustomUserCreationForm
+from core.exports import EXPORT_FORMATS, EXPORT_KINDS, stream_export, export_filename
+from core.history import journal_entry_page, trade_page
+from .forms import OpenTradeForm, TradingAccountForm,CloseTradeForm,DirectClosedTradeForm, CustomUserCreationForm, HistoryFilterForm
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
@@ -415,31 +422,95 @@ class TradeSellView(View):
         return render(request, 'trade.html', {'trading_accounts': trading_accounts, 'assets': assets})
 
 class HistoryView(LoginRequiredMixin, TemplateView):
+    """
+    تاریخچه اسناد و معاملات با صفحه‌بندی keyset روی (entry_date, id) و فیلتر حساب، بازه تاریخ، مبلغ و نوع سند.
+    هر صفحه (اول یا صدم) با تعداد ثابتی پرس‌وجو ساخته می‌شود.
+    """
     template_name = 'history.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.request.user
+        params = self.request.GET
+
+        user_trading_accounts = list(TradingAccount.objects.filter(user=user).order_by('name'))
+        filter_form = HistoryFilterForm(params or None, user=user)
+        filters = {}
+        if filter_form.is_bound:
+            if filter_form.is_valid():
+                filters = filter_form.cleaned_data
+            else:
+                messages.error(self.request, "Invalid history filters were ignored.")
 
-        # Fetch Journal Entries related to the user's trading accounts
-        user_trading_accounts = TradingAccount.objects.filter(user=user)
-        
-        # Get the ChartOfAccount instances linked to these trading accounts
-        user_chart_of_accounts = ChartOfAccount.objects.filter(trading_account__in=user_trading_accounts)
-
-        # Get the journal entries from these accounts
-        context['journal_entries'] = JournalEntry.objects.filter(
-            journalentryline__account__in=user_chart_of_accounts
-        ).distinct().order_by('-entry_date', '-id').prefetch_related('journalentryline_set__account')
-        
-        # Fetch Closed Trades related to the user's trading accounts
-        context['all_trades'] = Trade.objects.filter(
-            trading_account__in=user_trading_accounts
-        ).order_by('-entry_date').select_related('asset', 'trading_account')
-
+        try:
+            journal_entries, next_cursor = journal_entry_page(
+                user, cursor=params.get('cursor'),
+                trading_account=filters.get('trading_account'), account=filters.get('account'),
+                start_date=filters.get('start_date'), end_date=filters.get('end_date'),
+                min_amount=filters.get('min_amount'), max_amount=filters.get('max_amount'),
+                entry_type=filters.get('entry_type'),
+            )
+            all_trades, next_trade_cursor = trade_page(
+                user, cursor=params.get('trade_cursor'), trading_account=filters.get('trading_account'),
+                start_date=filters.get('start_date'), end_date=filters.get('end_date'),
+            )
+        except ValueError:
+            raise Http404("Invalid history cursor.")
+
+        context['journal_entries'] = journal_entries
+        context['all_trades'] = all_trades
+        context['next_page_query'] = self._page_query(cursor=next_cursor) if next_cursor else None
+        context['next_trade_page_query'] = self._page_query(trade_cursor=next_trade_cursor) if next_trade_cursor else None
+        context['first_page_query'] = self._page_query(cursor=None, trade_cursor=None)
+        context['is_first_page'] = not params.get('cursor') and not params.get('trade_cursor')
+        context['filters'] = filters
+        # سرفصل‌ها فقط برای حساب معاملاتی انتخاب شده فهرست می‌شوند
+        context['filter_accounts'] = (
+            ChartOfAccount.objects.filter(trading_account=filters['trading_account']).order_by('account_number')
+            if filters.get('trading_account') else []
+        )
+        context['entry_types'] = JournalEntry.ENTRY_TYPE_CHOICES
+        context['trading_accounts'] = user_trading_accounts
         context['title'] = 'Transaction History'
         return context
 
+    def _page_query(self, **cursors):
+        # فیلترها و cursor زبانه دیگر در لینک صفحه‌ها حفظ می‌شوند؛ فقط cursor داده شده جایگزین (یا با None حذف) می‌شود
+        query = self.request.GET.copy()
+        for name, cursor in cursors.items():
+            query.pop(name, None)
+            if cursor is not None:
+                query[name] = cursor
+        return query.urlencode()
+
+class ExportView(LoginRequiredMixin, View):
+    """
+    خروجی جریانی (CSV یا NDJSON) اسناد یا معاملات یک حساب معاملاتی در یک بازه تاریخ.
+    داده‌ها دسته به دسته از دیتابیس خوانده و بلافاصله نوشته می‌شوند (حافظه ثابت).
+    """
+
+    def get(self, request):
+        trading_account = get_object_or_404(TradingAccount, id=request.GET.get('trading_account_id') or 0, user=request.user)
+        kind = request.GET.get('kind', EXPORT_KINDS[0])
+        export_format = request.GET.get('format', 'csv')
+        if kind not in EXPORT_KINDS or export_format not in EXPORT_FORMATS:
+            return JsonResponse({'error': 'Unknown export kind or format.'}, status=400)
+
+        try:
+            start_date = datetime.strptime(request.GET['start_date'], '%Y-%m-%d').date() if request.GET.get('start_date') else None
+            end_date = datetime.strptime(request.GET['end_date'], '%Y-%m-%d').date() if request.GET.get('end_date') else None
+        except ValueError:
+            return JsonResponse({'error': 'Dates must be in YYYY-MM-DD format.'}, status=400)
+
+        response = StreamingHttpResponse(
+            stream_export(kind, export_format, trading_account, start_date, end_date),
+            content_type=EXPORT_FORMATS[export_format]
+        )
+        filename = export_filename(kind, export_format, trading_account, start_date, end_date)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
 class LoginView(View):
     def get(self, request):
         return render(request, 'login.html')
@@ -538,7 +609,10 @@ class IncomeStatementView(TemplateView):
                     start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
                     end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
                     
-                    report_data = generate_income_statement(selected_account, start_date, end_date)
+                    report_data = cached_report(
+                        'income_statement', [selected_account], (start_date, end_date),
+                        lambda: generate_income_statement(selected_account, start_date, end_date)
+                    )
                     context['report_data'] = report_data
                     context['selected_account'] = selected_account
                     context['start_date'] = start_date
@@ -682,6 +756,20 @@ class ChartOfAccountUpdateView(UpdateView):
     success_url = reverse_lazy('chartofaccount_list')
 
 
+def _parse_as_of_date(request):
+    """
+    تاریخ گزارش (as_of) را از query string می‌خواند؛ اگر خالی یا نامعتبر باشد None برمی‌گرداند.
+    """
+    as_of_str = request.GET.get('as_of')
+    if not as_of_str:
+        return None
+    try:
+        return datetime.strptime(as_of_str, '%Y-%m-%d').date()
+    except ValueError:
+        messages.error(request, 'Invalid date format. Please use YYYY-MM-DD.')
+        return None
+
+
 class BalanceSheetView(LoginRequiredMixin, TemplateView):
     template_name = 'balance_sheet.html'
 
@@ -695,72 +783,66 @@ class BalanceSheetView(LoginRequiredMixin, TemplateView):
         if selected_account_id:
             selected_account = get_object_or_404(TradingAccount, id=selected_account_id, user=user)
             context['selected_account'] = selected_account
-            context['report_date'] = timezone.now()
+            as_of = _parse_as_of_date(self.request)
+            context['as_of'] = as_of
+            context['report_date'] = as_of or timezone.now()
 
-            # --- شروع منطق جدید و اصلاح شده ---
+            context.update(cached_report(
+                'balance_sheet', [selected_account], (as_of,),
+                lambda: self.build_report(selected_account, as_of)
+            ))
 
-            # ۱. دریافت تمام حساب‌های مربوط به این حساب معاملاتی
-            accounts = ChartOfAccount.objects.filter(trading_account=selected_account)
-
-            # ۲. محاسبه موجودی برای هر حساب به صورت بهینه
-            # ما یک دیکشنری برای نگهداری موجودی‌ها می‌سازیم
-            account_balances = {}
-            lines = JournalEntryLine.objects.filter(account__in=accounts)
+        return context
 
-            # محاسبه مجموع بدهکار و بستانکار برای همه حساب‌ها در یک کوئری
-            balances_data = lines.values('account_id').annotate(
-                total_debit=Sum('debit_amount'),
-                total_credit=Sum('credit_amount')
-            )
+    def build_report(self, selected_account, as_of):
+        """
+        مانده‌های ترازنامه را محاسبه می‌کند؛ نتیجه با نسخه دفتر حساب کش می‌شود.
+        """
+        # --- شروع منطق جدید و اصلاح شده ---
 
-            for balance_info in balances_data:
-                account_balances[balance_info['account_id']] = {
-                    'debit': balance_info['total_debit'] or 0,
-                    'credit': balance_info['total_credit'] or 0
-                }
+        # ۱. دریافت تمام حساب‌های مربوط به این حساب معاملاتی
+        accounts = ChartOfAccount.objects.filter(trading_account=selected_account)
 
-            # ۳. دسته‌بندی حساب‌ها و تزریق موجودی محاسبه شده به هر حساب
-            asset_accounts = []
-            liability_accounts = []
-            equity_accounts = []
-            
-            for acc in accounts:
-                balance_info = account_balances.get(acc.id, {'debit': 0, 'credit': 0})
-                debit_total = balance_info['debit']
-                credit_total = balance_info['credit']
-
-                # محاسبه موجودی نهایی بر اساس نوع حساب
-                if acc.account_type in [ASSET, EXPENSE]:
-                    acc.balance = debit_total - credit_total
-                else: # LIABILITY, EQUITY, REVENUE
-                    acc.balance = credit_total - debit_total
-
-                # اضافه کردن به لیست مربوطه
-                if acc.account_type == ASSET:
-                    asset_accounts.append(acc)
-                elif acc.account_type == LIABILITY:
-                    liability_accounts.append(acc)
-                elif acc.account_type == EQUITY:
-                    equity_accounts.append(acc)
-
-            # ۴. محاسبه مجموع کل
-            total_assets = sum(acc.balance for acc in asset_accounts)
-            total_liabilities = sum(acc.balance for acc in liability_accounts)
-            total_equity = sum(acc.balance for acc in equity_accounts)
-            # --- پایان منطق جدید ---
-
-            context['asset_accounts'] = asset_accounts
-            context['liability_accounts'] = liability_accounts
-            context['equity_accounts'] = equity_accounts
-            context['total_assets'] = total_assets
-            context['total_liabilities'] = total_liabilities
-            context['total_equity'] = total_equity
-            context['total_liabilities_and_equity'] = total_liabilities + total_equity
+        # ۲. خواندن مانده همه حساب‌ها در یک کوئری (مانده جاری یا مانده روزانه تاریخ گزارش)
+        account_balances = get_account_totals(selected_account, as_of=as_of)
 
-        return context
-
-from django.core.serializers.json import DjangoJSONEncoder
-import json
+        # ۳. دسته‌بندی حساب‌ها و تزریق موجودی محاسبه شده به هر حساب
+        asset_accounts = []
+        liability_accounts = []
+        equity_accounts = []
+        
+        for acc in accounts:
+            debit_total, credit_total = account_balances.get(acc.id, (0, 0))
+
+            # محاسبه موجودی نهایی بر اساس نوع حساب
+            if acc.account_type in [ASSET, EXPENSE]:
+                acc.balance = debit_total - credit_total
+            else: # LIABILITY, EQUITY, REVENUE
+                acc.balance = credit_total - debit_total
+
+            # اضافه کردن به لیست مربوطه
+            if acc.account_type == ASSET:
+                asset_accounts.append(acc)
+            elif acc.account_type == LIABILITY:
+                liability_accounts.append(acc)
+            elif acc.account_type == EQUITY:
+                equity_accounts.append(acc)
+
+        # ۴. محاسبه مجموع کل
+        total_assets = sum(acc.balance for acc in asset_accounts)
+        total_liabilities = sum(acc.balance for acc in liability_accounts)
+        total_equity = sum(acc.balance for acc in equity_accounts)
+        # --- پایان منطق جدید ---
+
+        return {
+            'asset_accounts': asset_accounts,
+            'liability_accounts': liability_accounts,
+            'equity_accounts': equity_accounts,
+            'total_assets': total_assets,
+            'total_liabilities': total_liabilities,
+            'total_equity': total_equity,
+            'total_liabilities_and_equity': total_liabilities + total_equity,
+        }
 
 class TrialBalanceView(LoginRequiredMixin, TemplateView):
     template_name = 'trial_balance.html'
@@ -775,53 +857,154 @@ class TrialBalanceView(LoginRequiredMixin, TemplateView):
         if selected_account_id:
             selected_account = get_object_or_404(TradingAccount, id=selected_account_id, user=user)
             context['selected_account'] = selected_account
+            as_of = _parse_as_of_date(self.request)
+            context['as_of'] = as_of
+
+            context['root_accounts'] = cached_report(
+                'trial_balance', [selected_account], (as_of,),
+                lambda: self.build_report(selected_account, as_of)
+            )
 
-            accounts = ChartOfAccount.objects.filter(trading_account=selected_account).prefetch_related('journalentryline_set__journal_entry')
+        return context
+
+    def build_report(self, selected_account, as_of):
+        """
+        درخت سرفصل‌ها با جمع بدهکار/بستانکار؛ نتیجه با نسخه دفتر حساب کش می‌شود.
+        """
+        # جمع بدهکار/بستانکار همه سرفصل‌ها با یک پرس‌وجو؛ آرتیکل‌ها فقط هنگام باز کردن
+        # یک سرفصل از طریق AccountLinesView خوانده می‌شوند
+        accounts = ChartOfAccount.objects.filter(trading_account=selected_account).order_by('account_number')
+        account_totals = get_account_totals(selected_account, as_of=as_of)
+        
+        account_details = {}
+        for acc in accounts:
+            total_debit, total_credit = account_totals.get(acc.id, (0, 0))
             
-            account_details = {}
-            for acc in accounts:
-                lines = acc.journalentryline_set.all()
-                total_debit = lines.aggregate(Sum('debit_amount'))['debit_amount__sum'] or 0
-                total_credit = lines.aggregate(Sum('credit_amount'))['credit_amount__sum'] or 0
-                
-                balance = 0
-                if acc.account_type in [ASSET, EXPENSE]:
-                    balance = total_debit - total_credit
-                else: # LIABILITY, EQUITY, REVENUE
-                    balance = total_credit - total_debit
-
-                # Serialize the lines into a list of dictionaries
-                lines_data = []
-                for line in lines:
-                    lines_data.append({
-                        'date': line.journal_entry.entry_date.strftime('%Y-%m-%d'),
-                        'description': line.journal_entry.description,
-                        'debit': str(line.debit_amount),
-                        'credit': str(line.credit_amount)
-                    })
-
-                account_details[acc.id] = {
-                    'object': acc,
-                    'debit': total_debit,
-                    'credit': total_credit,
-                    'balance': balance,
-                    'lines_json': json.dumps(lines_data, cls=DjangoJSONEncoder), # Pass a JSON string
-                    'children': []
-                }
+            balance = 0
+            if acc.account_type in [ASSET, EXPENSE]:
+                balance = total_debit - total_credit
+            else: # LIABILITY, EQUITY, REVENUE
+                balance = total_credit - total_debit
+
+            account_details[acc.id] = {
+                'object': acc,
+                'debit': total_debit,
+                'credit': total_credit,
+                'balance': balance,
+                'children': []
+            }
+
+        # Build the hierarchy
+        root_accounts = []
+        for acc_id, details in account_details.items():
+            parent_id = details['object'].parent_account_id
+            if parent_id in account_details:
+                account_details[parent_id]['children'].append(details)
+            else:
+                root_accounts.append(details)
+
+        return root_accounts
 
-            # Build the hierarchy
-            root_accounts = []
-            for acc_id, details in account_details.items():
-                parent_id = details['object'].parent_account_id
-                if parent_id in account_details:
-                    account_details[parent_id]['children'].append(details)
-                else:
-                    root_accounts.append(details)
 
-            context['root_accounts'] = root_accounts
+class ConsolidatedReportView(LoginRequiredMixin, TemplateView):
+    """
+    صورت سود و زیان یا ترازنامه تجمیعی چند حساب معاملاتی.
+    کاربر عادی از بین حساب‌های خودش انتخاب می‌کند و مدیر (Admin) از بین همه حساب‌ها؛
+    اگر حسابی انتخاب نشود، همه حساب‌های قابل دسترس تجمیع می‌شوند.
+    """
+    template_name = 'consolidated_report.html'
+    INCOME_STATEMENT = 'income_statement'
+    BALANCE_SHEET = 'balance_sheet'
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        user = self.request.user
+        trading_accounts = TradingAccount.objects.order_by('name', 'id')
+        if user.role != 'Admin':
+            trading_accounts = trading_accounts.filter(user=user)
+        trading_accounts = list(trading_accounts)
+        context['trading_accounts'] = trading_accounts
+
+        report_type = self.request.GET.get('report', self.INCOME_STATEMENT)
+        if report_type not in (self.INCOME_STATEMENT, self.BALANCE_SHEET):
+            report_type = self.INCOME_STATEMENT
+        per_account = self.request.GET.get('per_account') == '1'
+        context['report_type'] = report_type
+        context['per_account'] = per_account
+
+        selected_ids = set()
+        for value in self.request.GET.getlist('trading_account_id'):
+            if value.isdigit():
+                selected_ids.add(int(value))
+        selected = [acc for acc in trading_accounts if acc.id in selected_ids] or trading_accounts
+        context['selected_ids'] = selected_ids
+        if not selected or 'report' not in self.request.GET:
+            return context
+
+        if report_type == self.BALANCE_SHEET:
+            as_of = _parse_as_of_date(self.request)
+            context['as_of'] = as_of
+            context['report_date'] = as_of or timezone.now()
+            report_data = cached_report(
+                'consolidated_balance_sheet', selected, (as_of, per_account),
+                lambda: generate_consolidated_balance_sheet(selected, as_of=as_of, per_account=per_account)
+            )
+        else:
+            try:
+                start_date = datetime.strptime(self.request.GET.get('start_date', ''), '%Y-%m-%d').date()
+                end_date = datetime.strptime(self.request.GET.get('end_date', ''), '%Y-%m-%d').date()
+            except ValueError:
+                messages.error(self.request, 'Invalid date format. Please use YYYY-MM-DD.')
+                return context
+            context['start_date'] = start_date
+            context['end_date'] = end_date
+            report_data = cached_report(
+                'consolidated_income_statement', selected, (start_date, end_date, per_account),
+                lambda: generate_consolidated_income_statement(selected, start_date, end_date, per_account=per_account)
+            )
+
+        accounts_by_id = {acc.id: acc for acc in selected}
+        context['report_accounts'] = [accounts_by_id[pk] for pk in report_data['trading_account_ids']]
+        if per_account and report_type == self.INCOME_STATEMENT:
+            context['net_per_account'] = list(zip(context['report_accounts'], report_data['net_profit_loss_per_account']))
+        context['report_data'] = report_data
         return context
 
+
+class AccountLinesView(LoginRequiredMixin, View):
+    """
+    آرتیکل‌های یک سرفصل را به صورت صفحه‌بندی شده (JSON) برمی‌گرداند.
+    صفحه تراز آزمایشی هنگام باز کردن هر سرفصل این آدرس را صدا می‌زند.
+    """
+    paginate_by = 50
+
+    def get(self, request, pk):
+        account = get_object_or_404(ChartOfAccount, pk=pk, trading_account__user=request.user)
+
+        lines = JournalEntryLine.objects.filter(account=account).select_related('journal_entry').order_by(
+            'journal_entry__entry_date', 'journal_entry_id', 'id'
+        )
+        as_of = _parse_as_of_date(request)
+        if as_of:
+            lines = lines.filter(journal_entry__entry_date__lte=as_of)
+
+        page = Paginator(lines, self.paginate_by).get_page(request.GET.get('page'))
+        return JsonResponse({
+            'account': account.display_name,
+            'page': page.number,
+            'num_pages': page.paginator.num_pages,
+            'next_page': page.next_page_number() if page.has_next() else None,
+            'lines': [
+                {
+                    'date': line.journal_entry.entry_date.strftime('%Y-%m-%d'),
+                    'description': line.journal_entry.description,
+                    'debit': str(line.debit_amount),
+                    'credit': str(line.credit_amount)
+                }
+                for line in page
+            ],
+        })
+
 class ChartOfAccountDeleteView(DeleteView):
     model = ChartOfAccount
     template_name = 'chartofaccount_confirm_delete.html'